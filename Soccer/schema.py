@@ -21,8 +21,21 @@ class OrderedSchemaGenerator(OpenAPISchemaGenerator):
             "player_update",
             "delete_user",
             "transfer_list",
+            "bulk_list_player",
+            "bulk_reprice_player",
+            "bulk_delist_player",
             "market_list",
+            "market_stats",
+            "leaderboard",
+            "recommend_players",
+            "price_suggestion",
             "buy_player",
+            "bulk_buy_player",
+            "place_bid",
+            "cancel_bid",
+            "trades",
+            "batch",
+            "metrics",
         ]
 
         for endpoint in endpoint_order:
@@ -51,6 +51,8 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "api.invalidation.InvalidationMiddleware",
+    "api.listing_expiry.ListingSweeperMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -143,3 +145,112 @@ SWAGGER_SETTINGS = {
         "Token": {"type": "apiKey", "in": "header", "name": "Authorization"}
     },
 }
+
+# Request coalescing for hot read endpoints (seconds a follower waits for
+# the in-flight computation before running the query itself)
+
+COALESCING_TIMEOUT = 5.0
+COALESCING_MAX_TRACKED_KEYS = 1000
+
+# Serve unsearched market list queries from the in-process sorted index
+
+MARKET_INDEX_ENABLED = False
+
+# File the shared memory-mapped market snapshot is published to. When set,
+# every worker serves unsearched market list queries from that snapshot.
+# Market changes are gathered for MARKET_SNAPSHOT_DELAY seconds and written
+# once by a background thread.
+
+MARKET_SNAPSHOT_PATH = None
+MARKET_SNAPSHOT_DELAY = 0.5
+
+# Cross-process cache invalidation. Generations are checked at most once per
+# INVALIDATION_CHECK_INTERVAL seconds (0 means on every request); setting
+# INVALIDATION_SOCKET_DIR also pushes invalidations over Unix datagram sockets.
+
+INVALIDATION_BUS_ENABLED = False
+INVALIDATION_CHECK_INTERVAL = 0
+INVALIDATION_SOCKET_DIR = None
+
+# Maximum number of sub-requests accepted by /api/batch/
+
+BATCH_MAX_OPERATIONS = 20
+
+# How many times a purchase that lost an optimistic concurrency race is
+# retried before the client gets 409 Conflict
+
+BUY_PLAYER_MAX_RETRIES = 3
+
+# Maximum number of players in one bulk purchase
+
+BULK_BUY_MAX_PLAYERS = 50
+
+# Maximum number of players in one bulk list, reprice or delist request
+
+BULK_TRANSFER_MAX_PLAYERS = 50
+
+# Responses to POSTs sent with an Idempotency-Key header are kept this many
+# seconds; duplicates arriving while the first is running wait this long
+
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_WAIT_TIMEOUT = 10.0
+
+# Order book: crossing bids and listings are settled in transactions of at
+# most this many matches
+
+ORDER_BOOK_SETTLE_BATCH = 100
+
+# Auctions: every pass of the closer settles the auctions due in chunks of
+# at most this many, one transaction per chunk
+
+AUCTION_CLOSE_BATCH = 500
+
+# Listing expiry: fixed price listings are withdrawn this many days after
+# they were made (None keeps them), by the expire_listings command or, with
+# an interval, by a sweeper thread in every web process. A sweep withdraws
+# at most this many listings per transaction
+
+LISTING_TTL_DAYS = 30
+LISTING_SWEEP_INTERVAL = 0
+LISTING_SWEEP_BATCH = 500
+
+# Trade ledger: archive_trades moves trades older than this many days out of
+# the live table, this many rows per transaction
+
+TRADE_LEDGER_RETENTION_DAYS = 365
+TRADE_ARCHIVE_BATCH = 10000
+
+# Player valuation: revalue_players prices players with these parameters,
+# see api/valuation.py for the defaults, this many teams per transaction
+
+PLAYER_VALUATION = {}
+PLAYER_VALUATION_BATCH = 500
+
+# Season rollover: players older than this retire and are replaced by youth
+# players of these ages, this many teams per transaction
+
+PLAYER_RETIREMENT_AGE = 40
+YOUTH_PLAYER_AGES = (16, 18)
+SEASON_ROLLOVER_BATCH = 1000
+
+# League simulation: teams play in divisions of this many, divisions are
+# played by this many worker processes (None for one per core) and saved
+# this many per transaction
+
+LEAGUE_DIVISION_SIZE = 20
+SIMULATION_WORKERS = None
+SIMULATION_BATCH = 50
+
+# Squad recommender: the cached market is rebuilt at least this often, as
+# batch revaluations change player values without touching the listings
+
+RECOMMENDER_CACHE_SECONDS = 300
+
+# Price suggestions are drawn from the listings and the trades of this many days
+
+PRICE_SUGGESTION_TRADE_DAYS = 90
+
+# The price suggestion index is rebuilt at least this often, as revaluations
+# and season ageing change players without touching the listings
+
+PRICE_SUGGESTION_CACHE_SECONDS = 300
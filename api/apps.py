@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "api"
+
+    def ready(self):
+        from django.conf import settings
+        from .signals import market_changed
+        from .market_snapshot import publish_on_market_change
+
+        if getattr(settings, "MARKET_SNAPSHOT_PATH", None):
+            market_changed.connect(publish_on_market_change)
@@ -0,0 +1,205 @@
+import itertools
+import threading
+import time
+from functools import reduce
+from operator import itemgetter, or_
+from django.conf import settings
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+from rest_framework.response import Response
+from .models import Team, Player, TransferList, Bid
+from .helper import (
+    Purchase,
+    PurchaseConflict,
+    run_with_purchase_retries,
+    settle_purchases,
+)
+from .invalidation import discard_bids
+from .market_stats import record_delisted
+
+
+"""
+Timed auctions. A listing with an auction_ends_at is an auction: bids
+are placed on it through the order book but never cross its ask, and
+once it ends the player goes to the best bid at or above the asking
+price, the reserve, from a team which can still pay for it. Ties go to
+the earliest bid. Auctions are closed in passes by a scheduler, the
+close_auctions command: a pass closes every auction due, up to
+AUCTION_CLOSE_BATCH per transaction, with the same statements for one
+auction as for a full chunk, so thousands ending on the hour are closed
+together. Winners are settled with the statements of buy_player.
+"""
+
+ENDPOINT = "close_auctions"
+
+
+def close_batch_size():
+    return getattr(settings, "AUCTION_CLOSE_BATCH", 500)
+
+
+def milliseconds(delta):
+    return round(delta.total_seconds() * 1000, 1)
+
+
+class AuctionCloser:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.passes = 0
+        self.sold = 0
+        self.unsold = 0
+        self.failed = 0
+        self._lag_total = 0.0
+        self._lag_max = 0.0
+        self._last_pass = None
+
+    def close_due(self, now=None):
+        """
+        Close every auction which ended at `now` or before. Returns how
+        many were sold, withdrawn without a winning bid, and left open
+        because they kept conflicting with other writes.
+        """
+        now = now or timezone.now()
+        started = time.monotonic()
+        sold, unsold, failed, lags = 0, 0, [], []
+        while True:
+            due = list(
+                TransferList.objects.select_related("player")
+                .filter(auction_ends_at__lte=now)
+                .exclude(pk__in=failed)
+                .order_by("auction_ends_at", "pk")[: close_batch_size()]
+            )
+            if not due:
+                break
+            outcome = run_with_purchase_retries(
+                ENDPOINT,
+                lambda retry: self._close(due if retry == 0 else self._reload(due)),
+            )
+            if isinstance(outcome, Response):
+                # Conflicted on every retry, the next pass tries again
+                failed.extend(listing.pk for listing in due)
+                continue
+            closed, bid_ids = outcome
+            discard_bids(bid_ids)
+            closed_at = timezone.now()
+            sold += sum(1 for _, purchase in closed if purchase is not None)
+            unsold += sum(1 for _, purchase in closed if purchase is None)
+            lags.extend(
+                milliseconds(closed_at - listing.auction_ends_at)
+                for listing, _ in closed
+            )
+        self._record(now, time.monotonic() - started, sold, unsold, len(failed), lags)
+        return {"sold": sold, "unsold": unsold, "failed": len(failed)}
+
+    def _reload(self, listings):
+        # Rows read before a conflict are stale
+        return list(
+            TransferList.objects.select_related("player").filter(
+                pk__in=[listing.pk for listing in listings],
+                auction_ends_at__isnull=False,
+            )
+        )
+
+    def _close(self, listings):
+        """
+        Close a chunk of auctions with a constant number of statements.
+        Must run inside a transaction; raises PurchaseConflict when a
+        listing, player or winning team changed since it was read.
+        Returns (listing, purchase or None) for every auction closed and
+        the ids of the bids removed with them.
+        """
+        if not listings:
+            return [], []
+        auctions = {listing.player_id: listing for listing in listings}
+        bids = list(
+            Bid.objects.filter(player__in=auctions)
+            .order_by("player", "-price", "placed_at", "pk")
+            .values_list("player_id", "pk", "team_id", "price")
+        )
+        teams = Team.objects.only("budget", "version").in_bulk(
+            {team_id for _, _, team_id, _ in bids}
+        )
+
+        winners, spent = {}, {}
+        for player_id, player_bids in itertools.groupby(bids, key=itemgetter(0)):
+            listing = auctions[player_id]
+            for _, _, team_id, price in player_bids:
+                if price < listing.asking_price:
+                    break
+                team = teams[team_id]
+                if team_id == listing.player.team_id:
+                    continue
+                if team.budget - spent.get(team_id, 0) < price:
+                    continue
+                spent[team_id] = spent.get(team_id, 0) + price
+                winners[player_id] = Purchase(listing, listing.player, team, price)
+                break
+
+        if winners:
+            settle_purchases(list(winners.values()))
+        unsold = [listing for listing in listings if listing.player_id not in winners]
+        if unsold:
+            # Withdraw them, unless one was repriced in the meantime
+            withdrawn = reduce(
+                or_,
+                (
+                    Q(pk=listing.pk, asking_price=listing.asking_price)
+                    for listing in unsold
+                ),
+            )
+            if TransferList.objects.filter(withdrawn).delete()[1].get(
+                TransferList._meta.label, 0
+            ) != len(unsold):
+                raise PurchaseConflict()
+            Player.objects.filter(
+                pk__in=[listing.player_id for listing in unsold]
+            ).update(listing_status="Not Listed")
+            record_delisted(
+                [(listing.player, listing.asking_price) for listing in unsold]
+            )
+        bid_ids = [bid_id for _, bid_id, _, _ in bids]
+        Bid.objects.filter(pk__in=bid_ids).delete()
+        return [
+            (listing, winners.get(listing.player_id)) for listing in listings
+        ], bid_ids
+
+    def _record(self, now, duration, sold, unsold, failed, lags):
+        with self._lock:
+            self.passes += 1
+            self.sold += sold
+            self.unsold += unsold
+            self.failed += failed
+            self._lag_total += sum(lags)
+            self._lag_max = max([self._lag_max, *lags])
+            self._last_pass = {
+                "at": now,
+                "duration_ms": round(duration * 1000, 1),
+                "closed": len(lags),
+                "failed": failed,
+                "max_lag_ms": max(lags, default=0.0),
+            }
+
+    def stats(self):
+        # The backlog is read from the table, it is what alerting needs
+        backlog = TransferList.objects.filter(
+            auction_ends_at__lte=timezone.now()
+        ).aggregate(due=Count("pk"), oldest=Min("auction_ends_at"))
+        with self._lock:
+            closed = self.sold + self.unsold
+            return {
+                "passes": self.passes,
+                "sold": self.sold,
+                "unsold": self.unsold,
+                "failed": self.failed,
+                "avg_lag_ms": round(self._lag_total / closed, 1) if closed else 0.0,
+                "max_lag_ms": self._lag_max,
+                "last_pass": self._last_pass,
+                "due": backlog["due"],
+                "oldest_due_lag_ms": (
+                    milliseconds(timezone.now() - backlog["oldest"])
+                    if backlog["oldest"]
+                    else 0.0
+                ),
+            }
+
+
+auction_closer = AuctionCloser()
@@ -0,0 +1,164 @@
+import threading
+import time
+from urllib.parse import urlencode
+from django.conf import settings
+from rest_framework.response import Response
+
+
+"""
+Single-flight request coalescing for expensive read endpoints.
+Concurrent requests with the same normalized key wait for one
+in-flight computation and share its result instead of each
+running the same joins against the database.
+"""
+
+
+class _InFlightCall:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    OVERFLOW_KEY = "__other__"
+
+    def __init__(self, timeout=None, max_tracked_keys=None):
+        self._timeout = timeout
+        self._max_tracked_keys = max_tracked_keys
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {}
+
+    @property
+    def timeout(self):
+        if self._timeout is not None:
+            return self._timeout
+        return getattr(settings, "COALESCING_TIMEOUT", 5.0)
+
+    @property
+    def max_tracked_keys(self):
+        if self._max_tracked_keys is not None:
+            return self._max_tracked_keys
+        return getattr(settings, "COALESCING_MAX_TRACKED_KEYS", 1000)
+
+    def _key_stats(self, key):
+        # Must be called with self._lock held
+        if key not in self._stats and len(self._stats) >= self.max_tracked_keys:
+            key = self.OVERFLOW_KEY
+        return self._stats.setdefault(
+            key,
+            {
+                "executions": 0,
+                "shared": 0,
+                "timeouts": 0,
+                "errors": 0,
+                "compute_ms": 0.0,
+            },
+        )
+
+    def do(self, key, fn):
+        """
+        Run fn() once for all concurrent callers using the same key.
+        Followers that wait longer than the timeout compute on their own.
+        """
+        with self._lock:
+            stats = self._key_stats(key)
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _InFlightCall()
+                self._calls[key] = call
+                stats["executions"] += 1
+
+        if leader:
+            started = time.perf_counter()
+            try:
+                call.result = fn()
+                return call.result
+            except Exception as error:
+                call.error = error
+                with self._lock:
+                    stats["errors"] += 1
+                raise
+            finally:
+                elapsed = (time.perf_counter() - started) * 1000
+                with self._lock:
+                    stats["compute_ms"] += elapsed
+                    del self._calls[key]
+                call.event.set()
+
+        if not call.event.wait(self.timeout):
+            with self._lock:
+                stats["timeouts"] += 1
+            return fn()
+        with self._lock:
+            stats["shared"] += 1
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {
+                key: dict(
+                    values,
+                    avg_compute_ms=(
+                        round(values["compute_ms"] / values["executions"], 3)
+                        if values["executions"]
+                        else 0.0
+                    ),
+                    in_flight=key in self._calls,
+                )
+                for key, values in self._stats.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+read_coalescer = SingleFlight()
+
+
+"""
+View mixin which coalesces list and retrieve calls. The key is built
+from the view, the path and the sorted query parameters, plus the
+requesting user when the response depends on who is asking.
+"""
+
+
+class CoalescedReadMixin:
+    coalescer = read_coalescer
+    coalesce_per_user = True
+
+    def get_coalesce_key(self, request):
+        params = urlencode(
+            [
+                (name, value)
+                for name, values in sorted(request.query_params.lists())
+                for value in sorted(values)
+            ]
+        )
+        key = f"{type(self).__name__}:{request.path}?{params}"
+        if self.coalesce_per_user:
+            key += f"#user={request.user.pk}"
+        return key
+
+    def list(self, request, *args, **kwargs):
+        data = self.coalescer.do(
+            self.get_coalesce_key(request),
+            lambda: super(CoalescedReadMixin, self).list(request, *args, **kwargs).data,
+        )
+        return Response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        data = self.coalescer.do(
+            self.get_coalesce_key(request),
+            lambda: super(CoalescedReadMixin, self)
+            .retrieve(request, *args, **kwargs)
+            .data,
+        )
+        return Response(data)
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django import forms
-from .models import CustomUser, MarketList
+from .models import CustomUser
 import pycountry
 from .helper import user_register_create_team_and_players, CountryFilter
 
@@ -116,10 +116,6 @@ class TransferListAdmin(admin.ModelAdmin):
 
     price.short_description = "Asking Price"
 
-    def save_model(self, request, obj, form, change):
-        super().save_model(request, obj, form, change)
-        MarketList.objects.create(transfer_list=obj)
-
     """
     To delete single player from transfer list and change
     its listing status from "Listed" to "Not Listed"
@@ -152,27 +148,27 @@ class TransferListAdmin(admin.ModelAdmin):
 
 class MarketListAdmin(admin.ModelAdmin):
     def player_name(self, obj):
-        return f"{obj.transfer_list.player.first_name} {obj.transfer_list.player.last_name}"
+        return f"{obj.player.first_name} {obj.player.last_name}"
 
     player_name.short_description = "Player Name"
 
     def team_name(self, obj):
-        return obj.transfer_list.player.team.name
+        return obj.player.team.name
 
     team_name.short_description = "Team Name"
 
     def position(self, obj):
-        return obj.transfer_list.player.position
+        return obj.player.position
 
     position.short_description = "Position"
 
     def country(self, obj):
-        return obj.transfer_list.player.country
+        return obj.player.country
 
     country.short_description = "Country"
 
     def price(self, obj):
-        return f"$ {obj.transfer_list.asking_price}"
+        return f"$ {obj.asking_price}"
 
     price.short_description = "Asking Price"
 
@@ -183,4 +179,4 @@ class MarketListAdmin(admin.ModelAdmin):
     show only countries of listed players
     """
 
-    list_filter = ("transfer_list__player__team__name", CountryFilter)
+    list_filter = ("player__team__name", CountryFilter)
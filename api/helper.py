@@ -1,4 +1,4 @@
-from .models import Team, Player, TransferList, MarketList
+from .models import Team, Player, TransferList, Trade, Bid, listing_expiry
 from faker import Faker
 import pycountry
 import random
@@ -8,6 +8,22 @@ from rest_framework.permissions import BasePermission
 from rest_framework import status
 from rest_framework.response import Response
 from django.contrib.admin import SimpleListFilter
+from django.db import transaction, IntegrityError
+from django.db.models import F, Q, Case, When, Value, DecimalField, BigIntegerField
+from collections import namedtuple
+from functools import reduce
+from operator import or_
+from django.conf import settings
+from django.utils import timezone
+from .metrics import conflict_stats
+from .signals import notify_market_changed, notify_teams_changed
+from .invalidation import discard_bids
+from .market_stats import (
+    record_listed,
+    record_delisted,
+    record_repriced,
+    record_sold,
+)
 
 
 """
@@ -55,6 +71,14 @@ class CheckTokenUserMatch(BasePermission):
         return request.user == user
 
 
+class CheckUsernameMatch(BasePermission):
+    # For views acting for the username of the URL without loading the user
+    message = "Invalid token."
+
+    def has_permission(self, request, view):
+        return request.user.username == view.kwargs.get("username")
+
+
 """
 Helper function to show full name of players when a user
 list players for selling on transfer list from url
@@ -65,6 +89,8 @@ def get_player_name_and_price(instance):
     data = {}
     data["player"] = instance.player.first_name + " " + instance.player.last_name
     data["asking_price"] = f"$ {instance.asking_price}"
+    if instance.is_auction:
+        data["auction_ends_at"] = instance.auction_ends_at
     return data
 
 
@@ -75,33 +101,214 @@ Helper Function for Market List Serializer
 
 def show_market_list_data(market_list_instance):
     data = {}
-    data["player_id"] = market_list_instance.transfer_list.player.id
+    data["player_id"] = market_list_instance.player.id
     data["player_name"] = (
-        f"{market_list_instance.transfer_list.player.first_name} {market_list_instance.transfer_list.player.last_name}"
+        f"{market_list_instance.player.first_name} {market_list_instance.player.last_name}"
     )
-    data["player_country"] = market_list_instance.transfer_list.player.country
-    data["team_name"] = market_list_instance.transfer_list.player.team.name
-    data["position"] = market_list_instance.transfer_list.player.position
-    data["asking_price"] = f"$ {market_list_instance.transfer_list.asking_price}"
+    data["player_country"] = market_list_instance.player.country
+    data["team_name"] = market_list_instance.player.team.name
+    data["position"] = market_list_instance.player.position
+    data["asking_price"] = f"$ {market_list_instance.asking_price}"
     return data
 
 
 """
-Helper function for Buy Player View Calculations
+Helper functions for Buy Player View Calculations. A purchase reads the
+listings, players and teams without locking, then applies every change
+as a compare-and-swap on the version columns inside one short
+transaction. When another request got there first the attempt is rolled
+back and retried a bounded number of times before answering 409.
 """
 
 
-def buy_player(serializer, username):
-    player_id = serializer.validated_data["player_id"]
-    player = Player.objects.get(id=player_id)
-    buyer_team = Team.objects.get(owner__username=username)
-    seller_team = player.team
+class PurchaseConflict(Exception):
+    pass
+
+
+Purchase = namedtuple("Purchase", ["listing", "player", "buyer_team", "price"])
+
+MONEY = DecimalField(max_digits=10, decimal_places=2)
+
+
+def _per_row(values, output_field=MONEY):
+    # CASE expression giving each primary key its own value in one UPDATE
+    return Case(
+        *[When(pk=pk, then=Value(value)) for pk, value in values.items()],
+        output_field=output_field,
+    )
+
+
+def settle_purchases(purchases):
+    """
+    Apply a set of validated purchases with a constant number of
+    statements, whatever the number of players, buyers and sellers.
+    Must run inside a transaction; raises PurchaseConflict when any
+    listing, player or buyer team changed since it was read. Every
+    purchase is recorded in the Trade ledger. Returns the new market
+    value of every bought player by id.
+    """
+    new_values = {}
+    spent, gained, sold_value, bought_value, buyer_versions = {}, {}, {}, {}, {}
+    for purchase in purchases:
+        player, buyer, price = purchase.player, purchase.buyer_team, purchase.price
+        # Increase player value by a random percentage between 10 and 100
+        increase_percentage = Decimal(randint(10, 100)) / 100
+        new_values[player.pk] = (
+            player.market_value * (1 + increase_percentage)
+        ).quantize(Decimal("0.01"))
+        buyer_versions[buyer.pk] = buyer.version
+        spent[buyer.pk] = spent.get(buyer.pk, 0) + price
+        bought_value[buyer.pk] = bought_value.get(buyer.pk, 0) + new_values[player.pk]
+        gained[player.team_id] = gained.get(player.team_id, 0) + price
+        sold_value[player.team_id] = (
+            sold_value.get(player.team_id, 0) + player.market_value
+        )
+
+    # Claim the listings, they may have been bought, repriced or withdrawn
+    claimed = reduce(
+        or_,
+        (
+            Q(pk=purchase.listing.pk, asking_price=purchase.listing.asking_price)
+            for purchase in purchases
+        ),
+    )
+    if TransferList.objects.filter(claimed).delete()[1].get(
+        TransferList._meta.label, 0
+    ) != len(purchases):
+        raise PurchaseConflict()
+
+    # Move the players, unless one changed since we read it
+    unchanged_players = reduce(
+        or_,
+        (
+            Q(
+                pk=purchase.player.pk,
+                team_id=purchase.player.team_id,
+                version=purchase.player.version,
+            )
+            for purchase in purchases
+        ),
+    )
+    if Player.objects.filter(unchanged_players).update(
+        team_id=_per_row(
+            {purchase.player.pk: purchase.buyer_team.pk for purchase in purchases},
+            BigIntegerField(),
+        ),
+        market_value=_per_row(new_values),
+        listing_status="Not Listed",
+        version=F("version") + 1,
+    ) != len(purchases):
+        raise PurchaseConflict()
+
+    # Charge the buyers, unless a budget changed since we checked it
+    unchanged_buyers = reduce(
+        or_, (Q(pk=pk, version=version) for pk, version in buyer_versions.items())
+    )
+    if Team.objects.filter(unchanged_buyers).update(
+        budget=F("budget") - _per_row(spent),
+        team_value=F("team_value") + _per_row(bought_value),
+        final_value=F("final_value") - _per_row(spent) + _per_row(bought_value),
+        version=F("version") + 1,
+    ) != len(buyer_versions):
+        raise PurchaseConflict()
+
+    # Crediting the sellers commutes with other purchases, so no CAS here
+    Team.objects.filter(pk__in=gained).update(
+        budget=F("budget") + _per_row(gained),
+        team_value=F("team_value") - _per_row(sold_value),
+        final_value=F("final_value") + _per_row(gained) - _per_row(sold_value),
+        version=F("version") + 1,
+    )
+
+    notify_teams_changed(set(buyer_versions) | set(gained))
+    record_delisted(
+        [(purchase.player, purchase.listing.asking_price) for purchase in purchases]
+    )
+    record_sold([purchase.price for purchase in purchases])
+
+    # Record the trades in the ledger, in the same transaction
+    traded_at = timezone.now()
+    Trade.objects.bulk_create(
+        Trade(
+            player_id=purchase.player.pk,
+            seller_team_id=purchase.player.team_id,
+            buyer_team_id=purchase.buyer_team.pk,
+            price=purchase.price,
+            value_before=purchase.player.market_value,
+            value_after=new_values[purchase.player.pk],
+            traded_at=traded_at,
+        )
+        for purchase in purchases
+    )
+    return new_values
+
+
+def run_with_purchase_retries(endpoint, attempt):
+    """
+    Call attempt(retry) in a fresh transaction until it does not
+    conflict, at most BUY_PLAYER_MAX_RETRIES extra times.
+    """
+    max_retries = getattr(settings, "BUY_PLAYER_MAX_RETRIES", 3)
+    for retry in range(max_retries + 1):
+        conflict_stats.record_attempt(endpoint)
+        try:
+            with transaction.atomic():
+                return attempt(retry)
+        except PurchaseConflict:
+            conflict_stats.record_conflict(endpoint)
+    conflict_stats.record_exhausted(endpoint)
+    return Response(
+        {
+            "status": "Conflict",
+            "message": "The player or your team changed during the purchase, please try again.",
+        },
+        status=status.HTTP_409_CONFLICT,
+    )
+
+
+def buy_player(serializer, username, endpoint="buy_player", loader=None):
+    # Rows the request loaded earlier are stale once an attempt conflicted
+    return run_with_purchase_retries(
+        endpoint,
+        lambda retry: attempt_purchase(
+            serializer, username, loader if retry == 0 else None
+        ),
+    )
 
-    # Get the asking price from the TransferList
-    asking_price = TransferList.objects.get(player=player).asking_price
+
+def attempt_purchase(serializer, username, loader=None):
+    player_id = serializer.validated_data["player_id"]
+    price = serializer.validated_data["price"]
+
+    if loader is not None:
+        player = loader.player(player_id)
+        listing = loader.listing(player) if player is not None else None
+    else:
+        listing = (
+            TransferList.objects.select_related("player")
+            .filter(player_id=player_id)
+            .first()
+        )
+        player = listing.player if listing is not None else None
+    if listing is None:
+        return Response(
+            {
+                "status": "Warning",
+                "message": "The player is not listed in the transfer list.",
+            },
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if listing.is_auction:
+        return Response(
+            {
+                "status": "Warning",
+                "message": "The player is on auction, place a bid instead.",
+            },
+            status=status.HTTP_400_BAD_REQUEST,
+        )
 
     # Check if the price provided by the user matches the asking price
-    if serializer.validated_data["price"] < asking_price:
+    if price < listing.asking_price:
         return Response(
             {
                 "status": "Warning",
@@ -110,7 +317,7 @@ def buy_player(serializer, username):
             status=status.HTTP_400_BAD_REQUEST,
         )
 
-    elif serializer.validated_data["price"] > asking_price:
+    elif price > listing.asking_price:
         return Response(
             {
                 "status": "Warning",
@@ -119,42 +326,306 @@ def buy_player(serializer, username):
             status=status.HTTP_400_BAD_REQUEST,
         )
 
-    # Update team budgets
-    buyer_team.budget -= serializer.validated_data["price"]
-    seller_team.budget += serializer.validated_data["price"]
+    if loader is not None:
+        buyer_team = loader.team_for_username(username)
+    else:
+        buyer_team = Team.objects.only("budget", "version").get(
+            owner__username=username
+        )
+    if buyer_team.budget < price:
+        return Response(
+            {
+                "status": "Warning",
+                "message": "Your team budget is not enough to buy this player.",
+            },
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    settle_purchases([Purchase(listing, player, buyer_team, price)])
+    if loader is not None:
+        loader.invalidate()
+
+    return Response(
+        {
+            "status": "Success",
+            "message": f"Congratulations *{username}*, you successfully bought *{player.first_name} {player.last_name}*.",
+        },
+        status=status.HTTP_200_OK,
+    )
 
-    # Increase player value by a random percentage between 10 and 100
-    increase_percentage = Decimal(randint(10, 100)) / 100
-    player.market_value *= 1 + increase_percentage
 
-    # Update teams and player
-    player.team = buyer_team  # Set the player's team to the buyer team
-    player.listing_status = "Not Listed"
-    player.save()
+"""
+Helper function for Bulk Buy View. All purchases are validated with one
+query for the listings, then settled together: either every player is
+bought or none is.
+"""
 
-    # Update the Buyer team_value and final_value
-    buyer_team.team_value += player.market_value
-    buyer_team.final_value = buyer_team.team_value + buyer_team.budget
-    buyer_team.save()
 
-    # Update the Seller team_value and final_value
-    seller_team.team_value -= player.market_value
-    seller_team.final_value = seller_team.team_value + seller_team.budget
-    seller_team.save()
+def bulk_buy_players(items, username, loader, endpoint="bulk_buy"):
+    return run_with_purchase_retries(
+        endpoint,
+        lambda retry: attempt_bulk_purchase(
+            items, username, loader if retry == 0 else None
+        ),
+    )
+
+
+def attempt_bulk_purchase(items, username, loader=None):
+    player_ids = [item["player_id"] for item in items]
+    listings = {
+        listing.player_id: listing
+        for listing in TransferList.objects.select_related(
+            "player__team__owner"
+        ).filter(player_id__in=player_ids)
+    }
+    if loader is not None:
+        buyer_team = loader.team_for_username(username)
+    else:
+        buyer_team = Team.objects.only("budget", "version").get(
+            owner__username=username
+        )
+
+    errors, purchases, seen = [], [], set()
+    for item in items:
+        player_id, price = item["player_id"], item["price"]
+        listing = listings.get(player_id)
+        if player_id in seen:
+            error = "The player appears more than once."
+        elif listing is None:
+            error = "The player is not listed in the transfer list."
+        elif listing.player.team.owner.username == username:
+            error = "You can't buy your own team player."
+        elif listing.is_auction:
+            error = "The player is on auction, place a bid instead."
+        elif price < listing.asking_price:
+            error = "The current price is *less* than asking price."
+        elif price > listing.asking_price:
+            error = "The current price is *more* than asking price."
+        else:
+            error = None
+            purchases.append(Purchase(listing, listing.player, buyer_team, price))
+        seen.add(player_id)
+        if error:
+            errors.append({"player_id": player_id, "message": error})
+
+    if not errors:
+        total_price = sum(purchase.price for purchase in purchases)
+        if buyer_team.budget < total_price:
+            errors.append(
+                {
+                    "player_id": None,
+                    "message": f"Your team budget is not enough for a total of $ {total_price}.",
+                }
+            )
+    if errors:
+        return Response(
+            {"status": "Warning", "errors": errors},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
 
-    # Remove player from TransferList and MarketList
-    TransferList.objects.filter(player=player).delete()
-    MarketList.objects.filter(transfer_list__player=player).delete()
+    settle_purchases(purchases)
+    if loader is not None:
+        loader.invalidate()
 
     return Response(
         {
             "status": "Success",
-            "message": f"Congratulations *{username}*, you successfully bought *{player.first_name} {player.last_name}*.",
+            "message": f"Congratulations *{username}*, you successfully bought {len(purchases)} players.",
+            "players": [
+                f"{purchase.player.first_name} {purchase.player.last_name}"
+                for purchase in purchases
+            ],
+            "total_price": f"$ {total_price}",
         },
         status=status.HTTP_200_OK,
     )
 
 
+"""
+Helper Functions for Bulk Transfer List
+Each item is checked on its own and reported back with its outcome;
+the valid ones are applied together with set-based statements.
+"""
+
+
+def load_own_players(items, username):
+    # One query for every player of the request, with their listing
+    players = {
+        player.pk: player
+        for player in Player.objects.select_related(
+            "team__owner", "transferlist"
+        ).filter(pk__in=[item["player_id"] for item in items])
+    }
+    results, valid, seen = [], [], set()
+    for item in items:
+        player_id = item["player_id"]
+        player = players.get(player_id)
+        if player_id in seen:
+            error = "The player appears more than once."
+        elif player is None or player.team.owner.username != username:
+            error = "Player does not exist in the team"
+        else:
+            error = None
+        seen.add(player_id)
+        results.append({"player_id": player_id, "status": "Error", "error": error})
+        if error is None:
+            valid.append((results[-1], player, item))
+    return results, valid
+
+
+def bulk_result_response(results):
+    applied = any(result["status"] != "Error" for result in results)
+    for result in results:
+        if result["error"] is None:
+            del result["error"]
+    return Response(
+        {"results": results},
+        status=status.HTTP_200_OK if applied else status.HTTP_400_BAD_REQUEST,
+    )
+
+
+def create_listings(listed, username, auction_ends_at=None):
+    """
+    Put (player, asking_price) pairs on the transfer list, and so on
+    the market, in one transaction: one UPDATE claiming the players,
+    scoped to the manager's own unlisted ones, then one INSERT. With an
+    auction_ends_at they are auctioned, the asking price is the reserve,
+    otherwise they expire after LISTING_TTL_DAYS. Returns the new
+    TransferList rows, or None without writing anything when one of the
+    players was listed or changed team in the meantime.
+    """
+    player_ids = [player.pk for player, _ in listed]
+    created_at = timezone.now()
+    expires_at = None if auction_ends_at else listing_expiry(created_at)
+    try:
+        with transaction.atomic():
+            claimed = Player.objects.filter(
+                pk__in=player_ids,
+                team__owner__username=username,
+                transferlist__isnull=True,
+            ).update(listing_status="Listed")
+            if claimed != len(player_ids):
+                transaction.set_rollback(True)
+                return None
+            transfer_lists = TransferList.objects.bulk_create(
+                TransferList(
+                    player=player,
+                    asking_price=asking_price,
+                    auction_ends_at=auction_ends_at,
+                    created_at=created_at,
+                    expires_at=expires_at,
+                )
+                for player, asking_price in listed
+            )
+            record_listed(listed)
+    except IntegrityError:
+        # A concurrent request claimed the same player before committing
+        return None
+    for player, _ in listed:
+        player.listing_status = "Listed"
+    notify_market_changed(player_ids)
+    return transfer_lists
+
+
+def bulk_list_players(items, username):
+    results, valid = load_own_players(items, username)
+    listed = []
+    for result, player, item in valid:
+        if hasattr(player, "transferlist"):
+            result["error"] = "Player already listed in the transfer list."
+        else:
+            result["status"] = "Listed"
+            listed.append((player, item["asking_price"]))
+    if listed and create_listings(listed, username) is None:
+        return Response(
+            {"Warning": "Some players were listed by another request, try again."},
+            status=status.HTTP_409_CONFLICT,
+        )
+    return bulk_result_response(results)
+
+
+def _unchanged_listings(players, username):
+    # The listings as they were read, still on the manager's own players
+    return TransferList.objects.filter(
+        reduce(
+            or_,
+            (
+                Q(
+                    pk=player.transferlist.pk,
+                    asking_price=player.transferlist.asking_price,
+                )
+                for player in players
+            ),
+        ),
+        player__team__owner__username=username,
+    )
+
+
+def bulk_conflict_response():
+    return Response(
+        {"Warning": "Some listings were changed by another request, try again."},
+        status=status.HTTP_409_CONFLICT,
+    )
+
+
+def bulk_reprice_players(items, username):
+    results, valid = load_own_players(items, username)
+    prices, repriced = {}, []
+    for result, player, item in valid:
+        if not hasattr(player, "transferlist"):
+            result["error"] = "The player is not listed in the transfer list."
+        elif player.transferlist.is_auction:
+            result["error"] = "The reserve price of an auction can't be changed."
+        else:
+            result["status"] = "Repriced"
+            prices[player.transferlist.pk] = item["asking_price"]
+            repriced.append(
+                (player, player.transferlist.asking_price, item["asking_price"])
+            )
+    if prices:
+        players = [player for player, _, _ in repriced]
+        with transaction.atomic():
+            if _unchanged_listings(players, username).filter(
+                auction_ends_at__isnull=True
+            ).update(asking_price=_per_row(prices)) != len(prices):
+                transaction.set_rollback(True)
+                return bulk_conflict_response()
+            record_repriced(repriced)
+        notify_market_changed([player.pk for player in players])
+    return bulk_result_response(results)
+
+
+def bulk_delist_players(items, username):
+    results, valid = load_own_players(items, username)
+    delisted = []
+    for result, player, _ in valid:
+        if not hasattr(player, "transferlist"):
+            result["error"] = "The player is not listed in the transfer list."
+        else:
+            result["status"] = "Delisted"
+            delisted.append((player, player.transferlist.asking_price))
+    if delisted:
+        players = [player for player, _ in delisted]
+        player_ids = [player.pk for player in players]
+        with transaction.atomic():
+            # The delete signals notify market listeners
+            deleted = _unchanged_listings(players, username).delete()[1]
+            if deleted.get(TransferList._meta.label, 0) != len(players):
+                transaction.set_rollback(True)
+                return bulk_conflict_response()
+            Player.objects.filter(pk__in=player_ids).update(listing_status="Not Listed")
+            record_delisted(delisted)
+            # Withdrawn auctions take their bids with them
+            auctions = [p.pk for p, _ in delisted if p.transferlist.is_auction]
+            bid_ids = list(
+                Bid.objects.filter(player__in=auctions).values_list("pk", flat=True)
+            )
+            if bid_ids:
+                Bid.objects.filter(pk__in=bid_ids).delete()
+                discard_bids(bid_ids)
+    return bulk_result_response(results)
+
+
 """
 Helper Class for Market List Admin
 Country Filter
@@ -166,11 +637,9 @@ class CountryFilter(SimpleListFilter):
     parameter_name = "country"
 
     def lookups(self, request, model_admin):
-        countries = set(
-            [cn.transfer_list.player.country for cn in model_admin.model.objects.all()]
-        )
+        countries = set([cn.player.country for cn in model_admin.model.objects.all()])
         return [(cn, cn) for cn in countries]
 
     def queryset(self, request, queryset):
         if self.value():
-            return queryset.filter(transfer_list__player__country=self.value())
+            return queryset.filter(player__country=self.value())
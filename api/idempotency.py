@@ -0,0 +1,136 @@
+import hashlib
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from .models import IdempotencyRecord
+
+
+"""
+Idempotency-Key support for write endpoints. The first request with a
+key claims it in the IdempotencyRecord table and its response is
+stored there. Retries with the same key get that response replayed
+without running the view again, and retries arriving while the first
+request is still running wait for it to finish. Server errors and 409
+conflicts, which ask the client to try again, are not stored. Records
+expire after IDEMPOTENCY_KEY_TTL seconds.
+"""
+
+HEADER = "Idempotency-Key"
+META_KEY = "HTTP_IDEMPOTENCY_KEY"
+MAX_KEY_LENGTH = 255
+
+
+class IdempotentReplay(Exception):
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+
+def request_fingerprint(request):
+    digest = hashlib.sha256()
+    digest.update(f"{request.method} {request.get_full_path()}\n".encode("utf-8"))
+    digest.update(request._request.body)
+    return digest.hexdigest()
+
+
+def warning(message, status_code):
+    return Response({"Warning": message}, status=status_code)
+
+
+def claim_key(user, key, fingerprint):
+    """
+    Return the claimed record when this request runs the view, or the
+    response to answer with: the stored one, or an error when the key
+    is reused for another request or its first request takes too long.
+    """
+    ttl = timedelta(seconds=getattr(settings, "IDEMPOTENCY_KEY_TTL", 86400))
+    wait = getattr(settings, "IDEMPOTENCY_WAIT_TIMEOUT", 10.0)
+    deadline = time.monotonic() + wait
+    delay = 0.01
+    while True:
+        now = timezone.now()
+        # Falls back to reading the row when a concurrent insert won
+        record, created = IdempotencyRecord.objects.get_or_create(
+            user=user,
+            key=key,
+            defaults={"fingerprint": fingerprint, "created_at": now},
+        )
+        if created:
+            return record
+        if record.created_at < now - ttl:
+            # Expired, forget it and claim the key again
+            IdempotencyRecord.objects.filter(
+                pk=record.pk, created_at=record.created_at
+            ).delete()
+            continue
+        if record.fingerprint != fingerprint:
+            return warning(
+                f"{HEADER} was already used for a different request.",
+                status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        if record.status_code is not None:
+            response = Response(record.body, status=record.status_code)
+            response["Idempotent-Replayed"] = "true"
+            return response
+        if time.monotonic() >= deadline:
+            return warning(
+                f"A request with this {HEADER} is still in progress, retry later.",
+                status.HTTP_409_CONFLICT,
+            )
+        time.sleep(delay)
+        delay = min(delay * 2, 0.2)
+
+
+class IdempotentPostMixin:
+    """
+    Honour the Idempotency-Key header on POST. Server errors and
+    conflicts are not stored, so a retry after one runs the view again.
+    """
+
+    idempotency_record = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        key = request.headers.get(HEADER)
+        if request.method != "POST" or not key or not request.user.is_authenticated:
+            return
+        if len(key) > MAX_KEY_LENGTH:
+            raise IdempotentReplay(
+                warning(
+                    f"{HEADER} is longer than {MAX_KEY_LENGTH} characters.",
+                    status.HTTP_400_BAD_REQUEST,
+                )
+            )
+        outcome = claim_key(request.user, key, request_fingerprint(request))
+        if isinstance(outcome, Response):
+            raise IdempotentReplay(outcome)
+        self.idempotency_record = outcome
+
+    def handle_exception(self, exc):
+        if isinstance(exc, IdempotentReplay):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        record = self.idempotency_record
+        code = response.status_code
+        # A conflict asks the client to try again, it is not replayed
+        if record is not None and code < 500 and code != status.HTTP_409_CONFLICT:
+            record.status_code = response.status_code
+            record.body = response.data
+            record.save(update_fields=["status_code", "body"])
+            self.idempotency_record = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            if self.idempotency_record is not None:
+                # Not answered, a server error or a conflict, let a retry
+                # run it again
+                self.idempotency_record.delete()
+                self.idempotency_record = None
@@ -0,0 +1,333 @@
+import glob
+import os
+import socket
+import threading
+import time
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import CacheGeneration
+
+
+"""
+Cross-process cache invalidation bus without an external broker.
+
+Publishing a key bumps its row in the CacheGeneration table, once per
+transaction however many times it is published there. Every
+process compares the generations it has seen with the table once per
+request (InvalidationMiddleware) and runs the local handlers for keys
+that moved. When INVALIDATION_SOCKET_DIR is set, publishers also push
+the key over Unix datagram sockets to every worker on the host, so
+invalidations usually land before the next request even starts.
+"""
+
+
+def bus_enabled():
+    return getattr(settings, "INVALIDATION_BUS_ENABLED", False)
+
+
+class InvalidationBus:
+    def __init__(self, socket_dir=None):
+        self._socket_dir = socket_dir
+        self._lock = threading.Lock()
+        self._handlers = {}
+        self._seen = {}
+        self._stats = {}
+        self._socket = None
+        self._socket_path = None
+        self._last_check = 0.0
+        self._baseline = False
+        self._pending = threading.local()
+
+    @property
+    def socket_dir(self):
+        return self._socket_dir or getattr(settings, "INVALIDATION_SOCKET_DIR", None)
+
+    def _key_stats(self, key):
+        # Must be called with self._lock held
+        return self._stats.setdefault(
+            key,
+            {
+                "published": 0,
+                "received": 0,
+                "pushed": 0,
+                "latency_ms_total": 0.0,
+                "latency_ms_max": 0.0,
+            },
+        )
+
+    def subscribe(self, key, handler):
+        with self._lock:
+            self._handlers.setdefault(key, []).append(handler)
+
+    def publish(self, key):
+        """
+        Bump the generation of key once the current transaction commits,
+        a single time however often the key is published in it.
+        """
+        connection = transaction.get_connection()
+        if not connection.in_atomic_block:
+            self.bump(key)
+            return
+        hooks = self._pending.__dict__.setdefault("hooks", {})
+        hook = hooks.get(key)
+        # A rollback drops the hook along with the rest of the transaction
+        if hook is not None and any(
+            func is hook for _, func, _ in connection.run_on_commit
+        ):
+            return
+
+        def hook():
+            hooks.pop(key, None)
+            self.bump(key)
+
+        hooks[key] = hook
+        transaction.on_commit(hook)
+
+    def bump(self, key):
+        now = timezone.now()
+        with transaction.atomic():
+            updated = CacheGeneration.objects.filter(key=key).update(
+                generation=F("generation") + 1, updated_at=now
+            )
+            if not updated:
+                CacheGeneration.objects.get_or_create(
+                    key=key, defaults={"generation": 1, "updated_at": now}
+                )
+            generation = CacheGeneration.objects.get(key=key).generation
+        with self._lock:
+            # Our own handlers already ran through the local signal path
+            self._seen[key] = max(self._seen.get(key, 0), generation)
+            self._key_stats(key)["published"] += 1
+        self._push(key, generation, now.timestamp())
+        return generation
+
+    def _apply(self, key, generation, published_at, pushed=False):
+        with self._lock:
+            if generation <= self._seen.get(key, 0):
+                return False
+            self._seen[key] = generation
+            stats = self._key_stats(key)
+            latency = max(0.0, (time.time() - published_at) * 1000)
+            stats["received"] += 1
+            stats["pushed"] += pushed
+            stats["latency_ms_total"] += latency
+            stats["latency_ms_max"] = max(stats["latency_ms_max"], latency)
+            handlers = list(self._handlers.get(key, []))
+        for handler in handlers:
+            handler(key)
+        return True
+
+    def check(self):
+        """
+        Fallback path: one query comparing every generation with the
+        ones this process has already seen.
+        """
+        interval = getattr(settings, "INVALIDATION_CHECK_INTERVAL", 0)
+        now = time.monotonic()
+        if interval and now - self._last_check < interval:
+            return
+        self._last_check = now
+        generations = CacheGeneration.objects.values_list(
+            "key", "generation", "updated_at"
+        )
+        if not self._baseline:
+            # The first check only records where this process starts from
+            with self._lock:
+                for key, generation, _ in generations:
+                    self._seen.setdefault(key, generation)
+                self._baseline = True
+            return
+        for key, generation, updated_at in generations:
+            self._apply(key, generation, updated_at.timestamp())
+
+    def listen(self):
+        """
+        Bind this process's datagram socket and start the receiver thread.
+        """
+        if not self.socket_dir or self._socket is not None:
+            return
+        with self._lock:
+            if self._socket is not None:
+                return
+            os.makedirs(self.socket_dir, exist_ok=True)
+            path = os.path.join(self.socket_dir, f"{os.getpid()}-{id(self)}.sock")
+            if os.path.exists(path):
+                os.unlink(path)
+            receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            receiver.bind(path)
+            self._socket, self._socket_path = receiver, path
+        threading.Thread(target=self._receive, args=(receiver,), daemon=True).start()
+
+    def close(self):
+        with self._lock:
+            if self._socket is None:
+                return
+            self._socket.close()
+            if os.path.exists(self._socket_path):
+                os.unlink(self._socket_path)
+            self._socket = self._socket_path = None
+
+    def _receive(self, receiver):
+        while True:
+            try:
+                message = receiver.recv(1024).decode("utf-8")
+            except OSError:
+                return
+            except ValueError:
+                continue  # Not a message of ours
+            try:
+                key, generation, published_at = message.rsplit(" ", 2)
+                generation, published_at = int(generation), float(published_at)
+            except ValueError:
+                continue
+            self._apply(key, generation, published_at, pushed=True)
+
+    def _push(self, key, generation, published_at):
+        if not self.socket_dir:
+            return
+        own_path = self._socket_path
+        message = f"{key} {generation} {published_at}".encode("utf-8")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+            # A full receiver queue must not hold up the publishing request
+            sender.setblocking(False)
+            for path in glob.glob(os.path.join(self.socket_dir, "*.sock")):
+                if path == own_path:
+                    continue
+                try:
+                    sender.sendto(message, path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Worker is gone, the socket file is left over
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                except BlockingIOError:
+                    # Receiver queue is full, the generation check catches up
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                key: {
+                    "published": values["published"],
+                    "received": values["received"],
+                    "pushed": values["pushed"],
+                    "avg_latency_ms": (
+                        round(values["latency_ms_total"] / values["received"], 3)
+                        if values["received"]
+                        else 0.0
+                    ),
+                    "max_latency_ms": round(values["latency_ms_max"], 3),
+                    "generation": self._seen.get(key, 0),
+                }
+                for key, values in self._stats.items()
+            }
+
+
+invalidation_bus = InvalidationBus()
+
+
+class InvalidationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if bus_enabled():
+            invalidation_bus.listen()
+            invalidation_bus.check()
+        return self.get_response(request)
+
+
+"""
+The market key: local market changes are published to other processes
+from notify_market_changed, and their market changes drop this
+process's in-memory index, recommender cache and price index.
+"""
+
+MARKET_KEY = "market"
+
+
+def publish_market_change():
+    if bus_enabled():
+        invalidation_bus.publish(MARKET_KEY)
+
+
+def drop_market_index(key):
+    from .market_index import market_index
+    from .recommender import recommender
+    from .price_suggestions import price_index
+
+    if market_index.built:
+        market_index.reset()
+    if recommender.built:
+        recommender.reset()
+    if price_index.built:
+        price_index.reset()
+
+
+invalidation_bus.subscribe(MARKET_KEY, drop_market_index)
+
+
+"""
+The order book key: bids placed, cancelled or filled here are published
+to other processes, and their bid or market changes make this process
+read its order book again before the next match.
+"""
+
+ORDER_BOOK_KEY = "order_book"
+
+
+def publish_bids_change():
+    if bus_enabled():
+        invalidation_bus.publish(ORDER_BOOK_KEY)
+
+
+def discard_bids(bid_ids):
+    """
+    Drop bids deleted in the current transaction from this process's
+    order book once it commits, and have the other processes reload.
+    """
+    from .orderbook import order_book
+
+    def discard():
+        order_book.discard(bid_ids)
+        publish_bids_change()
+
+    transaction.on_commit(discard)
+
+
+def drop_order_book(key):
+    from .orderbook import order_book
+
+    if order_book.loaded:
+        order_book.invalidate()
+
+
+invalidation_bus.subscribe(MARKET_KEY, drop_order_book)
+invalidation_bus.subscribe(ORDER_BOOK_KEY, drop_order_book)
+
+
+"""
+The teams key: local team value changes are published to other
+processes from notify_teams_changed, and theirs drop this process's
+leaderboard.
+"""
+
+TEAMS_KEY = "teams"
+
+
+def publish_teams_change():
+    if bus_enabled():
+        invalidation_bus.publish(TEAMS_KEY)
+
+
+def drop_leaderboard(key):
+    from .leaderboard import leaderboard
+
+    if leaderboard.built:
+        leaderboard.reset()
+
+
+invalidation_bus.subscribe(TEAMS_KEY, drop_leaderboard)
@@ -0,0 +1,155 @@
+import threading
+from bisect import bisect_left, insort
+from .models import Team
+from .signals import ChangesDuringReads, teams_changed
+
+
+"""
+In-process team leaderboard. For every ranked metric the teams are
+kept in an array sorted by value, highest first and by id on ties, so
+the top N is a slice and the rank of any team a bisect, without a
+COUNT over the team table. The arrays are built from one read of the
+team table on first use and kept current through the teams_changed
+signal, sent by signup, team saves and purchases. Teams changed while
+the table is read are read again after it.
+"""
+
+METRICS = ("final_value", "team_value", "budget")
+
+
+class Leaderboard:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._changes = ChangesDuringReads()
+        self.rebuilds = 0
+        self.refreshes = 0
+        self._clear()
+
+    @property
+    def built(self):
+        return self._built
+
+    def _clear(self):
+        self._teams = {}  # team id -> (name, values by metric)
+        self._ranked = {metric: [] for metric in METRICS}  # (-value, team id)
+
+    def _add(self, row):
+        team_id, name, *values = row
+        values = dict(zip(METRICS, values))
+        self._teams[team_id] = (name, values)
+        for metric in METRICS:
+            insort(self._ranked[metric], (-values[metric], team_id))
+
+    def _remove(self, team_id):
+        entry = self._teams.pop(team_id, None)
+        if entry is None:
+            return
+        for metric, value in entry[1].items():
+            ranked = self._ranked[metric]
+            del ranked[bisect_left(ranked, (-value, team_id))]
+
+    def rebuild(self):
+        teams_changed.connect(
+            self._on_teams_changed, weak=False, dispatch_uid="leaderboard"
+        )
+        with self._changes.reading() as changed:
+            teams = list(Team.objects.values_list("pk", "name", *METRICS))
+            with self._lock:
+                self._clear()
+                for team_id, name, *values in teams:
+                    self._teams[team_id] = (name, dict(zip(METRICS, values)))
+                for metric in METRICS:
+                    self._ranked[metric] = sorted(
+                        (-values[metric], team_id)
+                        for team_id, (_, values) in self._teams.items()
+                    )
+                self._built = True
+                self.rebuilds += 1
+        if changed:
+            self.refresh(changed)
+
+    def reset(self):
+        teams_changed.disconnect(dispatch_uid="leaderboard")
+        with self._lock:
+            self._clear()
+            self._built = False
+
+    def ensure_built(self):
+        if not self._built:
+            self.rebuild()
+
+    def refresh(self, team_ids):
+        rows = Team.objects.filter(pk__in=team_ids).values_list("pk", "name", *METRICS)
+        with self._lock:
+            for team_id in team_ids:
+                self._remove(team_id)
+            for row in rows:
+                self._add(row)
+            self.refreshes += 1
+
+    def _on_teams_changed(self, sender, team_ids, **kwargs):
+        self._changes.record(team_ids)
+        if self._built:
+            self.refresh(team_ids)
+
+    def _entry(self, metric, rank, team_id):
+        name, values = self._teams[team_id]
+        return {
+            "rank": rank,
+            "team_id": team_id,
+            "team_name": name,
+            metric: values[metric],
+        }
+
+    def top(self, metric, limit):
+        self.ensure_built()
+        with self._lock:
+            return [
+                self._entry(metric, rank, team_id)
+                for rank, (_, team_id) in enumerate(
+                    self._ranked[metric][:limit], start=1
+                )
+            ]
+
+    def rank(self, metric, team_id):
+        """Rank of the team, 1 for the highest value, or None."""
+        self.ensure_built()
+        with self._lock:
+            entry = self._teams.get(team_id)
+            if entry is None:
+                return None
+            key = (-entry[1][metric], team_id)
+            return dict(
+                self._entry(
+                    metric, bisect_left(self._ranked[metric], key) + 1, team_id
+                ),
+                of=len(self._teams),
+            )
+
+    def verify(self, limit=100):
+        """
+        Compare the top of every ranking against the database, read
+        through the team value indexes. Returns the mismatching metrics.
+        """
+        self.ensure_built()
+        mismatches = []
+        for metric in METRICS:
+            ranking = Team.objects.order_by(f"-{metric}", "pk")
+            expected = list(ranking.values_list("pk", flat=True)[:limit])
+            with self._lock:
+                ranked = [team_id for _, team_id in self._ranked[metric][:limit]]
+            if ranked != expected:
+                mismatches.append(metric)
+        return mismatches
+
+    def stats(self):
+        return {
+            "built": self._built,
+            "teams": len(self._teams),
+            "rebuilds": self.rebuilds,
+            "refreshes": self.refreshes,
+        }
+
+
+leaderboard = Leaderboard()
@@ -0,0 +1,148 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Sum
+from .models import Team, Player, Fixture, Standing, SeasonRollover
+from .match_engine import play_division, strength
+from .orderbook import in_batches
+
+
+"""
+League simulation. The teams without a standing for the season are
+ranked by final value and cut into divisions of LEAGUE_DIVISION_SIZE,
+so that teams meet others of similar value, and every division plays a
+double round robin. A team left alone, when the season resumes for a
+team which signed up after it was played, gets a standing without
+fixtures. Divisions are played in a process pool (see
+match_engine.py, which never touches the database) while the parent
+writes the results of the previous batch, fixtures and standings of a
+batch in one transaction. An interrupted season resumes with the
+teams which have no standing yet.
+"""
+
+
+def current_season():
+    # Seasons are numbered by the rollover which started them, 0 before the first
+    return SeasonRollover.objects.aggregate(season=Max("season"))["season"] or 0
+
+
+def divisions(team_ids, size):
+    # Two teams at least, so that every team plays
+    chunks = list(in_batches(team_ids, max(size, 2)))
+    if len(chunks) > 1 and len(chunks[-1]) < 2:
+        chunks[-2].extend(chunks.pop())  # A team alone has nobody to play
+    # The only team left sits the season out, with a standing all the same
+    return chunks
+
+
+def squad_strengths(team_ids):
+    values = {}
+    rows = (
+        Player.objects.filter(team__in=team_ids)
+        .values("team", "position")
+        .annotate(total=Sum("market_value"))
+        .values_list("team", "position", "total")
+        .order_by()
+    )
+    for team_id, position, total in rows:
+        values.setdefault(team_id, {})[position] = float(total)
+    return {team_id: strength(values.get(team_id, {})) for team_id in team_ids}
+
+
+FIXTURE_FIELDS = [
+    "season",
+    "division",
+    "round",
+    "home_team",
+    "away_team",
+    "home_goals",
+    "away_goals",
+]
+STANDING_FIELDS = [
+    "season",
+    "division",
+    "team",
+    "played",
+    "won",
+    "drawn",
+    "lost",
+    "goals_for",
+    "goals_against",
+    "points",
+]
+
+
+def insert_sql(db, model, fields):
+    quote = db.ops.quote_name
+    columns = ", ".join(quote(model._meta.get_field(name).column) for name in fields)
+    values = ", ".join(["%s"] * len(fields))
+    return f"INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({values})"
+
+
+def save_results(season, results):
+    # Plain integers, so written with executemany rather than model instances
+    fixtures, standings = [], []
+    for division, played, table in results:
+        fixtures.extend((season, division, *fixture) for fixture in played)
+        standings.extend(
+            (season, division, team_id, *row) for team_id, row in table.items()
+        )
+    db = transaction.get_connection()
+    with transaction.atomic(), db.cursor() as cursor:
+        cursor.executemany(insert_sql(db, Fixture, FIXTURE_FIELDS), fixtures)
+        cursor.executemany(insert_sql(db, Standing, STANDING_FIELDS), standings)
+    return len(fixtures)
+
+
+def simulate_season(season=None, division_size=None, workers=None, batch_size=None):
+    """
+    Play the season (the current one by default) for every team without
+    a standing in it yet. Returns the counts and the time it took.
+    """
+    season = current_season() if season is None else season
+    division_size = division_size or getattr(settings, "LEAGUE_DIVISION_SIZE", 20)
+    workers = workers or getattr(settings, "SIMULATION_WORKERS", None) or os.cpu_count()
+    batch_size = batch_size or getattr(settings, "SIMULATION_BATCH", 50)
+    started = time.monotonic()
+    last = Standing.objects.filter(season=season).aggregate(division=Max("division"))
+    team_ids = list(
+        Team.objects.exclude(standings__season=season)
+        .order_by("-final_value", "pk")
+        .values_list("pk", flat=True)
+    )
+    chunks = divisions(team_ids, division_size)
+
+    fixtures, pending = 0, None
+    executor = ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        numbered = enumerate(chunks, start=(last["division"] or 0) + 1)
+        for batch in in_batches(numbered, batch_size):
+            strengths = squad_strengths([pk for _, ids in batch for pk in ids])
+            jobs = [
+                (
+                    division,
+                    ids,
+                    {pk: strengths[pk] for pk in ids},
+                    f"{season}:{division}",
+                )
+                for division, ids in batch
+            ]
+            # In the pool, the batch is played while the previous one is saved
+            results = (executor.map if executor else map)(play_division, jobs)
+            if pending is not None:
+                fixtures += save_results(season, pending)
+            pending = results
+        if pending is not None:
+            fixtures += save_results(season, pending)
+    finally:
+        if executor:
+            executor.shutdown()
+    return {
+        "season": season,
+        "divisions": len(chunks),
+        "teams": sum(len(chunk) for chunk in chunks),
+        "fixtures": fixtures,
+        "seconds": time.monotonic() - started,
+    }
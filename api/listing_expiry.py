@@ -0,0 +1,163 @@
+import threading
+import time
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+from .models import Player, TransferList
+from .market_stats import record_delisted
+from .signals import notify_market_changed
+
+
+"""
+Listing expiry. Fixed price listings carry an expires_at,
+LISTING_TTL_DAYS after they were made, and the sweeper withdraws the
+expired ones: it walks the expires_at index oldest first, at most
+LISTING_SWEEP_BATCH listings per transaction, each batch with the same
+statements whatever its size: one DELETE of the listings (the market
+list is the same table), one UPDATE resetting the players'
+listing_status, the market statistics update and one market_changed
+notification. A batch which lost a listing to a purchase in the
+meantime is rolled back and read again. The sweeper runs from the
+expire_listings command, once or on an interval, or in every web
+process when LISTING_SWEEP_INTERVAL is set.
+"""
+
+MAX_CONFLICTS = 3  # Batches rolled back in a row before a pass gives up
+
+
+def sweep_batch_size():
+    return getattr(settings, "LISTING_SWEEP_BATCH", 500)
+
+
+def delete_expired(listing_ids, now):
+    # Not a queryset delete, whose signals notify one listing at a time
+    db = transaction.get_connection()
+    quote, meta = db.ops.quote_name, TransferList._meta
+    placeholders = ", ".join(["%s"] * len(listing_ids))
+    with db.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {quote(meta.db_table)} "
+            f"WHERE {quote(meta.pk.column)} IN ({placeholders}) "
+            f"AND {quote(meta.get_field('expires_at').column)} <= %s",
+            [*listing_ids, db.ops.adapt_datetimefield_value(now)],
+        )
+        return cursor.rowcount
+
+
+class ListingSweeper:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self.passes = 0
+        self.expired = 0
+        self.conflicts = 0
+        self.errors = 0
+        self._last_pass = None
+
+    def sweep(self, now=None, batch_size=None):
+        """
+        Withdraw every listing which expired at `now` or before. Returns
+        how many were withdrawn and how many batches were rolled back.
+        """
+        now = now or timezone.now()
+        batch_size = batch_size or sweep_batch_size()
+        started = time.monotonic()
+        expired, conflicts, in_a_row = 0, 0, 0
+        while in_a_row < MAX_CONFLICTS:
+            withdrawn = self._sweep_batch(now, batch_size)
+            if withdrawn is None:
+                conflicts += 1
+                in_a_row += 1
+                continue
+            expired, in_a_row = expired + withdrawn, 0
+            if withdrawn < batch_size:
+                break
+        with self._lock:
+            self.passes += 1
+            self.expired += expired
+            self.conflicts += conflicts
+            self._last_pass = {
+                "at": now,
+                "duration_ms": round((time.monotonic() - started) * 1000, 1),
+                "expired": expired,
+                "conflicts": conflicts,
+            }
+        return {"expired": expired, "conflicts": conflicts}
+
+    def _sweep_batch(self, now, batch_size):
+        with transaction.atomic():
+            # Rows rather than instances, with what the market statistics need
+            listings = list(
+                TransferList.objects.filter(expires_at__lte=now)
+                .order_by("expires_at")
+                .annotate(position=F("player__position"), country=F("player__country"))
+                .values_list(
+                    "pk", "player_id", "asking_price", "position", "country", named=True
+                )[:batch_size]
+            )
+            if not listings:
+                return 0
+            listing_ids = [listing.pk for listing in listings]
+            if delete_expired(listing_ids, now) != len(listing_ids):
+                # Bought or delisted since it was read
+                transaction.set_rollback(True)
+                return None
+            player_ids = [listing.player_id for listing in listings]
+            Player.objects.filter(pk__in=player_ids).update(listing_status="Not Listed")
+            record_delisted([(listing, listing.asking_price) for listing in listings])
+            notify_market_changed(player_ids)
+        return len(listings)
+
+    def start(self, interval):
+        """Sweep every `interval` seconds in a daemon thread, once per process."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, args=(interval,), daemon=True
+            )
+        self._thread.start()
+
+    def _run(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.sweep()
+            except DatabaseError:
+                # The next pass tries again
+                with self._lock:
+                    self.errors += 1
+            finally:
+                close_old_connections()
+
+    def stats(self):
+        # The backlog is read from the table, through the expiry index
+        backlog = TransferList.objects.filter(expires_at__lte=timezone.now()).aggregate(
+            due=Count("pk"), oldest=Min("expires_at")
+        )
+        with self._lock:
+            return {
+                "running": self._thread is not None,
+                "passes": self.passes,
+                "expired": self.expired,
+                "conflicts": self.conflicts,
+                "errors": self.errors,
+                "last_pass": self._last_pass,
+                "due": backlog["due"],
+                "oldest_due": backlog["oldest"],
+            }
+
+
+listing_sweeper = ListingSweeper()
+
+
+class ListingSweeperMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        interval = getattr(settings, "LISTING_SWEEP_INTERVAL", 0)
+        if interval:
+            listing_sweeper.start(interval)
+        return self.get_response(request)
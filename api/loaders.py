@@ -0,0 +1,67 @@
+from .models import Team, Player, TransferList
+
+
+"""
+Request-scoped entity loader. It is an identity map kept on the request,
+so serializers, views and helpers handling the same request share the
+rows they load instead of fetching them again. Players are loaded with
+their team, the team owner and their listing joined up front. Paths
+which write through what they loaded invalidate the loader afterwards.
+
+Reads per request with the loader (the token lookup, which also loads
+the user, is one more query done by TokenAuthentication):
+- buy_player: the player with team, owner and listing, and the buyer team
+- transfer_list POST: the player with team, owner and listing
+"""
+
+
+class EntityLoader:
+    def __init__(self, user=None):
+        self.user = user
+        self._players = {}
+        self._teams = {}
+
+    @classmethod
+    def for_request(cls, request):
+        # Keep the loader on the Django request, shared by DRF's wrapper
+        http_request = getattr(request, "_request", request)
+        loader = getattr(http_request, "entity_loader", None)
+        if loader is None:
+            user = getattr(request, "user", None)
+            loader = http_request.entity_loader = cls(
+                user if user is not None and user.is_authenticated else None
+            )
+        return loader
+
+    def player(self, player_id):
+        key = str(player_id)
+        if key not in self._players:
+            self._players[key] = (
+                Player.objects.select_related("team__owner", "transferlist")
+                .filter(pk=player_id)
+                .first()
+            )
+        return self._players[key]
+
+    def listing(self, player):
+        try:
+            return player.transferlist
+        except TransferList.DoesNotExist:
+            return None
+
+    def team(self, user):
+        if user.pk not in self._teams:
+            # Not user.team, cached on the user a batch shares between
+            # its operations
+            self._teams[user.pk] = Team.objects.get(owner=user)
+        return self._teams[user.pk]
+
+    def invalidate(self):
+        """Forget every loaded row, after a write which may have changed them."""
+        self._players.clear()
+        self._teams.clear()
+
+    def team_for_username(self, username):
+        if self.user is not None and self.user.username == username:
+            return self.team(self.user)
+        return Team.objects.get(owner__username=username)
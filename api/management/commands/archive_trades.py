@@ -0,0 +1,59 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from api.models import Trade, ArchivedTrade
+
+FIELDS = [
+    "id",
+    "player_id",
+    "seller_team_id",
+    "buyer_team_id",
+    "price",
+    "value_before",
+    "value_after",
+    "traded_at",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Move trades older than TRADE_LEDGER_RETENTION_DAYS from the live "
+        "ledger to the archive, oldest first and in batches, keeping their ids."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=getattr(settings, "TRADE_LEDGER_RETENTION_DAYS", 365),
+            help="Archive trades older than this many days.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=getattr(settings, "TRADE_ARCHIVE_BATCH", 10000),
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        moved = 0
+        while True:
+            with transaction.atomic():
+                # Ids grow with traded_at, so every batch is an id range
+                rows = list(
+                    Trade.objects.filter(traded_at__lt=cutoff)
+                    .order_by("pk")
+                    .values_list(*FIELDS)[: options["batch_size"]]
+                )
+                if not rows:
+                    break
+                ArchivedTrade.objects.bulk_create(
+                    ArchivedTrade(**dict(zip(FIELDS, row))) for row in rows
+                )
+                Trade.objects.filter(
+                    pk__gte=rows[0][0], pk__lte=rows[-1][0], traded_at__lt=cutoff
+                ).delete()
+            moved += len(rows)
+        self.stdout.write(f"Archived {moved} trades older than {cutoff:%Y-%m-%d}.")
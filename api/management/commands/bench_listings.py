@@ -0,0 +1,43 @@
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from api.models import Player, TransferList
+from api.helper import create_listings
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure listing write throughput: list and withdraw unlisted players "
+        "one at a time inside a transaction which is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--players", type=int, default=500)
+        parser.add_argument("--rounds", type=int, default=3)
+
+    def handle(self, *args, **options):
+        players = list(
+            Player.objects.filter(transferlist__isnull=True)[: options["players"]]
+        )
+        if not players:
+            self.stdout.write("No unlisted players to benchmark with.")
+            return
+
+        best = None
+        with transaction.atomic():
+            for _ in range(options["rounds"]):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    for player in players:
+                        create_listings([(player, Decimal("1000.00"))])
+                    elapsed = time.perf_counter() - started
+                TransferList.objects.filter(player__in=players).delete()
+                best = elapsed if best is None else min(best, elapsed)
+            transaction.set_rollback(True)
+
+        self.stdout.write(
+            f"{len(players)} listings: {len(players) / best:.0f} listings/s, "
+            f"{len(queries) / len(players):.1f} queries per listing"
+        )
@@ -0,0 +1,75 @@
+import random
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from api.models import Team, Player, TransferList
+from api.orderbook import order_book, in_batches
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure order book throughput: list players, then submit random "
+        "bids around their asking prices inside a transaction which is "
+        "rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--listings", type=int, default=500)
+        parser.add_argument("--bids", type=int, default=5000)
+        parser.add_argument(
+            "--batch", type=int, default=1, help="Bids submitted per call"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        teams = list(Team.objects.all())
+        players = list(
+            Player.objects.filter(transferlist__isnull=True)[: options["listings"]]
+        )
+        if len(teams) < 2 or not players:
+            self.stdout.write("Need at least two teams with unlisted players.")
+            return
+
+        with transaction.atomic():
+            asks = {player.pk: Decimal(rng.randint(1000, 5000)) for player in players}
+            TransferList.objects.bulk_create(
+                TransferList(player=player, asking_price=asks[player.pk])
+                for player in players
+            )
+            order_book.reset()
+            order_book.load()
+            before = order_book.stats()
+
+            bids = []
+            for _ in range(options["bids"]):
+                team = rng.choice(teams)
+                player = rng.choice(players)
+                if player.team_id != team.pk:
+                    # Most bids rest below the ask, some cross it
+                    price = (asks[player.pk] * Decimal(rng.uniform(0.7, 1.1))).quantize(
+                        Decimal("0.01")
+                    )
+                    bids.append((team, player, price))
+
+            started = time.perf_counter()
+            for batch in in_batches(bids, options["batch"]):
+                orders = {}
+                for team, player, price in batch:
+                    orders.setdefault(team, {})[player] = price
+                for team, team_orders in orders.items():
+                    order_book.submit(team, list(team_orders.items()))
+            elapsed = time.perf_counter() - started
+
+            after = order_book.stats()
+            transaction.set_rollback(True)
+        order_book.reset()
+
+        matched = after["matched"] - before["matched"]
+        self.stdout.write(
+            f"{len(bids)} bids on {len(players)} listings in {elapsed:.2f}s: "
+            f"{len(bids) / elapsed:.0f} bids/s, {matched} matches "
+            f"({matched / elapsed:.0f} matches/s) in "
+            f"{after['settled_batches'] - before['settled_batches']} settlements"
+        )
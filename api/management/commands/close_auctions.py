@@ -0,0 +1,38 @@
+import time
+from django.core.management.base import BaseCommand
+from api.auctions import auction_closer
+from api.market_snapshot import market_snapshot_writer
+
+
+class Command(BaseCommand):
+    help = (
+        "Close every auction which has ended: settle it with the best bid at "
+        "or above its reserve, or withdraw it. Runs once, or every --interval "
+        "seconds as the auction scheduler."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Seconds between passes; 0 runs a single pass.",
+        )
+
+    def handle(self, *args, **options):
+        interval = options["interval"]
+        while True:
+            started = time.monotonic()
+            result = auction_closer.close_due()
+            # Not left to the writer thread, which dies with a single pass
+            market_snapshot_writer.flush()
+            lag = auction_closer.stats()["last_pass"]["max_lag_ms"]
+            self.stdout.write(
+                f"Closed {result['sold'] + result['unsold']} auctions: "
+                f"{result['sold']} sold, {result['unsold']} unsold, "
+                f"{result['failed']} left open after conflicts, "
+                f"max lag {lag} ms."
+            )
+            if not interval:
+                return
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
@@ -0,0 +1,41 @@
+import time
+from django.core.management.base import BaseCommand
+from api.listing_expiry import listing_sweeper
+from api.market_snapshot import market_snapshot_writer
+
+
+class Command(BaseCommand):
+    help = (
+        "Withdraw every fixed price listing which has expired. Runs once, or "
+        "every --interval seconds as the listing sweeper."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Seconds between passes; 0 runs a single pass.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Listings withdrawn per transaction (LISTING_SWEEP_BATCH).",
+        )
+
+    def handle(self, *args, **options):
+        interval = options["interval"]
+        while True:
+            started = time.monotonic()
+            result = listing_sweeper.sweep(batch_size=options["batch_size"])
+            # Not left to the writer thread, which dies with a single pass
+            market_snapshot_writer.flush()
+            duration = listing_sweeper.stats()["last_pass"]["duration_ms"]
+            self.stdout.write(
+                f"Withdrew {result['expired']} expired listings in {duration} ms, "
+                f"{result['conflicts']} batches read again after conflicts."
+            )
+            if not interval:
+                return
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
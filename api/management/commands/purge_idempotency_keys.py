@@ -0,0 +1,16 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from api.models import IdempotencyRecord
+
+
+class Command(BaseCommand):
+    help = "Delete idempotency records older than IDEMPOTENCY_KEY_TTL."
+
+    def handle(self, *args, **options):
+        ttl = timedelta(seconds=getattr(settings, "IDEMPOTENCY_KEY_TTL", 86400))
+        deleted, _ = IdempotencyRecord.objects.filter(
+            created_at__lt=timezone.now() - ttl
+        ).delete()
+        self.stdout.write(f"Deleted {deleted} expired idempotency records.")
@@ -0,0 +1,110 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Sum
+from django.db.models.functions import TruncDate
+from api.models import TransferList, Trade, ArchivedTrade, MarketStat, DailySales
+from api.market_stats import DIMENSIONS
+
+STAT_FIELDS = ["listings", "total_price", "min_price", "max_price"]
+
+
+def expected_market_stats():
+    expected = {}
+    for dimension in DIMENSIONS:
+        rows = (
+            TransferList.objects.values(value=F(f"player__{dimension}"))
+            .annotate(
+                listings=Count("pk"),
+                total_price=Sum("asking_price"),
+                min_price=Min("asking_price"),
+                max_price=Max("asking_price"),
+            )
+            .order_by()
+        )
+        for row in rows:
+            expected[(dimension, row.pop("value"))] = row
+    return expected
+
+
+def expected_daily_sales():
+    expected = {}
+    for model in (Trade, ArchivedTrade):
+        rows = (
+            model.objects.annotate(day=TruncDate("traded_at"))
+            .values("day")
+            .annotate(sales=Count("pk"), volume=Sum("price"))
+            .order_by()
+        )
+        for row in rows:
+            day = expected.setdefault(row["day"], {"sales": 0, "volume": 0})
+            day["sales"] += row["sales"]
+            day["volume"] += row["volume"]
+    return expected
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the market statistics from the listings and the trade "
+        "ledger, report every row which drifted and optionally rewrite them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            help="Replace the stored statistics with the recomputed ones.",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            drift = self.compare_market_stats() + self.compare_daily_sales()
+            for line in drift:
+                self.stdout.write(line)
+            if drift and options["fix"]:
+                MarketStat.objects.all().delete()
+                MarketStat.objects.bulk_create(
+                    MarketStat(dimension=dimension, value=value, **row)
+                    for (dimension, value), row in expected_market_stats().items()
+                )
+                DailySales.objects.all().delete()
+                DailySales.objects.bulk_create(
+                    DailySales(day=day, **row)
+                    for day, row in expected_daily_sales().items()
+                )
+        fixed = " and fixed" if drift and options["fix"] else ""
+        self.stdout.write(f"Found{fixed} {len(drift)} drifted statistics.")
+
+    def compare_market_stats(self):
+        expected = expected_market_stats()
+        empty = dict.fromkeys(STAT_FIELDS, 0)
+        drift = []
+        stored = {
+            (stat.dimension, stat.value): stat for stat in MarketStat.objects.all()
+        }
+        for key in sorted(set(expected) | set(stored)):
+            row = expected.get(key, dict(empty, min_price=None, max_price=None))
+            stat = stored.get(key)
+            for field in STAT_FIELDS:
+                value = getattr(stat, field) if stat is not None else empty[field]
+                if field in ("min_price", "max_price") and value is None:
+                    continue  # Recomputed when next read, not drift
+                if value != row[field]:
+                    drift.append(
+                        f"{key[0]} {key[1]}: {field} is {value}, expected {row[field]}"
+                    )
+        return drift
+
+    def compare_daily_sales(self):
+        expected = expected_daily_sales()
+        stored = {sales.day: sales for sales in DailySales.objects.all()}
+        drift = []
+        for day in sorted(set(expected) | set(stored)):
+            row = expected.get(day, {"sales": 0, "volume": 0})
+            sales = stored.get(day)
+            for field in ("sales", "volume"):
+                value = getattr(sales, field) if sales is not None else 0
+                if value != row[field]:
+                    drift.append(
+                        f"sales {day}: {field} is {value}, expected {row[field]}"
+                    )
+        return drift
@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import DecimalField, F, IntegerField, Sum, Value
+from django.db.models.functions import Coalesce
+from api.helper import _per_row
+from api.models import Team
+from api.orderbook import in_batches
+from api.signals import notify_teams_changed
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute team_value (sum of the players' market values) and "
+        "final_value (budget plus team_value) of every team with one "
+        "aggregate query, and fix the teams which drifted in chunks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only print the teams which drifted and their values.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        drifted = list(self.drifted_teams())
+        for pk, team_value, final_value, _, expected_value, expected_final in drifted:
+            self.stdout.write(
+                f"Team {pk}: team_value {team_value:.2f} -> {expected_value:.2f}, "
+                f"final_value {final_value:.2f} -> {expected_final:.2f}"
+            )
+        if options["dry_run"]:
+            self.stdout.write(f"{len(drifted)} teams drifted, nothing changed.")
+            return
+
+        fixed = 0
+        for batch in in_batches(drifted, options["batch_size"]):
+            fixed += self.fix(batch)
+        self.stdout.write(f"Fixed {fixed} of {len(drifted)} drifted teams.")
+        if fixed < len(drifted):
+            self.stdout.write("The others changed meanwhile, run the command again.")
+
+    def drifted_teams(self):
+        # (pk, team_value, final_value, version, expected team and final values)
+        money = DecimalField(max_digits=10, decimal_places=2)
+        expected = Coalesce(Sum("players__market_value"), Value(0), output_field=money)
+        rows = (
+            Team.objects.annotate(expected_value=expected)
+            .order_by("pk")
+            .values_list(
+                "pk", "team_value", "final_value", "version", "budget", "expected_value"
+            )
+            .iterator()
+        )
+        # Compared as decimals in cents, some backends sum decimals as floats
+        for pk, team_value, final_value, version, budget, expected_value in rows:
+            expected_final = budget + expected_value
+            if team_value != expected_value or final_value != expected_final:
+                yield pk, team_value, final_value, version, expected_value, expected_final
+
+    def fix(self, batch):
+        values = {pk: expected for pk, _, _, _, expected, _ in batch}
+        versions = {pk: version for pk, _, _, version, _, _ in batch}
+        # Teams changed by a purchase since they were read are left alone
+        unchanged = Team.objects.filter(
+            pk__in=values, version=_per_row(versions, IntegerField())
+        )
+        with transaction.atomic():
+            fixed = unchanged.update(
+                team_value=_per_row(values),
+                final_value=F("budget") + _per_row(values),
+                version=F("version") + 1,
+            )
+            notify_teams_changed(values)
+        return fixed
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.valuation import revalue_players
+
+
+class Command(BaseCommand):
+    help = (
+        "Reprice every player from its age, position and recent trade prices "
+        "with the PLAYER_VALUATION model, refresh the team values in the same "
+        "pass and report the throughput."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=getattr(settings, "PLAYER_VALUATION_BATCH", 500),
+            help="Teams repriced per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        result = revalue_players(batch_teams=options["batch_size"])
+        seconds = max(result["seconds"], 1e-6)
+        self.stdout.write(
+            f"Repriced {result['players']} players of {result['teams']} teams "
+            f"in {seconds:.2f}s ({result['players'] / seconds:.0f} players/s)."
+        )
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.market_snapshot import market_snapshot_writer
+from api.seasons import current_rollover, roll_over_season
+
+
+class Command(BaseCommand):
+    help = (
+        "Age every player by a year, retire those older than "
+        "PLAYER_RETIREMENT_AGE and replace them with youth players, team by "
+        "team in chunks. An interrupted rollover resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=getattr(settings, "SEASON_ROLLOVER_BATCH", 1000),
+            help="Teams rolled over per transaction.",
+        )
+        parser.add_argument(
+            "--retirement-age",
+            type=int,
+            default=getattr(settings, "PLAYER_RETIREMENT_AGE", 40),
+        )
+
+    def handle(self, *args, **options):
+        rollover = current_rollover()
+        if rollover.last_team_id:
+            self.stdout.write(
+                f"Resuming season {rollover.season} after team {rollover.last_team_id}."
+            )
+        rollover = roll_over_season(
+            batch_size=options["batch_size"],
+            retirement_age=options["retirement_age"],
+        )
+        # Not left to the writer thread, which dies with the command
+        market_snapshot_writer.flush()
+        self.stdout.write(
+            f"Season {rollover.season}: rolled over {rollover.teams} teams, "
+            f"{rollover.players_retired} players retired and replaced."
+        )
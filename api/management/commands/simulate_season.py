@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.league import simulate_season
+
+
+class Command(BaseCommand):
+    help = (
+        "Play a season: divisions of teams of similar value play a double "
+        "round robin in a process pool, and the fixtures and standings are "
+        "saved in batches. An interrupted season resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--season", type=int, help="Defaults to the current season."
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=getattr(settings, "SIMULATION_WORKERS", None),
+            help="Worker processes, all the cores by default; 1 plays in process.",
+        )
+        parser.add_argument(
+            "--division-size",
+            type=int,
+            default=getattr(settings, "LEAGUE_DIVISION_SIZE", 20),
+        )
+
+    def handle(self, *args, **options):
+        result = simulate_season(
+            season=options["season"],
+            division_size=options["division_size"],
+            workers=options["workers"],
+        )
+        seconds = max(result["seconds"], 1e-6)
+        self.stdout.write(
+            f"Season {result['season']}: {result['teams']} teams played "
+            f"{result['fixtures']} fixtures in {result['divisions']} divisions "
+            f"in {seconds:.2f}s ({result['fixtures'] / seconds:.0f} fixtures/s)."
+        )
@@ -0,0 +1,188 @@
+import threading
+from bisect import bisect_left, bisect_right, insort
+from django.conf import settings
+from .models import MarketList
+from .coalesce import SingleFlight
+from .helper import show_market_list_data
+from .signals import ChangesDuringReads, market_changed
+
+
+"""
+Optional in-process index of all active market listings. Listings are
+kept in arrays sorted by asking price, with secondary buckets by
+position and country, so MarketListView filters and ordering are
+answered with bisect range lookups instead of joins. The index is
+built from the database on first use, by one caller while the others
+wait, and kept current through the market_changed signal. Listings
+changed while the market is read are read again after it.
+"""
+
+MAX_PLAYER_ID = "~"  # Sorts after every uuid string
+
+
+def active_market_queryset():
+    return MarketList.objects.select_related("player__team")
+
+
+class MarketIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._builds = SingleFlight()
+        self._changes = ChangesDuringReads()
+        self.rebuilds = 0
+        self.refreshes = 0
+        self._clear()
+
+    @property
+    def enabled(self):
+        return getattr(settings, "MARKET_INDEX_ENABLED", False)
+
+    @property
+    def built(self):
+        return self._built
+
+    def _clear(self):
+        self._entries = {}
+        self._by_price = []
+        self._by_position = {}
+        self._by_country = {}
+
+    def _buckets(self, entry):
+        return (
+            self._by_price,
+            self._by_position.setdefault(entry["position"], []),
+            self._by_country.setdefault(entry["player_country"], []),
+        )
+
+    def _add(self, market_list):
+        data = show_market_list_data(market_list)
+        player_id = str(data["player_id"])
+        key = (market_list.asking_price, player_id)
+        self._entries[player_id] = (key, data)
+        for bucket in self._buckets(data):
+            insort(bucket, key)
+
+    def _remove(self, player_id):
+        entry = self._entries.pop(player_id, None)
+        if entry is None:
+            return
+        key, data = entry
+        for bucket in self._buckets(data):
+            del bucket[bisect_left(bucket, key)]
+
+    def rebuild(self):
+        market_changed.connect(
+            self._on_market_changed, weak=False, dispatch_uid="market_index"
+        )
+        with self._changes.reading() as changed:
+            market = list(active_market_queryset())
+            with self._lock:
+                self._clear()
+                for market_list in market:
+                    self._add(market_list)
+                self._built = True
+                self.rebuilds += 1
+        if changed:
+            self.refresh(changed)
+
+    def reset(self):
+        market_changed.disconnect(dispatch_uid="market_index")
+        with self._lock:
+            self._clear()
+            self._built = False
+
+    def ensure_built(self):
+        # As PriceIndex.ensure_built, without the expiry
+        if not self._built:
+
+            def build():
+                if not self._built:
+                    self.rebuild()
+
+            self._builds.do("rebuild", build)
+
+    def refresh(self, player_ids):
+        player_ids = [str(player_id) for player_id in player_ids]
+        market = list(active_market_queryset().filter(player__in=player_ids))
+        with self._lock:
+            for player_id in player_ids:
+                self._remove(player_id)
+            for market_list in market:
+                self._add(market_list)
+            self.refreshes += 1
+
+    def _on_market_changed(self, sender, player_ids, **kwargs):
+        self._changes.record(player_ids)
+        if self._built:
+            self.refresh(player_ids)
+
+    def query(
+        self,
+        position=None,
+        country=None,
+        min_price=None,
+        max_price=None,
+        descending=False,
+    ):
+        self.ensure_built()
+        with self._lock:
+            # Range scan the smallest bucket, then filter the other attribute
+            candidates = [self._by_price]
+            if position:
+                candidates.append(self._by_position.get(position, []))
+            if country:
+                candidates.append(self._by_country.get(country, []))
+            bucket = min(candidates, key=len)
+            low = 0 if min_price is None else bisect_left(bucket, (min_price, ""))
+            high = (
+                len(bucket)
+                if max_price is None
+                else bisect_right(bucket, (max_price, MAX_PLAYER_ID))
+            )
+            results = []
+            for _, player_id in bucket[low:high]:
+                data = self._entries[player_id][1]
+                if position and data["position"] != position:
+                    continue
+                if country and data["player_country"] != country:
+                    continue
+                results.append(data)
+        if descending:
+            results.reverse()
+        return results
+
+    def verify(self):
+        """
+        Compare the index against the database and report listings that
+        are missing from the index, stale in it, or no longer active.
+        """
+        expected = {
+            str(data["player_id"]): data
+            for data in map(show_market_list_data, active_market_queryset())
+        }
+        with self._lock:
+            indexed = {
+                player_id: data for player_id, (_, data) in self._entries.items()
+            }
+        return {
+            "missing": sorted(set(expected) - set(indexed)),
+            "extra": sorted(set(indexed) - set(expected)),
+            "stale": sorted(
+                player_id
+                for player_id in set(expected) & set(indexed)
+                if expected[player_id] != indexed[player_id]
+            ),
+        }
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "built": self._built,
+            "size": len(self._entries),
+            "rebuilds": self.rebuilds,
+            "refreshes": self.refreshes,
+        }
+
+
+market_index = MarketIndex()
@@ -0,0 +1,359 @@
+import mmap
+import os
+import struct
+import threading
+import time
+import uuid
+from decimal import Decimal
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from .models import Player, TransferList
+from .market_index import active_market_queryset
+
+try:
+    import fcntl
+except ImportError:  # Windows, writers are not serialized across processes
+    fcntl = None
+
+
+"""
+Memory-mapped market snapshot shared by all worker processes.
+
+A writer publishes the active market as one binary file: a header, a
+fixed-width record array sorted by asking price and a string table.
+Each version is written to a temporary file and atomically renamed over
+the previous one. Readers mmap the current file read-only, so every
+worker on the host serves MarketListView from the same page cache copy.
+Market changes are handed to a background writer, which waits
+MARKET_SNAPSHOT_DELAY seconds to gather them and publishes once, and
+only when a changed player is listed or in the published snapshot.
+Management commands flush the writer themselves before they exit.
+"""
+
+MAGIC = b"MKTS"
+LAYOUT_VERSION = 1
+
+# magic, layout version, market version, record count, string table offset
+HEADER = struct.Struct("<4sHQII")
+# player uuid, asking price in cents, position code,
+# (offset, length) of player name, country and team name in the string table
+RECORD = struct.Struct("<16sqBIHIHIH")
+PRICE = struct.Struct("<q")
+PRICE_OFFSET = 16
+
+POSITIONS = [position for position, _ in Player.POSITIONS]
+POSITION_CODES = {position: code for code, position in enumerate(POSITIONS)}
+
+
+def snapshot_path():
+    return getattr(settings, "MARKET_SNAPSHOT_PATH", None)
+
+
+def _read_market_version(path):
+    try:
+        with open(path, "rb") as snapshot:
+            magic, _, version, _, _ = HEADER.unpack(snapshot.read(HEADER.size))
+    except (OSError, struct.error):
+        return 0
+    return version if magic == MAGIC else 0
+
+
+def _encode_market(market, version):
+    strings = bytearray()
+    offsets = {}
+
+    def intern(text):
+        encoded = text.encode("utf-8")
+        if encoded not in offsets:
+            offsets[encoded] = len(strings)
+            strings.extend(encoded)
+        return offsets[encoded], len(encoded)
+
+    rows = sorted(
+        (
+            (listing.asking_price, str(listing.player.id), listing.player)
+            for listing in market
+        ),
+        key=lambda row: row[:2],
+    )
+    records = bytearray()
+    for asking_price, _, player in rows:
+        records += RECORD.pack(
+            player.id.bytes,
+            int(asking_price * 100),
+            POSITION_CODES[player.position],
+            *intern(f"{player.first_name} {player.last_name}"),
+            *intern(player.country),
+            *intern(player.team.name),
+        )
+    header = HEADER.pack(
+        MAGIC, LAYOUT_VERSION, version, len(rows), HEADER.size + len(records)
+    )
+    return header + records + strings
+
+
+def publish_market_snapshot(path=None):
+    """
+    Write the current market to path with a bumped version and
+    atomically replace the previous snapshot. Returns the new version.
+    """
+    path = path or snapshot_path()
+    with open(f"{path}.lock", "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        version = _read_market_version(path) + 1
+        data = _encode_market(active_market_queryset(), version)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as snapshot:
+            snapshot.write(data)
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(temp_path, path)
+    return version
+
+
+def _published_player_ids(path):
+    # Raw uuid bytes of the players in the current snapshot
+    try:
+        with open(path, "rb") as snapshot:
+            data = snapshot.read()
+        magic, _, _, count, _ = HEADER.unpack_from(data)
+    except (OSError, struct.error):
+        return None
+    if magic != MAGIC:
+        return None
+    end = HEADER.size + count * RECORD.size
+    return {
+        RECORD.unpack_from(data, offset)[0]
+        for offset in range(HEADER.size, end, RECORD.size)
+    }
+
+
+class MarketSnapshotWriter:
+    def __init__(self, path=None, delay=None):
+        self._path = path
+        self._delay = delay
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = set()
+        self._thread = None
+        self.published = 0
+        self.skipped = 0
+        self.errors = 0
+
+    @property
+    def path(self):
+        return self._path or snapshot_path()
+
+    @property
+    def delay(self):
+        if self._delay is not None:
+            return self._delay
+        return getattr(settings, "MARKET_SNAPSHOT_DELAY", 0.5)
+
+    def schedule(self, player_ids):
+        """Queue changed players for the writer thread, started on first use."""
+        with self._lock:
+            self._pending.update(str(player_id) for player_id in player_ids)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _affects_market(self, player_ids):
+        published = _published_player_ids(self.path)
+        if published is None:
+            return True
+        if any(uuid.UUID(player_id).bytes in published for player_id in player_ids):
+            return True
+        return TransferList.objects.filter(player__in=player_ids).exists()
+
+    def flush(self):
+        """
+        Publish a new snapshot if any pending change touches the market.
+        Returns the new version, or None when nothing was published.
+        """
+        with self._publish_lock:
+            with self._lock:
+                player_ids, self._pending = self._pending, set()
+            if not player_ids:
+                return None
+            if not self._affects_market(player_ids):
+                with self._lock:
+                    self.skipped += 1
+                return None
+            version = publish_market_snapshot(self.path)
+            with self._lock:
+                self.published += 1
+            return version
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            # Changes arriving meanwhile go out with the same snapshot
+            time.sleep(self.delay)
+            self._wake.clear()
+            try:
+                self.flush()
+            except (DatabaseError, OSError):
+                # The next change publishes again
+                with self._lock:
+                    self.errors += 1
+            finally:
+                close_old_connections()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "running": self._thread is not None,
+                "pending": len(self._pending),
+                "published": self.published,
+                "skipped": self.skipped,
+                "errors": self.errors,
+            }
+
+
+market_snapshot_writer = MarketSnapshotWriter()
+
+
+def publish_on_market_change(sender, player_ids, **kwargs):
+    if snapshot_path():
+        market_snapshot_writer.schedule(player_ids)
+
+
+class MarketSnapshotReader:
+    def __init__(self, path=None):
+        self._path = path
+        self._lock = threading.Lock()
+        self._current = None
+        self._identity = None
+        self.version = 0
+        self.count = 0
+        self.remaps = 0
+
+    @property
+    def path(self):
+        return self._path or snapshot_path()
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _refresh_map(self):
+        """
+        Return (map, record count, string table offset) for the current
+        snapshot, remapping only when the file was replaced.
+        """
+        path = self.path
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            publish_market_snapshot(path)
+            stat = os.stat(path)
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if identity == self._identity:
+                return self._current
+            with open(path, "rb") as snapshot:
+                mapped = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, layout, version, count, strings_offset = HEADER.unpack_from(mapped)
+            if magic != MAGIC or layout != LAYOUT_VERSION:
+                mapped.close()
+                raise ValueError(f"{path} is not a market snapshot")
+            # The previous map stays valid for readers still using it and
+            # is released once they drop their reference
+            self._current = (mapped, count, strings_offset)
+            self._identity = identity
+            self.version = version
+            self.count = count
+            self.remaps += 1
+            return self._current
+
+    def _price_at(self, mapped, index):
+        return PRICE.unpack_from(
+            mapped, HEADER.size + index * RECORD.size + PRICE_OFFSET
+        )[0]
+
+    def _bisect(self, mapped, count, cents, right):
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            price = self._price_at(mapped, middle)
+            if price < cents or (right and price == cents):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def query(
+        self,
+        position=None,
+        country=None,
+        min_price=None,
+        max_price=None,
+        descending=False,
+    ):
+        mapped, count, strings = self._refresh_map()
+        low = (
+            0
+            if min_price is None
+            else self._bisect(mapped, count, min_price * 100, False)
+        )
+        high = (
+            count
+            if max_price is None
+            else self._bisect(mapped, count, max_price * 100, True)
+        )
+        position_code = POSITION_CODES.get(position) if position else None
+        country_bytes = country.encode("utf-8") if country else None
+
+        def raw(offset, length):
+            start = strings + offset
+            end = start + length
+            return mapped[start:end]
+
+        def text(offset, length):
+            return str(raw(offset, length), "utf-8")
+
+        results = []
+        for index in range(low, high):
+            (
+                player_id,
+                cents,
+                code,
+                name_offset,
+                name_length,
+                country_offset,
+                country_length,
+                team_offset,
+                team_length,
+            ) = RECORD.unpack_from(mapped, HEADER.size + index * RECORD.size)
+            if position and code != position_code:
+                continue
+            if country and raw(country_offset, country_length) != country_bytes:
+                continue
+            results.append(
+                {
+                    "player_id": uuid.UUID(bytes=player_id),
+                    "player_name": text(name_offset, name_length),
+                    "player_country": text(country_offset, country_length),
+                    "team_name": text(team_offset, team_length),
+                    "position": POSITIONS[code],
+                    "asking_price": f"$ {Decimal(cents).scaleb(-2)}",
+                }
+            )
+        if descending:
+            results.reverse()
+        return results
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "version": self.version,
+            "size": self.count,
+            "remaps": self.remaps,
+        }
+
+
+market_snapshot = MarketSnapshotReader()
@@ -0,0 +1,178 @@
+from datetime import timedelta
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+from django.db import transaction
+from django.db.models import (
+    Case,
+    DecimalField,
+    F,
+    IntegerField,
+    Max,
+    Min,
+    Q,
+    Value,
+    When,
+)
+from django.utils import timezone
+from .models import TransferList, MarketStat, DailySales
+
+
+"""
+Market statistics kept up to date incrementally. Every listing,
+delisting, repricing and sale applies its delta to the MarketStat rows
+of the player's position and country, and sales to the DailySales row
+of the day, with the same two statements whatever the number of rows.
+Deltas are applied once the transaction making the change commits, in
+a short transaction of their own, so purchases and listings don't hold
+the hot rows locked until they finish; a delta lost to a crash in
+between is drift for reconcile_market_stats. A minimum or maximum
+can't be maintained that way when its listing leaves the market: it is
+set to null then, and recomputed for that row alone when it is next
+read. reconcile_market_stats recomputes everything and reports the
+drift.
+"""
+
+DIMENSIONS = ("position", "country")
+MONEY = DecimalField(max_digits=16, decimal_places=2)
+
+
+def _groups(entries):
+    # (player, added prices, removed prices) -> both by MarketStat row
+    groups = {}
+    for player, added, removed in entries:
+        for dimension in DIMENSIONS:
+            key = (dimension, getattr(player, dimension))
+            group = groups.setdefault(key, ([], []))
+            group[0].extend(added)
+            group[1].extend(removed)
+    return groups
+
+
+def _extreme(row, field, added, removed, lowest):
+    """
+    Cases for the new min_price (lowest) or max_price of a row: null
+    when a removed price was the extreme, the added one when it is a
+    new extreme or the row was empty, unchanged otherwise. Right hand
+    sides of an UPDATE see the row as it was, so listings is the old
+    count.
+    """
+    reached = f"{field}__gte" if lowest else f"{field}__lte"
+    passed = f"{field}__gt" if lowest else f"{field}__lt"
+    whens = []
+    if removed:
+        hit = min(removed) if lowest else max(removed)
+        whens.append(When(row & Q(**{reached: hit}), then=Value(None)))
+    if added:
+        new = min(added) if lowest else max(added)
+        whens.append(When(row & (Q(listings=0) | Q(**{passed: new})), then=Value(new)))
+    return whens
+
+
+def _apply(entries):
+    """
+    Apply (player, added prices, removed prices) entries to the rows of
+    their positions and countries once the current transaction commits.
+    """
+    groups = _groups(entries)
+    if groups:
+        transaction.on_commit(lambda: _update(groups))
+
+
+@transaction.atomic
+def _update(groups):
+    # One INSERT making sure the rows exist, then one UPDATE
+    MarketStat.objects.bulk_create(
+        [MarketStat(dimension=dimension, value=value) for dimension, value in groups],
+        ignore_conflicts=True,
+    )
+    rows = {key: Q(dimension=key[0], value=key[1]) for key in groups}
+    listings, totals, minimums, maximums = [], [], [], []
+    for key, (added, removed) in groups.items():
+        row = rows[key]
+        listings.append(When(row, then=Value(len(added) - len(removed))))
+        delta = sum(added, Decimal(0)) - sum(removed, Decimal(0))
+        totals.append(When(row, then=Value(delta)))
+        minimums.extend(_extreme(row, "min_price", added, removed, lowest=True))
+        maximums.extend(_extreme(row, "max_price", added, removed, lowest=False))
+    MarketStat.objects.filter(reduce(or_, rows.values())).update(
+        listings=F("listings") + Case(*listings, output_field=IntegerField()),
+        total_price=F("total_price") + Case(*totals, output_field=MONEY),
+        min_price=Case(*minimums, default=F("min_price"), output_field=MONEY),
+        max_price=Case(*maximums, default=F("max_price"), output_field=MONEY),
+    )
+
+
+def record_listed(entries):
+    """Apply new listings, given as (player, asking_price) pairs."""
+    _apply((player, [price], []) for player, price in entries)
+
+
+def record_delisted(entries):
+    """Apply listings which left the market, as (player, asking_price)."""
+    _apply((player, [], [price]) for player, price in entries)
+
+
+def record_repriced(entries):
+    """Apply new asking prices, given as (player, old, new) triples."""
+    _apply((player, [new], [old]) for player, old, new in entries)
+
+
+def record_sold(prices):
+    """
+    Count sales at the given prices in today's DailySales row once the
+    current transaction commits.
+    """
+    today, count, volume = timezone.localdate(), len(prices), sum(prices)
+
+    def update():
+        DailySales.objects.bulk_create([DailySales(day=today)], ignore_conflicts=True)
+        DailySales.objects.filter(day=today).update(
+            sales=F("sales") + count, volume=F("volume") + volume
+        )
+
+    if count:
+        transaction.on_commit(update)
+
+
+"""
+Reading
+"""
+
+
+def _refresh_extremes(stat):
+    with transaction.atomic():
+        extremes = TransferList.objects.filter(
+            **{f"player__{stat.dimension}": stat.value}
+        ).aggregate(min_price=Min("asking_price"), max_price=Max("asking_price"))
+        MarketStat.objects.filter(pk=stat.pk).update(**extremes)
+    stat.min_price, stat.max_price = extremes["min_price"], extremes["max_price"]
+
+
+def market_stats(days=30):
+    stats = {dimension: [] for dimension in DIMENSIONS}
+    for stat in MarketStat.objects.filter(listings__gt=0).order_by("value"):
+        if stat.min_price is None or stat.max_price is None:
+            _refresh_extremes(stat)
+        stats[stat.dimension].append(
+            {
+                stat.dimension: stat.value,
+                "listings": stat.listings,
+                "total_price": stat.total_price,
+                "min_price": stat.min_price,
+                "max_price": stat.max_price,
+                "average_price": (stat.total_price / stat.listings).quantize(
+                    Decimal("0.01")
+                ),
+            }
+        )
+    since = timezone.localdate() - timedelta(days=days - 1)
+    return {
+        "by_position": stats["position"],
+        "by_country": stats["country"],
+        "daily_sales": list(
+            DailySales.objects.filter(day__gte=since)
+            .order_by("-day")
+            .values("day", "sales", "volume")
+        ),
+    }
@@ -0,0 +1,105 @@
+import math
+import random
+
+
+"""
+Match engine, free of Django so that it runs in pool worker processes.
+A squad's strength is an attack and a defence rating, each a weighted
+sum of the market values of its players by position. The goals of a
+side are Poisson distributed around GOALS_PER_SIDE, scaled by its
+attack against the opponent's defence and, at home, by HOME_ADVANTAGE.
+Each division is played from its own seed, so results don't depend on
+which worker plays it.
+"""
+
+ATTACK_WEIGHTS = {"Attacker": 1.0, "Midfielder": 0.5}
+DEFENCE_WEIGHTS = {"Goalkeeper": 0.5, "Defender": 1.0, "Midfielder": 0.5}
+GOALS_PER_SIDE = 1.35
+HOME_ADVANTAGE = 1.15
+
+# Points of a win, a draw and a loss
+POINTS = (3, 1, 0)
+
+
+def strength(values_by_position):
+    """(attack, defence) of a squad, given its total value by position."""
+    attack = sum(
+        weight * values_by_position.get(position, 0)
+        for position, weight in ATTACK_WEIGHTS.items()
+    )
+    defence = sum(
+        weight * values_by_position.get(position, 0)
+        for position, weight in DEFENCE_WEIGHTS.items()
+    )
+    return attack, defence
+
+
+def round_robin(team_ids):
+    """
+    Double round robin by the circle method: rounds of (home, away)
+    pairs, every team meeting every other once at home and once away.
+    With an odd number of teams one sits every round out.
+    """
+    teams = list(team_ids)
+    if len(teams) % 2:
+        teams.append(None)
+    half, rounds = len(teams) // 2, []
+    for number in range(len(teams) - 1):
+        pairs = zip(teams[:half], reversed(teams[half:]))
+        rounds.append(
+            [
+                (home, away) if number % 2 else (away, home)
+                for home, away in pairs
+                if home is not None and away is not None
+            ]
+        )
+        teams.insert(1, teams.pop())
+    return rounds + [[(away, home) for home, away in pairs] for pairs in rounds]
+
+
+def goals(expected, rng):
+    # Poisson sample (Knuth), fine for the few goals of a match
+    limit, count, product = math.exp(-expected), 0, rng.random()
+    while product > limit:
+        count += 1
+        product *= rng.random()
+    return count
+
+
+def play_match(home, away, rng):
+    (home_attack, home_defence), (away_attack, away_defence) = home, away
+    home_share = home_attack / ((home_attack + away_defence) or 1)
+    away_share = away_attack / ((away_attack + home_defence) or 1)
+    return (
+        goals(2 * GOALS_PER_SIDE * HOME_ADVANTAGE * home_share, rng),
+        goals(2 * GOALS_PER_SIDE * away_share, rng),
+    )
+
+
+def play_division(job):
+    """
+    Play a division: job is (division, team ids, strengths by team id,
+    seed). Returns the division, its fixtures as (round, home, away,
+    home goals, away goals) and its table as team id -> [played, won,
+    drawn, lost, goals for, goals against, points].
+    """
+    division, team_ids, strengths, seed = job
+    rng = random.Random(seed)
+    fixtures, table = [], {team_id: [0] * 7 for team_id in team_ids}
+    for number, pairs in enumerate(round_robin(team_ids), start=1):
+        for home, away in pairs:
+            home_goals, away_goals = play_match(strengths[home], strengths[away], rng)
+            fixtures.append((number, home, away, home_goals, away_goals))
+            for team, scored, conceded in (
+                (home, home_goals, away_goals),
+                (away, away_goals, home_goals),
+            ):
+                row = table[team]
+                # 1 won, 2 drawn, 3 lost
+                outcome = 1 if scored > conceded else 2 if scored == conceded else 3
+                row[0] += 1
+                row[outcome] += 1
+                row[4] += scored
+                row[5] += conceded
+                row[6] += POINTS[outcome - 1]
+    return division, fixtures, table
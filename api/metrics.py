@@ -0,0 +1,48 @@
+import threading
+
+
+"""
+Per-endpoint optimistic concurrency counters, reported by the metrics
+endpoint so the retry budget can be tuned against real contention.
+"""
+
+
+class ConflictStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _endpoint(self, endpoint):
+        # Must be called with self._lock held
+        return self._stats.setdefault(
+            endpoint, {"attempts": 0, "conflicts": 0, "exhausted": 0}
+        )
+
+    def record_attempt(self, endpoint):
+        with self._lock:
+            self._endpoint(endpoint)["attempts"] += 1
+
+    def record_conflict(self, endpoint):
+        with self._lock:
+            self._endpoint(endpoint)["conflicts"] += 1
+
+    def record_exhausted(self, endpoint):
+        with self._lock:
+            self._endpoint(endpoint)["exhausted"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                endpoint: dict(
+                    values,
+                    conflict_rate=(
+                        round(values["conflicts"] / values["attempts"], 4)
+                        if values["attempts"]
+                        else 0.0
+                    ),
+                )
+                for endpoint, values in self._stats.items()
+            }
+
+
+conflict_stats = ConflictStats()
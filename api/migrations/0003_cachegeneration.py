@@ -0,0 +1,24 @@
+# Generated by Django 5.0.1 on 2026-10-19 16:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0002_alter_customuser_username"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CacheGeneration",
+            fields=[
+                (
+                    "key",
+                    models.CharField(max_length=100, primary_key=True, serialize=False),
+                ),
+                ("generation", models.PositiveBigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-19 16:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0003_cachegeneration"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="player",
+            name="version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="team",
+            name="version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
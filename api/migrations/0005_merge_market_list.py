@@ -0,0 +1,37 @@
+# Generated by Django 5.0.1 on 2026-10-19 16:25
+
+from django.db import migrations
+
+
+def drop_listings_not_on_market(apps, schema_editor):
+    # Every listing is on the market from now on; listings which never
+    # made it there (a half-finished listing) are withdrawn instead
+    TransferList = apps.get_model("api", "TransferList")
+    Player = apps.get_model("api", "Player")
+    orphans = TransferList.objects.filter(marketlist__isnull=True)
+    Player.objects.filter(transferlist__in=orphans).update(listing_status="Not Listed")
+    orphans.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0004_team_player_version"),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_listings_not_on_market, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name="MarketList",
+        ),
+        migrations.CreateModel(
+            name="MarketList",
+            fields=[],
+            options={
+                "proxy": True,
+                "indexes": [],
+                "constraints": [],
+            },
+            bases=("api.transferlist",),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.1 on 2026-10-19 16:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0007_bid"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="transferlist",
+            name="auction_ends_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="bid",
+            index=models.Index(
+                fields=["player", "-price", "placed_at"], name="bid_best_price_idx"
+            ),
+        ),
+    ]
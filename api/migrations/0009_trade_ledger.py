@@ -0,0 +1,117 @@
+# Generated by Django 5.0.1 on 2026-10-19 16:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0008_auction"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedTrade",
+            fields=[
+                ("price", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("value_before", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("value_after", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("traded_at", models.DateTimeField()),
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                (
+                    "buyer_team",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="api.team",
+                    ),
+                ),
+                (
+                    "player",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="api.player",
+                    ),
+                ),
+                (
+                    "seller_team",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="api.team",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["player", "-id"], name="archived_trade_player_idx"
+                    ),
+                    models.Index(
+                        fields=["seller_team", "-id"], name="archived_trade_seller_idx"
+                    ),
+                    models.Index(
+                        fields=["buyer_team", "-id"], name="archived_trade_buyer_idx"
+                    ),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="Trade",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("price", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("value_before", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("value_after", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("traded_at", models.DateTimeField()),
+                (
+                    "buyer_team",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="api.team",
+                    ),
+                ),
+                (
+                    "player",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="api.player",
+                    ),
+                ),
+                (
+                    "seller_team",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="api.team",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["player", "-id"], name="trade_player_idx"),
+                    models.Index(
+                        fields=["seller_team", "-id"], name="trade_seller_idx"
+                    ),
+                    models.Index(fields=["buyer_team", "-id"], name="trade_buyer_idx"),
+                    models.Index(fields=["traded_at"], name="trade_traded_at_idx"),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.0.1 on 2026-10-19 16:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0009_trade_ledger"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailySales",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField(unique=True)),
+                ("sales", models.PositiveIntegerField(default=0)),
+                (
+                    "volume",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=16),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="MarketStat",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "dimension",
+                    models.CharField(
+                        choices=[("position", "Position"), ("country", "Country")],
+                        max_length=10,
+                    ),
+                ),
+                ("value", models.CharField(max_length=70)),
+                ("listings", models.IntegerField(default=0)),
+                (
+                    "total_price",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=16),
+                ),
+                (
+                    "min_price",
+                    models.DecimalField(decimal_places=2, max_digits=10, null=True),
+                ),
+                (
+                    "max_price",
+                    models.DecimalField(decimal_places=2, max_digits=10, null=True),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="marketstat",
+            constraint=models.UniqueConstraint(
+                fields=("dimension", "value"), name="unique_market_stat"
+            ),
+        ),
+    ]
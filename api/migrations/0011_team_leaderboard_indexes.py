@@ -0,0 +1,29 @@
+# Generated by Django 5.0.1 on 2026-10-19 16:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0010_market_stats"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="team",
+            index=models.Index(
+                fields=["-final_value", "id"], name="team_final_value_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="team",
+            index=models.Index(
+                fields=["-team_value", "id"], name="team_team_value_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="team",
+            index=models.Index(fields=["-budget", "id"], name="team_budget_idx"),
+        ),
+    ]
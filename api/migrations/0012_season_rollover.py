@@ -0,0 +1,38 @@
+# Generated by Django 5.0.1 on 2026-10-19 17:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0011_team_leaderboard_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SeasonRollover",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("season", models.PositiveIntegerField(unique=True)),
+                ("last_team_id", models.IntegerField(default=0)),
+                ("teams", models.PositiveIntegerField(default=0)),
+                ("players_retired", models.PositiveIntegerField(default=0)),
+                ("started_at", models.DateTimeField(auto_now_add=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="player",
+            name="season",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
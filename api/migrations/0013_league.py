@@ -0,0 +1,108 @@
+# Generated by Django 5.0.1 on 2026-10-19 17:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0012_season_rollover"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Fixture",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("season", models.PositiveIntegerField()),
+                ("division", models.PositiveIntegerField()),
+                ("round", models.PositiveSmallIntegerField()),
+                ("home_goals", models.PositiveSmallIntegerField()),
+                ("away_goals", models.PositiveSmallIntegerField()),
+                (
+                    "away_team",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="away_fixtures",
+                        to="api.team",
+                    ),
+                ),
+                (
+                    "home_team",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="home_fixtures",
+                        to="api.team",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["season", "division", "round"],
+                        name="fixture_division_idx",
+                    ),
+                    models.Index(
+                        fields=["home_team", "season"], name="fixture_home_idx"
+                    ),
+                    models.Index(
+                        fields=["away_team", "season"], name="fixture_away_idx"
+                    ),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="Standing",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("season", models.PositiveIntegerField()),
+                ("division", models.PositiveIntegerField()),
+                ("played", models.PositiveSmallIntegerField(default=0)),
+                ("won", models.PositiveSmallIntegerField(default=0)),
+                ("drawn", models.PositiveSmallIntegerField(default=0)),
+                ("lost", models.PositiveSmallIntegerField(default=0)),
+                ("goals_for", models.PositiveIntegerField(default=0)),
+                ("goals_against", models.PositiveIntegerField(default=0)),
+                ("points", models.PositiveIntegerField(default=0)),
+                (
+                    "team",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="standings",
+                        to="api.team",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["season", "division", "-points"],
+                        name="standing_table_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="standing",
+            constraint=models.UniqueConstraint(
+                fields=("season", "team"), name="unique_standing_per_season"
+            ),
+        ),
+    ]
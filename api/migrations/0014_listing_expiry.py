@@ -0,0 +1,38 @@
+# Generated by Django 5.0.1 on 2026-10-19 17:40
+
+import datetime
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def expire_existing_listings(apps, schema_editor):
+    # Listings made before expiry existed get a full TTL from now
+    days = getattr(settings, "LISTING_TTL_DAYS", 30)
+    if not days:
+        return
+    TransferList = apps.get_model("api", "TransferList")
+    TransferList.objects.filter(auction_ends_at__isnull=True).update(
+        expires_at=django.utils.timezone.now() + datetime.timedelta(days=days)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0013_league"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="transferlist",
+            name="created_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name="transferlist",
+            name="expires_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(expire_existing_listings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-19 18:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0014_listing_expiry"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="player",
+            name="season",
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+    ]
@@ -1,9 +1,13 @@
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
     PermissionsMixin,
 )
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from datetime import timedelta
 import pycountry
 import uuid
 
@@ -59,6 +63,16 @@ class Team(models.Model):
     )
     team_value = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     final_value = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Bumped by every purchase that changes the budget (optimistic locking)
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        # Leaderboard orderings, highest first and by id on ties
+        indexes = [
+            models.Index(fields=["-final_value", "id"], name="team_final_value_idx"),
+            models.Index(fields=["-team_value", "id"], name="team_team_value_idx"),
+            models.Index(fields=["-budget", "id"], name="team_budget_idx"),
+        ]
 
     def __str__(self):
         return self.name
@@ -93,38 +107,285 @@ class Player(models.Model):
         max_length=20, choices=LISTING_STATUS_CHOICES, default="Not Listed"
     )
     team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name="players")
+    # Bumped whenever the player changes owner (optimistic locking)
+    version = models.PositiveIntegerField(default=0)
+    # Last season rollover which aged the player (see seasons.py), indexed
+    # for the pass over players still behind the season
+    season = models.PositiveIntegerField(default=0, db_index=True)
 
     def __str__(self):
         return self.first_name + " " + self.last_name
 
 
 # Create Player Transfer List Model
+# (the single listing table, every listed player is on the market)
+
+
+def listing_expiry(created_at):
+    # Listings without an expiry stay until sold or delisted
+    days = getattr(settings, "LISTING_TTL_DAYS", 30)
+    return created_at + timedelta(days=days) if days else None
 
 
 class TransferList(models.Model):
     player = models.OneToOneField(Player, on_delete=models.CASCADE)
     asking_price = models.DecimalField(max_digits=10, decimal_places=2)
+    # Set for auctions, which go to the best bid at or above the asking
+    # price (the reserve) once they end, instead of selling at once
+    auction_ends_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    # Fixed price listings are withdrawn by the listing sweeper after
+    # LISTING_TTL_DAYS, auctions end at auction_ends_at instead
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
 
     def __str__(self):
         return f"{self.player.first_name} {self.player.last_name}"
 
+    @property
+    def is_auction(self):
+        return self.auction_ends_at is not None
+
     def team_name(self):
         return self.player.team.name
 
     def save(self, *args, **kwargs):
+        if self._state.adding and not self.is_auction and self.expires_at is None:
+            self.expires_at = listing_expiry(self.created_at)
         self.player.listing_status = "Listed"
-        self.player.save()
+        self.player.save(update_fields=["listing_status"])
         super().save(*args, **kwargs)
 
 
 # Create Market List Model
+# (the market view of the listing table, kept for its admin page)
 
 
-class MarketList(models.Model):
-    transfer_list = models.OneToOneField(TransferList, on_delete=models.CASCADE)
+class MarketList(TransferList):
+    class Meta:
+        proxy = True
 
-    def save(self, *args, **kwargs):
-        self.country = self.transfer_list.player.country
-        self.transfer_list.player.listing_status = "Listed"
-        self.transfer_list.player.save()
-        super().save(*args, **kwargs)
+
+# Create Bid Model (buy orders of the order book and bids on auctions)
+
+
+class Bid(models.Model):
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name="bids")
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name="bids")
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    # Time priority, reset whenever the bid is replaced
+    placed_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["player", "team"], name="unique_bid_per_team_and_player"
+            )
+        ]
+        indexes = [
+            # Best bid of every player first, as read when auctions close
+            models.Index(
+                fields=["player", "-price", "placed_at"], name="bid_best_price_idx"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.team.name} bids $ {self.price} for {self.player}"
+
+
+# Create Cache Generation Model (cross-process cache invalidation)
+
+
+class CacheGeneration(models.Model):
+    key = models.CharField(max_length=100, primary_key=True)
+    generation = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.key} @ {self.generation}"
+
+
+# Create Idempotency Record Model (responses replayed to retried POSTs)
+
+
+class IdempotencyRecord(models.Model):
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    # sha256 of method, path and body, a reused key must match it
+    fingerprint = models.CharField(max_length=64)
+    # Both null while the first request with this key is still running
+    status_code = models.PositiveSmallIntegerField(null=True)
+    body = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "key"], name="unique_idempotency_key_per_user"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.key}"
+
+
+# Create Trade Models (append-only ledger of every completed transfer)
+
+
+class TradeRecord(models.Model):
+    # Kept when the player or a team is deleted, the ledger is history
+    player = models.ForeignKey(Player, on_delete=models.SET_NULL, null=True)
+    seller_team = models.ForeignKey(
+        Team, on_delete=models.SET_NULL, null=True, related_name="+"
+    )
+    buyer_team = models.ForeignKey(
+        Team, on_delete=models.SET_NULL, null=True, related_name="+"
+    )
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    value_before = models.DecimalField(max_digits=10, decimal_places=2)
+    value_after = models.DecimalField(max_digits=10, decimal_places=2)
+    traded_at = models.DateTimeField()
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return f"{self.player_id} for $ {self.price} at {self.traded_at}"
+
+
+class Trade(TradeRecord):
+    # Ids grow with traded_at, history is paged by id newest first
+    class Meta:
+        indexes = [
+            models.Index(fields=["player", "-id"], name="trade_player_idx"),
+            models.Index(fields=["seller_team", "-id"], name="trade_seller_idx"),
+            models.Index(fields=["buyer_team", "-id"], name="trade_buyer_idx"),
+            models.Index(fields=["traded_at"], name="trade_traded_at_idx"),
+        ]
+
+
+class ArchivedTrade(TradeRecord):
+    # Trades older than TRADE_LEDGER_RETENTION_DAYS, same ids as in Trade
+    id = models.BigIntegerField(primary_key=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["player", "-id"], name="archived_trade_player_idx"),
+            models.Index(
+                fields=["seller_team", "-id"], name="archived_trade_seller_idx"
+            ),
+            models.Index(fields=["buyer_team", "-id"], name="archived_trade_buyer_idx"),
+        ]
+
+
+# Create Market Statistics Models (aggregates kept up to date by every
+# listing, delisting and sale, see market_stats.py)
+
+
+class MarketStat(models.Model):
+    DIMENSIONS = [("position", "Position"), ("country", "Country")]
+    dimension = models.CharField(max_length=10, choices=DIMENSIONS)
+    value = models.CharField(max_length=70)
+    listings = models.IntegerField(default=0)
+    total_price = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    # Null when there is no listing, or when the listing holding the
+    # extreme left the market, until the next read recomputes it
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["dimension", "value"], name="unique_market_stat"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.dimension} {self.value}: {self.listings} listings"
+
+
+class DailySales(models.Model):
+    day = models.DateField(unique=True)
+    sales = models.PositiveIntegerField(default=0)
+    volume = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.day}: {self.sales} sales"
+
+
+# Create Season Rollover Model (progress of the yearly aging, retirement
+# and youth regeneration of every squad, see seasons.py)
+
+
+class SeasonRollover(models.Model):
+    season = models.PositiveIntegerField(unique=True)
+    # Teams are rolled over in id order, up to and including this one
+    last_team_id = models.IntegerField(default=0)
+    teams = models.PositiveIntegerField(default=0)
+    players_retired = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Season {self.season}"
+
+
+# Create League Models (simulated seasons: teams play a double round robin
+# in divisions of similar value, see league.py)
+
+
+class Fixture(models.Model):
+    season = models.PositiveIntegerField()
+    division = models.PositiveIntegerField()
+    round = models.PositiveSmallIntegerField()
+    home_team = models.ForeignKey(
+        Team, on_delete=models.CASCADE, related_name="home_fixtures"
+    )
+    away_team = models.ForeignKey(
+        Team, on_delete=models.CASCADE, related_name="away_fixtures"
+    )
+    home_goals = models.PositiveSmallIntegerField()
+    away_goals = models.PositiveSmallIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["season", "division", "round"], name="fixture_division_idx"
+            ),
+            models.Index(fields=["home_team", "season"], name="fixture_home_idx"),
+            models.Index(fields=["away_team", "season"], name="fixture_away_idx"),
+        ]
+
+    def __str__(self):
+        return (
+            f"{self.home_team_id} {self.home_goals} - "
+            f"{self.away_goals} {self.away_team_id}"
+        )
+
+
+class Standing(models.Model):
+    season = models.PositiveIntegerField()
+    division = models.PositiveIntegerField()
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name="standings")
+    played = models.PositiveSmallIntegerField(default=0)
+    won = models.PositiveSmallIntegerField(default=0)
+    drawn = models.PositiveSmallIntegerField(default=0)
+    lost = models.PositiveSmallIntegerField(default=0)
+    goals_for = models.PositiveIntegerField(default=0)
+    goals_against = models.PositiveIntegerField(default=0)
+    points = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["season", "team"], name="unique_standing_per_season"
+            )
+        ]
+        indexes = [
+            # Division tables, best first
+            models.Index(
+                fields=["season", "division", "-points"], name="standing_table_idx"
+            )
+        ]
+
+    def __str__(self):
+        return f"Season {self.season}: {self.team_id} {self.points} points"
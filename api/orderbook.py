@@ -0,0 +1,430 @@
+import heapq
+import itertools
+import threading
+from collections import namedtuple
+from functools import reduce
+from operator import or_
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from .models import Team, Player, TransferList, Bid
+from .helper import Purchase, PurchaseConflict, settle_purchases
+from .metrics import conflict_stats
+from .signals import market_changed
+from .invalidation import publish_bids_change
+
+
+"""
+In-process order book for player transfers. Bids are buy orders kept
+in the Bid table; every TransferList entry is the ask for its player,
+except auctions, whose bids rest on the book until the auction closes.
+The engine keeps the best bids of every player in a heap ordered by
+price, then time, and executes a bid against the ask as soon as they
+cross. The price is the one of the order which was resting on the
+book: the asking price for a new bid, the bid price for a new or
+repriced listing. Matches are settled in batches, one transaction per
+batch, with the same statements as buy_player. The Bid and TransferList
+tables are the book, so it is rebuilt from them after a restart, and
+when another process changed them (see invalidation.py). A bid is
+claimed as it was read, by price and time, in the settling transaction,
+so one cancelled or replaced elsewhere in the meantime is never filled.
+"""
+
+RestingBid = namedtuple(
+    "RestingBid", ["bid_id", "player_id", "team_id", "price", "placed_at"]
+)
+Ask = namedtuple("Ask", ["listing_id", "player_id", "price"])
+Match = namedtuple("Match", ["bid", "ask", "price"])
+
+ENDPOINT = "order_book"
+
+
+def settle_batch_size():
+    return getattr(settings, "ORDER_BOOK_SETTLE_BATCH", 100)
+
+
+class StaleBid(PurchaseConflict):
+    pass
+
+
+def claimed_bids(bids):
+    # The bids as the book read them, not cancelled or replaced since
+    return reduce(
+        or_,
+        (Q(pk=bid.bid_id, price=bid.price, placed_at=bid.placed_at) for bid in bids),
+    )
+
+
+def in_batches(items, size):
+    items = iter(items)
+    batch = list(itertools.islice(items, size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(items, size))
+
+
+class OrderBook:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._sequence = itertools.count()
+        self._loaded = False
+        self._stale = False
+        self._local = threading.local()
+        self.matched = 0
+        self.batches = 0
+        self.cancelled = 0
+        self._clear()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def _clear(self):
+        self._bids = {}  # player id -> heap of (-price, sequence, bid id)
+        self._resting = {}  # bid id -> (RestingBid, sequence)
+        self._asks = {}  # player id -> Ask
+
+    def load(self):
+        bids = Bid.objects.order_by("placed_at", "pk").values_list(
+            "pk", "player_id", "team_id", "price", "placed_at"
+        )
+        asks = TransferList.objects.filter(auction_ends_at__isnull=True).values_list(
+            "pk", "player_id", "asking_price"
+        )
+        with self._lock:
+            self._clear()
+            for row in bids:
+                self._rest(RestingBid(*row))
+            for row in asks:
+                self._asks[row[1]] = Ask(*row)
+            self._loaded = True
+            self._stale = False
+        market_changed.connect(
+            self._on_market_changed, weak=False, dispatch_uid="order_book"
+        )
+
+    def reset(self):
+        market_changed.disconnect(dispatch_uid="order_book")
+        with self._lock:
+            self._clear()
+            self._loaded = False
+
+    def ensure_loaded(self):
+        if not self._loaded or self._stale:
+            self.load()
+
+    def invalidate(self):
+        # Another process changed the book, it is read again on next use
+        self._stale = True
+
+    """
+    Book keeping. Replaced and cancelled bids are left in the heaps and
+    skipped when they reach the top.
+    """
+
+    def _rest(self, bid):
+        sequence = next(self._sequence)
+        self._resting[bid.bid_id] = (bid, sequence)
+        heapq.heappush(
+            self._bids.setdefault(bid.player_id, []),
+            (-bid.price, sequence, bid.bid_id),
+        )
+
+    def _best_bid(self, player_id):
+        heap = self._bids.get(player_id)
+        while heap:
+            _, sequence, bid_id = heap[0]
+            resting = self._resting.get(bid_id)
+            if resting is not None and resting[1] == sequence:
+                return resting[0]
+            heapq.heappop(heap)
+        return None
+
+    def _cross(self, player_id, bid_is_taker):
+        ask = self._asks.get(player_id)
+        bid = self._best_bid(player_id)
+        if ask is None or bid is None or bid.price < ask.price:
+            return None
+        # Both orders leave the book until the match is settled
+        del self._resting[bid.bid_id]
+        del self._asks[player_id]
+        return Match(bid, ask, ask.price if bid_is_taker else bid.price)
+
+    def _refresh_asks(self, player_ids):
+        asks = TransferList.objects.filter(
+            player__in=player_ids, auction_ends_at__isnull=True
+        ).values_list("pk", "player_id", "asking_price")
+        for player_id in player_ids:
+            self._asks.pop(player_id, None)
+        for row in asks:
+            self._asks[row[1]] = Ask(*row)
+
+    """
+    Matching and settlement
+    """
+
+    def submit(self, team, orders):
+        """
+        Place or replace the team's bids, given as (player, price) pairs,
+        and execute the ones that cross. Returns one outcome per order.
+        """
+        self.ensure_loaded()
+        now = timezone.now()
+        saved = Bid.objects.bulk_create(
+            [
+                Bid(player=player, team=team, price=price, placed_at=now)
+                for player, price in orders
+            ],
+            update_conflicts=True,
+            unique_fields=["player", "team"],
+            update_fields=["price", "placed_at"],
+        )
+        if any(bid.pk is None for bid in saved):
+            # Backends which do not return ids of upserted rows
+            ids = dict(
+                Bid.objects.filter(
+                    team=team, player__in=[player for player, _ in orders]
+                ).values_list("player_id", "pk")
+            )
+            for bid in saved:
+                bid.pk = ids[bid.player_id]
+        publish_bids_change()
+        with self._lock:
+            for bid in saved:
+                self._rest(RestingBid(bid.pk, bid.player_id, team.pk, bid.price, now))
+            filled = self._match([bid.player_id for bid in saved], bid_is_taker=True)
+            return [
+                (
+                    {"status": "Filled", "price": filled[bid.pk]}
+                    if bid.pk in filled
+                    else {"status": "Open" if bid.pk in self._resting else "Cancelled"}
+                )
+                for bid in saved
+            ]
+
+    def cancel(self, team, player):
+        bid_ids = list(
+            Bid.objects.filter(team=team, player=player).values_list("pk", flat=True)
+        )
+        Bid.objects.filter(pk__in=bid_ids).delete()
+        self.discard(bid_ids)
+        publish_bids_change()
+        return bool(bid_ids)
+
+    def discard(self, bid_ids):
+        # Bids deleted from the table, e.g. with the auction they were for
+        with self._lock:
+            for bid_id in bid_ids:
+                self._resting.pop(bid_id, None)
+
+    def match_all(self):
+        """
+        Rebuild the book from the database, as after a restart, and
+        execute every order which crosses.
+        """
+        self.load()
+        with self._lock:
+            return self._match(list(self._asks), bid_is_taker=False)
+
+    def _on_market_changed(self, sender, player_ids, **kwargs):
+        # A new or repriced listing takes the best resting bid's price
+        if not self._loaded or getattr(self._local, "settling", False):
+            return
+        if self._stale:
+            self.load()
+        with self._lock:
+            self._refresh_asks(player_ids)
+            self._match(player_ids, bid_is_taker=False)
+
+    def _match(self, player_ids, bid_is_taker):
+        # Must be called with self._lock held
+        filled = {}
+        pending = list(dict.fromkeys(player_ids))
+        while pending:
+            matches = [self._cross(player_id, bid_is_taker) for player_id in pending]
+            matches = [match for match in matches if match is not None]
+            pending = []
+            for batch in in_batches(matches, settle_batch_size()):
+                batch_filled, rematch = self._settle(batch)
+                filled.update(batch_filled)
+                pending.extend(rematch)
+        return filled
+
+    def _settle(self, matches):
+        """
+        Settle one batch of matches in a single transaction, or one by
+        one when another process changed a row in the meantime. Returns
+        the price of every filled bid by bid id, and the players whose
+        ask went back on the book after a bid was cancelled.
+        """
+        purchases, bids, rematch = self._purchases(matches)
+        if not purchases:
+            return {}, rematch
+        conflict_stats.record_attempt(ENDPOINT)
+        try:
+            # Our own listing deletes are already off the book
+            self._local.settling = True
+            with transaction.atomic():
+                if Bid.objects.filter(claimed_bids(bids)).delete()[0] != len(bids):
+                    raise StaleBid()
+                settle_purchases(purchases)
+        except PurchaseConflict as conflict:
+            conflict_stats.record_conflict(ENDPOINT)
+            if len(purchases) > 1:
+                filled = {}
+                for match in matches:
+                    if match.bid in bids:
+                        match_filled, match_rematch = self._settle([match])
+                        filled.update(match_filled)
+                        rematch.extend(match_rematch)
+                return filled, rematch
+            # Read the ask again; the bid goes back on the book, unless it
+            # was cancelled or replaced by another process
+            player_id = matches[0].ask.player_id
+            self._refresh_asks([player_id])
+            if isinstance(conflict, StaleBid):
+                return {}, rematch + [player_id]
+            self._rest(bids[0])
+            return {}, rematch
+        finally:
+            self._local.settling = False
+        self.matched += len(purchases)
+        self.batches += 1
+        publish_bids_change()
+        return {
+            bid.bid_id: purchase.price for bid, purchase in zip(bids, purchases)
+        }, rematch
+
+    def _purchases(self, matches):
+        players = Player.objects.in_bulk([match.ask.player_id for match in matches])
+        listings = TransferList.objects.in_bulk(
+            [match.ask.listing_id for match in matches]
+        )
+        teams = Team.objects.only("budget", "version").in_bulk(
+            {match.bid.team_id for match in matches}
+        )
+        purchases, bids, cancelled, spent = [], [], [], {}
+        for match in matches:
+            bid, ask = match.bid, match.ask
+            listing, team = listings.get(ask.listing_id), teams.get(bid.team_id)
+            if listing is None or listing.asking_price != ask.price:
+                # The ask is stale, the bid stays on the book
+                self._refresh_asks([ask.player_id])
+                self._rest(bid)
+            elif team is None or players[ask.player_id].team_id == team.pk:
+                cancelled.append(match)
+            elif team.budget - spent.get(team.pk, 0) < match.price:
+                cancelled.append(match)
+            else:
+                spent[team.pk] = spent.get(team.pk, 0) + match.price
+                purchases.append(
+                    Purchase(listing, players[ask.player_id], team, match.price)
+                )
+                bids.append(bid)
+        if cancelled:
+            # Bids the team can no longer pay for, or for its own player;
+            # the ask goes to whoever is next in line
+            Bid.objects.filter(
+                claimed_bids([match.bid for match in cancelled])
+            ).delete()
+            publish_bids_change()
+            self.cancelled += len(cancelled)
+            for match in cancelled:
+                self._asks[match.ask.player_id] = match.ask
+        return purchases, bids, [match.ask.player_id for match in cancelled]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": self._loaded,
+                "resting_bids": len(self._resting),
+                "asks": len(self._asks),
+                "matched": self.matched,
+                "settled_batches": self.batches,
+                "cancelled_bids": self.cancelled,
+            }
+
+
+order_book = OrderBook()
+
+
+"""
+Helper functions for the bid views
+"""
+
+
+def place_bid(validated_data, username, loader):
+    player, price = validated_data["player_id"], validated_data["price"]
+    team = loader.team_for_username(username)
+    player_name = f"{player.first_name} {player.last_name}"
+    if player.team_id == team.pk:
+        return Response(
+            {"Warning": "You can't bid on your own team player."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if team.budget < price:
+        return Response(
+            {"Warning": "Your team budget is not enough for this bid."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    auction = loader.listing(player)
+    if auction is not None and auction.is_auction:
+        if auction.auction_ends_at <= timezone.now():
+            return Response(
+                {"Warning": "The auction for this player has ended."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if price < auction.asking_price:
+            return Response(
+                {"Warning": "Your bid is below the reserve price of the auction."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+    outcome = order_book.submit(team, [(player, price)])[0]
+    loader.invalidate()
+    if outcome["status"] == "Filled":
+        return Response(
+            {
+                "status": "Success",
+                "message": f"Congratulations *{username}*, you bought *{player_name}* for $ {outcome['price']}.",
+            },
+            status=status.HTTP_200_OK,
+        )
+    if outcome["status"] == "Open" and auction is not None and auction.is_auction:
+        return Response(
+            {
+                "status": "Open",
+                "message": f"Your bid of $ {price} for *{player_name}* is in the auction ending at {auction.auction_ends_at.isoformat()}.",
+            },
+            status=status.HTTP_201_CREATED,
+        )
+    if outcome["status"] == "Open":
+        return Response(
+            {
+                "status": "Open",
+                "message": f"Your bid of $ {price} for *{player_name}* is on the order book.",
+            },
+            status=status.HTTP_201_CREATED,
+        )
+    return Response(
+        {"Warning": "Your team budget is not enough for this bid."},
+        status=status.HTTP_400_BAD_REQUEST,
+    )
+
+
+def cancel_bid(validated_data, username, loader):
+    player = validated_data["player_id"]
+    cancelled = order_book.cancel(loader.team_for_username(username), player)
+    loader.invalidate()
+    if not cancelled:
+        return Response(
+            {"Warning": "You have no bid for this player."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    return Response(
+        {"status": "Success", "message": "Your bid was cancelled."},
+        status=status.HTTP_200_OK,
+    )
@@ -0,0 +1,312 @@
+import heapq
+import itertools
+import math
+import statistics
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import deque, namedtuple
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.utils import timezone
+from .models import TransferList, Trade
+from .signals import ChangesDuringReads, market_changed
+from .coalesce import SingleFlight
+
+
+"""
+Fair price suggestions. The players most similar to the one being
+listed, by position, age, country and market value, are looked up
+among the listings (at their asking prices) and the players sold in
+the last PRICE_SUGGESTION_TRADE_DAYS (at their prices), and the middle
+of their prices is suggested.
+
+Every comparable is a point of features computed once: log market
+value, age and country. Points are kept per position and age, sorted by
+log value. The k nearest are found by walking outwards from the
+player's value in every age at once, always taking the step whose value
+and age gaps are smallest, and stopping once those gaps alone are
+further than the k-th nearest found, so many players of the same value
+don't make it scan the whole position. The index is built with two
+queries on first use, then follows market_changed for listings and
+reads the trades recorded since the last one it has seen, dropping the
+expired ones. Revaluations and season ageing change players without
+touching listings, so it is also rebuilt after
+PRICE_SUGGESTION_CACHE_SECONDS, by one request while the others keep
+using the old one.
+"""
+
+# Distance units: a factor of 2 in market value, 5 years, another country
+VALUE_SCALE = math.log(2)
+AGE_SCALE = 5
+COUNTRY_DISTANCE = 0.5
+
+DEFAULT_NEIGHBOURS = 10
+MAX_NEIGHBOURS = 50
+
+Point = namedtuple("Point", "log_value age country price")
+
+
+def log_value(market_value):
+    return math.log(max(float(market_value), 1.0)) / VALUE_SCALE
+
+
+def distance(point, log_value, age, country):
+    gap = abs(point.log_value - log_value) + abs(point.age - age) / AGE_SCALE
+    return gap + (COUNTRY_DISTANCE if point.country != country else 0)
+
+
+class PriceIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._builds = SingleFlight()
+        self._refreshing = threading.Lock()
+        self._changes = ChangesDuringReads()
+        self._built_at = None
+        self.rebuilds = 0
+        self.refreshes = 0
+        self._clear()
+
+    @property
+    def built(self):
+        return self._built_at is not None
+
+    def _clear(self):
+        self._points = {}  # key -> (position, Point)
+        self._by_position = {}  # position -> age -> sorted (log value, key)
+        self._sold = deque()  # (traded_at, key) of sold points, oldest first
+        self._last_trade_id = 0
+
+    def _add(self, key, position, point, sort=True):
+        # Rebuilds sort every position once instead
+        self._points[key] = (position, point)
+        ages = self._by_position.setdefault(position, {})
+        points = ages.setdefault(point.age, [])
+        if sort:
+            insort(points, (point.log_value, key))
+        else:
+            points.append((point.log_value, key))
+
+    def _remove(self, key):
+        entry = self._points.pop(key, None)
+        if entry is None:
+            return
+        position, point = entry
+        ages = self._by_position[position]
+        points = ages[point.age]
+        del points[bisect_left(points, (point.log_value, key))]
+        if not points:
+            del ages[point.age]
+
+    def _add_listing(self, row, sort=True):
+        player_id, price, position, age, country, market_value = row
+        point = Point(log_value(market_value), age, country, price)
+        self._add(("listed", str(player_id)), position, point, sort)
+
+    def _add_trades(self, rows, sort=True):
+        for trade_id, price, value, position, age, country, traded_at in rows:
+            key = ("sold", trade_id)
+            point = Point(log_value(value), age, country, price)
+            self._add(key, position, point, sort)
+            self._sold.append((traded_at, key))
+            self._last_trade_id = max(self._last_trade_id, trade_id)
+
+    def _trades(self, since, after_id=0):
+        # Priced at the player's value when sold
+        return list(
+            Trade.objects.filter(
+                traded_at__gte=since, pk__gt=after_id, player__isnull=False
+            )
+            .order_by("pk")
+            .values_list(
+                "pk",
+                "price",
+                "value_before",
+                "player__position",
+                "player__age",
+                "player__country",
+                "traded_at",
+            )
+        )
+
+    def _window(self):
+        days = getattr(settings, "PRICE_SUGGESTION_TRADE_DAYS", 90)
+        return timezone.now() - timedelta(days=days)
+
+    def _expire(self, since):
+        while self._sold and self._sold[0][0] < since:
+            self._remove(self._sold.popleft()[1])
+
+    def rebuild(self):
+        # Listings changed while they are read are read again after
+        market_changed.connect(
+            self._on_market_changed, weak=False, dispatch_uid="price_index"
+        )
+        with self._changes.reading() as changed:
+            since = self._window()
+            listings = list(
+                TransferList.objects.values_list(
+                    "player_id",
+                    "asking_price",
+                    "player__position",
+                    "player__age",
+                    "player__country",
+                    "player__market_value",
+                )
+            )
+            trades = self._trades(since)
+            with self._lock:
+                self._clear()
+                for row in listings:
+                    self._add_listing(row, sort=False)
+                self._add_trades(trades, sort=False)
+                for ages in self._by_position.values():
+                    for points in ages.values():
+                        points.sort()
+                self._built_at = time.monotonic()
+                self.rebuilds += 1
+        if changed:
+            self.refresh(changed)
+
+    def reset(self):
+        market_changed.disconnect(dispatch_uid="price_index")
+        with self._lock:
+            self._clear()
+            self._built_at = None
+
+    def _expired(self):
+        ttl = getattr(settings, "PRICE_SUGGESTION_CACHE_SECONDS", 300)
+        built_at = self._built_at
+        return built_at is None or time.monotonic() - built_at > ttl
+
+    def ensure_built(self):
+        # As Recommender.ensure_built
+        if not self.built:
+
+            def build():
+                if not self.built:
+                    self.rebuild()
+
+            self._builds.do("rebuild", build)
+        elif self._expired() and self._refreshing.acquire(blocking=False):
+            try:
+                if self._expired():  # Another caller may have just rebuilt it
+                    self.rebuild()
+            finally:
+                self._refreshing.release()
+
+    def refresh(self, player_ids):
+        # Sales remove listings, so trades are read along with them
+        player_ids = [str(player_id) for player_id in player_ids]
+        listings = list(
+            TransferList.objects.filter(player__in=player_ids).values_list(
+                "player_id",
+                "asking_price",
+                "player__position",
+                "player__age",
+                "player__country",
+                "player__market_value",
+            )
+        )
+        since = self._window()
+        trades = self._trades(since, self._last_trade_id)
+        with self._lock:
+            for player_id in player_ids:
+                self._remove(("listed", player_id))
+            for row in listings:
+                self._add_listing(row)
+            self._add_trades(trades)
+            self._expire(since)
+            self.refreshes += 1
+
+    def _on_market_changed(self, sender, player_ids, **kwargs):
+        self._changes.record(player_ids)
+        if self.built:
+            self.refresh(player_ids)
+
+    def nearest(self, position, age, country, market_value, k, exclude=None):
+        """The k nearest points as (distance, kind, price), nearest first."""
+        self.ensure_built()
+        target = log_value(market_value)
+        nearest = []  # Max-heap of (-distance, key, point)
+        # Min-heap of the next step of every walk: (value and age gap,
+        # tie breaker, age gap, points, index, direction)
+        steps, order = [], itertools.count()
+
+        def step(points, index, direction, age_gap):
+            if 0 <= index < len(points):
+                gap = abs(points[index][0] - target) + age_gap
+                entry = (gap, next(order), age_gap, points, index, direction)
+                heapq.heappush(steps, entry)
+
+        with self._lock:
+            for point_age, points in self._by_position.get(position, {}).items():
+                age_gap = abs(point_age - age) / AGE_SCALE
+                above = bisect_left(points, (target,))
+                step(points, above - 1, -1, age_gap)
+                step(points, above, 1, age_gap)
+            while steps:
+                gap, _, age_gap, points, index, direction = heapq.heappop(steps)
+                if len(nearest) == k and gap >= -nearest[0][0]:
+                    break  # Everything further out is at least this far
+                key = points[index][1]
+                step(points, index + direction, direction, age_gap)
+                if key == exclude:
+                    continue
+                point = self._points[key][1]
+                entry = (-distance(point, target, age, country), key, point)
+                if len(nearest) < k:
+                    heapq.heappush(nearest, entry)
+                elif entry[0] > nearest[0][0]:
+                    heapq.heapreplace(nearest, entry)
+        return sorted(
+            (-negative, key[0], point.price) for negative, key, point in nearest
+        )
+
+    def suggest(self, player, k=DEFAULT_NEIGHBOURS):
+        """
+        Asking price suggestion for the player: the median price of its k
+        nearest comparables, with their interquartile range.
+        """
+        nearest = self.nearest(
+            player.position,
+            player.age,
+            player.country,
+            player.market_value,
+            k,
+            exclude=("listed", str(player.pk)),
+        )
+        prices = sorted(price for _, _, price in nearest)
+        suggestion = {
+            "player_id": player.pk,
+            "market_value": f"$ {player.market_value}",
+            "comparables": len(nearest),
+            "suggested_price": None,
+            "price_range": None,
+            "similar": [
+                {"distance": round(gap, 3), "kind": kind, "price": f"$ {price}"}
+                for gap, kind, price in nearest
+            ],
+        }
+        if prices:
+            quarter = (len(prices) - 1) // 4
+            median = Decimal(statistics.median(prices)).quantize(Decimal("0.01"))
+            suggestion["suggested_price"] = f"$ {median}"
+            suggestion["price_range"] = {
+                "low": f"$ {prices[quarter]}",
+                "high": f"$ {prices[-1 - quarter]}",
+            }
+        return suggestion
+
+    def stats(self):
+        return {
+            "built": self.built,
+            "points": len(self._points),
+            "sold": len(self._sold),
+            "rebuilds": self.rebuilds,
+            "refreshes": self.refreshes,
+        }
+
+
+price_index = PriceIndex()
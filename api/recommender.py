@@ -0,0 +1,359 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import namedtuple
+from decimal import Decimal
+from django.conf import settings
+from .models import Player, TransferList
+from .signals import ChangesDuringReads, market_changed
+from .coalesce import SingleFlight
+
+
+"""
+Squad recommender. Given a budget and how many players are wanted per
+position, it picks the listed players, auctions and the team's own
+listings aside, with the highest total market value whose asking
+prices fit the budget: a knapsack with a count per position, solved by
+branch and bound.
+
+Only few listings can be part of an answer: when k players of a
+position are wanted, a listing is never needed if k others at most as
+expensive are worth at least as much. The per-process cache keeps, for
+every position, the listings fewer than MAX_PER_POSITION plus the most
+listings one team has there plus SLACK others dominate this way, a few
+hundred of 100k. It is built with one query and then follows
+market_changed: new listings are added, and every change spends one
+unit of the position's slack, the position being rebuilt once it runs
+out, and listings changed while it is read are read again after it.
+Requests narrow that down to the exact candidates in one pass.
+Batch revaluations change market values without touching listings, so
+the cache is also rebuilt after RECOMMENDER_CACHE_SECONDS, by one
+request while the others keep answering from the old one. Answers are
+cached until the market changes.
+"""
+
+MAX_PER_POSITION = 5
+SLACK = 50  # Changes a position absorbs before it is rebuilt
+NODE_LIMIT = 100000  # Branch and bound gives its best answer so far past this
+RESULT_CACHE_SIZE = 1024
+
+POSITIONS = [position for position, _ in Player.POSITIONS]
+
+# Prices and values in cents; ordered by price, then value descending
+Listing = namedtuple("Listing", "price rank player_id value team_id row")
+
+FIELDS = [
+    "player_id",
+    "asking_price",
+    "player__market_value",
+    "player__position",
+    "player__team_id",
+    "player__first_name",
+    "player__last_name",
+    "player__country",
+    "player__team__name",
+]
+
+
+def cents(amount):
+    return int(amount * 100)
+
+
+def listing_queryset():
+    # Auctions go to the best bid, they can't be bought at the asking price
+    return TransferList.objects.filter(auction_ends_at__isnull=True).values_list(
+        *FIELDS
+    )
+
+
+def make_listing(row):
+    _, price, value, _, team_id, *_ = row
+    return Listing(cents(price), -cents(value), str(row[0]), cents(value), team_id, row)
+
+
+def describe(listing):
+    player_id, price, value, position, _, first, last, country, team = listing.row
+    return {
+        "player_id": player_id,
+        "player_name": f"{first} {last}",
+        "player_country": country,
+        "team_name": team,
+        "position": position,
+        "asking_price": f"$ {price}",
+        "market_value": f"$ {value}",
+    }
+
+
+def skyline(listings, depth, budget=None, team_id=None):
+    """
+    The listings, sorted by price then value descending, that fewer than
+    depth listings at most as expensive are worth at least as much as,
+    leaving out those over the budget or of the team.
+    """
+    best, kept = [], []  # Min-heap of the depth highest values seen
+    for listing in listings:
+        if budget is not None and listing.price > budget:
+            break
+        if listing.team_id == team_id:
+            continue
+        if len(best) < depth:
+            heapq.heappush(best, listing.value)
+        elif listing.value > best[0]:
+            heapq.heapreplace(best, listing.value)
+        else:
+            continue
+        kept.append(listing)
+    return kept
+
+
+def solve(groups, budget, node_limit=NODE_LIMIT):
+    """
+    Pick count listings of every (count, listings) group, with prices
+    summing to at most budget, maximizing the sum of values. Returns the
+    picks (or None when nothing fits) and whether the search completed.
+    """
+    groups = [
+        (count, sorted(listings, key=lambda listing: (-listing.value, listing.price)))
+        for count, listings in groups
+    ]
+    if any(len(listings) < count for count, listings in groups):
+        return None, True
+    # Bounds: the best values left in a group are the next ones in value
+    # order, the cheapest completion takes the cheapest of every group
+    value_sums, cheapest = [], []
+    for count, listings in groups:
+        sums = [0]
+        for listing in listings:
+            sums.append(sums[-1] + listing.value)
+        value_sums.append(sums)
+        prices = sorted(listing.price for listing in listings)[:count]
+        cheapest.append([sum(prices[:taken]) for taken in range(count + 1)])
+    best_after, cheapest_after = [0] * (len(groups) + 1), [0] * (len(groups) + 1)
+    for index in range(len(groups) - 1, -1, -1):
+        count = groups[index][0]
+        best_after[index] = best_after[index + 1] + value_sums[index][count]
+        cheapest_after[index] = cheapest_after[index + 1] + cheapest[index][count]
+
+    best = {"value": -1, "picks": None}
+    nodes, picks = 0, []
+
+    def search(group, need, start, budget, value):
+        nonlocal nodes
+        if need == 0:
+            group += 1
+            if group == len(groups):
+                if value > best["value"]:
+                    best["value"], best["picks"] = value, list(picks)
+                return
+            need, start = groups[group][0], 0
+        nodes += 1
+        if nodes > node_limit:
+            return
+        listings, sums = groups[group][1], value_sums[group]
+        rest = cheapest[group][need - 1] + cheapest_after[group + 1]
+        for index in range(start, len(listings) - need + 1):
+            bound = value + sums[index + need] - sums[index] + best_after[group + 1]
+            if bound <= best["value"]:
+                break  # Values only decrease from here
+            listing = listings[index]
+            if listing.price + rest > budget:
+                continue
+            picks.append(listing)
+            search(
+                group,
+                need - 1,
+                index + 1,
+                budget - listing.price,
+                value + listing.value,
+            )
+            picks.pop()
+
+    if cheapest_after[0] <= budget:
+        search(-1, 0, 0, budget, 0)
+    return best["picks"], nodes <= node_limit
+
+
+class Recommender:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._builds = SingleFlight()
+        self._refreshing = threading.Lock()
+        self._changes = ChangesDuringReads()
+        self._built_at = None
+        self.version = 0
+        self.rebuilds = 0
+        self.hits = 0
+        self.misses = 0
+        self._clear()
+
+    @property
+    def built(self):
+        return self._built_at is not None
+
+    def _clear(self):
+        self._listed = {position: set() for position in POSITIONS}  # player ids
+        self._candidates = {position: [] for position in POSITIONS}  # sorted
+        self._cached = {position: {} for position in POSITIONS}  # id -> Listing
+        self._slack = dict.fromkeys(POSITIONS, 0)
+        self._results = {}
+
+    def _build(self, position, listings):
+        per_team = {}
+        for listing in listings:
+            per_team[listing.team_id] = per_team.get(listing.team_id, 0) + 1
+        depth = MAX_PER_POSITION + max(per_team.values(), default=0) + SLACK
+        candidates = skyline(sorted(listings), depth)
+        self._listed[position] = {listing.player_id for listing in listings}
+        self._candidates[position] = candidates
+        self._cached[position] = {listing.player_id: listing for listing in candidates}
+        self._slack[position] = SLACK
+
+    def rebuild(self, positions=POSITIONS):
+        # Listings changed while they are read are read again after
+        market_changed.connect(
+            self._on_market_changed, weak=False, dispatch_uid="recommender"
+        )
+        with self._changes.reading() as changed:
+            listings = {position: [] for position in positions}
+            for row in listing_queryset().filter(player__position__in=positions):
+                listing = make_listing(row)
+                listings[listing.row[3]].append(listing)
+            with self._lock:
+                for position in positions:
+                    self._build(position, listings[position])
+                if positions is POSITIONS:
+                    self._built_at = time.monotonic()
+                    self.rebuilds += 1
+                self._results.clear()
+                self.version += 1
+        if changed:
+            self.refresh(changed)
+
+    def reset(self):
+        market_changed.disconnect(dispatch_uid="recommender")
+        with self._lock:
+            self._clear()
+            self._built_at = None
+
+    def _expired(self):
+        ttl = getattr(settings, "RECOMMENDER_CACHE_SECONDS", 300)
+        built_at = self._built_at
+        return built_at is None or time.monotonic() - built_at > ttl
+
+    def ensure_built(self):
+        """
+        Build the cache on first use, concurrent callers sharing one
+        build. Once it expires, the first caller rebuilds it and the
+        others carry on with the old one meanwhile.
+        """
+        if not self.built:
+
+            def build():
+                if not self.built:
+                    self.rebuild()
+
+            self._builds.do("rebuild", build)
+        elif self._expired() and self._refreshing.acquire(blocking=False):
+            try:
+                if self._expired():  # Another caller may have just rebuilt it
+                    self.rebuild()
+            finally:
+                self._refreshing.release()
+
+    def refresh(self, player_ids):
+        player_ids = [str(player_id) for player_id in player_ids]
+        rows = list(listing_queryset().filter(player__in=player_ids))
+        exhausted = []
+        with self._lock:
+            for player_id in player_ids:
+                for position in POSITIONS:
+                    if player_id not in self._listed[position]:
+                        continue
+                    # One dominating listing less, for whatever it dominated
+                    self._listed[position].discard(player_id)
+                    self._slack[position] -= 1
+                    listing = self._cached[position].pop(player_id, None)
+                    if listing is not None:
+                        candidates = self._candidates[position]
+                        del candidates[bisect_left(candidates, listing)]
+            for row in rows:
+                # New listings are only ever more candidates
+                listing = make_listing(row)
+                position = listing.row[3]
+                self._listed[position].add(listing.player_id)
+                self._cached[position][listing.player_id] = listing
+                insort(self._candidates[position], listing)
+            exhausted = [
+                position for position in POSITIONS if self._slack[position] < 0
+            ]
+            self._results.clear()
+            self.version += 1
+        if exhausted:
+            self.rebuild(exhausted)
+
+    def _on_market_changed(self, sender, player_ids, **kwargs):
+        self._changes.record(player_ids)
+        if self.built:
+            self.refresh(player_ids)
+
+    def recommend(self, team_id, budget, counts):
+        """
+        The best listings to buy for the team: counts maps positions to
+        the number of players wanted, budget is a Decimal.
+        """
+        self.ensure_built()
+        wanted = tuple((position, counts.get(position, 0)) for position in POSITIONS)
+        key = (team_id, cents(budget), wanted)
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self.hits += 1
+                return result
+            groups = [
+                (
+                    count,
+                    skyline(
+                        self._candidates[position],
+                        count,
+                        budget=cents(budget),
+                        team_id=team_id,
+                    ),
+                )
+                for position, count in wanted
+                if count
+            ]
+            version = self.version
+        picks, optimal = solve(groups, cents(budget))
+        picks = picks or []
+        result = {
+            "budget": f"$ {budget:.2f}",
+            "total_price": f"$ {Decimal(sum(p.price for p in picks)) / 100:.2f}",
+            "total_value": f"$ {Decimal(sum(p.value for p in picks)) / 100:.2f}",
+            "players": [describe(listing) for listing in picks],
+            "optimal": optimal,
+            "market_version": version,
+        }
+        with self._lock:
+            self.misses += 1
+            if self.version == version:
+                if len(self._results) >= RESULT_CACHE_SIZE:
+                    self._results.clear()
+                self._results[key] = result
+        return result
+
+    def stats(self):
+        return {
+            "built": self.built,
+            "version": self.version,
+            "candidates": {
+                position: len(candidates)
+                for position, candidates in self._candidates.items()
+            },
+            "rebuilds": self.rebuilds,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+recommender = Recommender()
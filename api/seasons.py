@@ -0,0 +1,209 @@
+import random
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+from .models import Team, Player, TransferList, Bid, SeasonRollover
+from .helper import fake, COUNTRIES
+from .market_stats import record_delisted
+from .invalidation import discard_bids
+from .signals import notify_market_changed, notify_teams_changed
+from .valuation import ValuationModel, team_values
+
+
+"""
+Season rollover. Every player gets a year older, those older than
+PLAYER_RETIREMENT_AGE then retire, with their listings and bids, and
+each is replaced in its squad by a youth player of the same position,
+so squads keep their shape (3 goalkeepers, 6 defenders, 6 midfielders
+and 5 attackers at signup). Teams are rolled over in id order, a chunk
+per transaction with set-based statements, and the SeasonRollover row
+records the last team done in the same transaction: an interrupted
+rollover resumes after it, and concurrent runs share the chunks.
+Players remember the season which aged them, so one transferred to a
+team not rolled over yet isn't aged twice, and once every team is done
+a last pass ages those still behind: players bought from a team not
+rolled over yet into one already done.
+"""
+
+
+def current_rollover():
+    """The unfinished rollover, or a new one for the next season."""
+    rollover = (
+        SeasonRollover.objects.filter(finished_at__isnull=True)
+        .order_by("season")
+        .first()
+    )
+    if rollover is None:
+        last = SeasonRollover.objects.aggregate(season=Max("season"))["season"]
+        rollover, _ = SeasonRollover.objects.get_or_create(season=(last or 0) + 1)
+    return rollover
+
+
+def name_pool(size=1000):
+    # Faker is slow per call, so youth names are drawn from a pool
+    return [fake.first_name() for _ in range(size)], [
+        fake.last_name() for _ in range(size)
+    ]
+
+
+def youth_players(replaced, season, ages, model, names):
+    # (team id, position) of the retired players -> their replacements
+    first_names, last_names = names
+    players = [
+        Player(
+            first_name=random.choice(first_names),
+            last_name=random.choice(last_names),
+            country=random.choice(COUNTRIES),
+            age=random.randint(*ages),
+            position=position,
+            team_id=team_id,
+            season=season,
+        )
+        for team_id, position in replaced
+    ]
+    values = model.price(
+        [player.age for player in players],
+        [player.position for player in players],
+        [None] * len(players),
+    )
+    for player, value in zip(players, values):
+        player.market_value = Decimal(value).quantize(Decimal("0.01"))
+    return players
+
+
+def roll_over_teams(rollover, team_ids, retirement_age, youth_ages, model, names):
+    """
+    Roll over the given teams, the next ones after rollover.last_team_id.
+    Returns the number of players retired, or None when another run
+    rolled them over first.
+    """
+    season = rollover.season
+    with transaction.atomic():
+        claimed = SeasonRollover.objects.filter(
+            pk=rollover.pk, last_team_id=rollover.last_team_id
+        ).update(last_team_id=team_ids[-1], teams=F("teams") + len(team_ids))
+        if not claimed:
+            return None
+        players = Player.objects.filter(team__in=team_ids, season__lt=season)
+        listed = list(
+            TransferList.objects.filter(player__in=players).values_list(
+                "player_id", flat=True
+            )
+        )
+        players.update(age=F("age") + 1, season=season)
+
+        retiring = list(
+            Player.objects.filter(
+                team__in=team_ids, season=season, age__gt=retirement_age
+            )
+            .annotate(asking_price=F("transferlist__asking_price"))
+            .only("pk", "team_id", "position", "country")
+        )
+        _replace_retired(retiring, season, youth_ages, model, names)
+        _finish_teams(rollover, team_ids, len(retiring), listed)
+    rollover.last_team_id = team_ids[-1]
+    return len(retiring)
+
+
+def roll_over_stragglers(rollover, retirement_age, youth_ages, model, names):
+    """
+    Age the players still behind the season once every team is rolled
+    over. Returns the number of players retired, or None when another
+    run aged some of them first.
+    """
+    season = rollover.season
+    with transaction.atomic():
+        stragglers = list(
+            Player.objects.filter(season__lt=season).values_list("pk", "team_id")
+        )
+        if not stragglers:
+            return 0
+        player_ids = [player_id for player_id, _ in stragglers]
+        listed = list(
+            TransferList.objects.filter(player__in=player_ids).values_list(
+                "player_id", flat=True
+            )
+        )
+        aged = Player.objects.filter(pk__in=player_ids, season__lt=season).update(
+            age=F("age") + 1, season=season
+        )
+        if aged != len(player_ids):
+            transaction.set_rollback(True)
+            return None
+        retiring = list(
+            Player.objects.filter(pk__in=player_ids, age__gt=retirement_age)
+            .annotate(asking_price=F("transferlist__asking_price"))
+            .only("pk", "team_id", "position", "country")
+        )
+        _replace_retired(retiring, season, youth_ages, model, names)
+        team_ids = sorted({team_id for _, team_id in stragglers})
+        _finish_teams(rollover, team_ids, len(retiring), listed)
+    return len(retiring)
+
+
+def _replace_retired(retiring, season, youth_ages, model, names):
+    if not retiring:
+        return
+    bids = list(Bid.objects.filter(player__in=retiring).values_list("pk", flat=True))
+    # Their listings and bids are deleted with them
+    Player.objects.filter(pk__in=[player.pk for player in retiring]).delete()
+    record_delisted(
+        (player, player.asking_price)
+        for player in retiring
+        if player.asking_price is not None
+    )
+    Player.objects.bulk_create(
+        youth_players(
+            [(player.team_id, player.position) for player in retiring],
+            season,
+            youth_ages,
+            model,
+            names,
+        )
+    )
+    discard_bids(bids)
+
+
+def _finish_teams(rollover, team_ids, retired, listed):
+    values = team_values()
+    Team.objects.filter(pk__in=team_ids).update(
+        team_value=values, final_value=F("budget") + values
+    )
+    SeasonRollover.objects.filter(pk=rollover.pk).update(
+        players_retired=F("players_retired") + retired
+    )
+    notify_teams_changed(team_ids)
+    notify_market_changed(listed)
+
+
+def roll_over_season(batch_size=None, retirement_age=None, youth_ages=None):
+    """Run the current rollover to the end and return it."""
+    batch_size = batch_size or getattr(settings, "SEASON_ROLLOVER_BATCH", 1000)
+    retirement_age = retirement_age or getattr(settings, "PLAYER_RETIREMENT_AGE", 40)
+    youth_ages = youth_ages or getattr(settings, "YOUTH_PLAYER_AGES", (16, 18))
+    model, names = ValuationModel(), name_pool()
+    rollover = current_rollover()
+    while True:
+        team_ids = list(
+            Team.objects.filter(pk__gt=rollover.last_team_id)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:batch_size]
+        )
+        if not team_ids:
+            break
+        retired = roll_over_teams(
+            rollover, team_ids, retirement_age, youth_ages, model, names
+        )
+        if retired is None:
+            rollover.refresh_from_db()
+    while (
+        roll_over_stragglers(rollover, retirement_age, youth_ages, model, names) is None
+    ):
+        pass  # Aged by another run meanwhile, read the rest again
+    SeasonRollover.objects.filter(pk=rollover.pk, finished_at__isnull=True).update(
+        finished_at=timezone.now()
+    )
+    rollover.refresh_from_db()
+    return rollover
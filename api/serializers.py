@@ -1,11 +1,28 @@
 from rest_framework import serializers
-from .models import CustomUser, Team, Player, TransferList, MarketList
+from django.conf import settings
+from django.utils import timezone
+from .models import CustomUser, Team, Player, TransferList, MarketList, Trade
 import pycountry
+from decimal import Decimal
 from .helper import (
     user_register_create_team_and_players,
     get_player_name_and_price,
     show_market_list_data,
 )
+from .loaders import EntityLoader
+from .leaderboard import METRICS as LEADERBOARD_METRICS
+from .recommender import MAX_PER_POSITION
+from .price_suggestions import DEFAULT_NEIGHBOURS, MAX_NEIGHBOURS
+
+# Load a player through the request's entity loader when there is one
+
+
+def load_player(context, player_id):
+    request = context.get("request")
+    if request is not None:
+        return EntityLoader.for_request(request).player(player_id)
+    return Player.objects.filter(id=player_id).first()
+
 
 # User Register Serializer
 
@@ -138,21 +155,20 @@ class TransferListSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = TransferList
-        fields = ["player_id", "asking_price"]
+        fields = ["player_id", "asking_price", "auction_ends_at"]
 
     def validate_player_id(self, value):
-        try:
-            player = Player.objects.get(id=value)
-            return player
-        except Player.DoesNotExist:
+        player = load_player(self.context, value)
+        if player is None:
             raise serializers.ValidationError(
                 "Player with this ID does not exist in the team!"
             )
+        return player
 
-    def create(self, validated_data):
-        player = validated_data.pop("player_id")
-        transfer_list = TransferList.objects.create(player=player, **validated_data)
-        return transfer_list
+    def validate_auction_ends_at(self, value):
+        if value is not None and value <= timezone.now():
+            raise serializers.ValidationError("The auction must end in the future.")
+        return value
 
     def to_representation(self, instance):
         return get_player_name_and_price(instance)
@@ -184,6 +200,86 @@ class MarketListSerializer(serializers.ModelSerializer):
         return show_market_list_data(instance)
 
 
+# Market List Filters (query parameters)
+
+
+class MarketListFilterSerializer(serializers.Serializer):
+    position = serializers.ChoiceField(choices=Player.POSITIONS, required=False)
+    country = serializers.CharField(required=False)
+    min_price = serializers.DecimalField(
+        max_digits=10, decimal_places=2, required=False
+    )
+    max_price = serializers.DecimalField(
+        max_digits=10, decimal_places=2, required=False
+    )
+    ordering = serializers.ChoiceField(
+        choices=["asking_price", "-asking_price"], required=False
+    )
+
+
+# Market Statistics (query parameters)
+
+
+class MarketStatsQuerySerializer(serializers.Serializer):
+    days = serializers.IntegerField(min_value=1, max_value=366, default=30)
+
+
+# Leaderboard (query parameters)
+
+
+class LeaderboardQuerySerializer(serializers.Serializer):
+    metric = serializers.ChoiceField(choices=LEADERBOARD_METRICS, default="final_value")
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+
+# Squad Recommendations
+
+RECOMMENDED_POSITIONS = {
+    "goalkeepers": "Goalkeeper",
+    "defenders": "Defender",
+    "midfielders": "Midfielder",
+    "attackers": "Attacker",
+}
+
+
+class RecommendPlayersQuerySerializer(serializers.Serializer):
+    # Number of players wanted per position
+    goalkeepers = serializers.IntegerField(
+        min_value=0, max_value=MAX_PER_POSITION, default=0
+    )
+    defenders = serializers.IntegerField(
+        min_value=0, max_value=MAX_PER_POSITION, default=0
+    )
+    midfielders = serializers.IntegerField(
+        min_value=0, max_value=MAX_PER_POSITION, default=0
+    )
+    attackers = serializers.IntegerField(
+        min_value=0, max_value=MAX_PER_POSITION, default=0
+    )
+    # Defaults to, and can't exceed, the team's budget
+    budget = serializers.DecimalField(
+        max_digits=10, decimal_places=2, min_value=0, required=False
+    )
+
+    def validate(self, data):
+        if not any(data[field] for field in RECOMMENDED_POSITIONS):
+            raise serializers.ValidationError("Ask for at least one player.")
+        return data
+
+    def counts(self):
+        return {
+            position: self.validated_data[field]
+            for field, position in RECOMMENDED_POSITIONS.items()
+        }
+
+
+class PriceSuggestionQuerySerializer(serializers.Serializer):
+    # Number of similar players the suggestion is drawn from
+    k = serializers.IntegerField(
+        min_value=1, max_value=MAX_NEIGHBOURS, default=DEFAULT_NEIGHBOURS
+    )
+
+
 # Player Buy
 
 
@@ -192,8 +288,120 @@ class BuyPlayerSerializer(serializers.Serializer):
     price = serializers.DecimalField(max_digits=10, decimal_places=2)
 
     def validate_player_id(self, value):
-        try:
-            player = Player.objects.get(id=value)
-        except Player.DoesNotExist:
+        if load_player(self.context, value) is None:
+            raise serializers.ValidationError("Player does not exist")
+        return value
+
+
+# Order Book Bids
+
+
+class PlaceBidSerializer(serializers.Serializer):
+    player_id = serializers.UUIDField()
+    price = serializers.DecimalField(
+        max_digits=10, decimal_places=2, min_value=Decimal("0.01")
+    )
+
+    def validate_player_id(self, value):
+        player = load_player(self.context, value)
+        if player is None:
             raise serializers.ValidationError("Player does not exist")
+        return player
+
+
+class CancelBidSerializer(serializers.Serializer):
+    player_id = serializers.UUIDField()
+
+    def validate_player_id(self, value):
+        player = load_player(self.context, value)
+        if player is None:
+            raise serializers.ValidationError("Player does not exist")
+        return player
+
+
+# Bulk Transfer List
+
+
+class BulkListItemSerializer(serializers.Serializer):
+    player_id = serializers.UUIDField()
+    asking_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+
+class BulkDelistItemSerializer(serializers.Serializer):
+    player_id = serializers.UUIDField()
+
+
+class BulkTransferListSerializer(serializers.Serializer):
+    players = BulkListItemSerializer(many=True, allow_empty=False)
+
+    def validate_players(self, value):
+        limit = getattr(settings, "BULK_TRANSFER_MAX_PLAYERS", 50)
+        if len(value) > limit:
+            raise serializers.ValidationError(
+                f"At most {limit} players can be handled at once."
+            )
+        return value
+
+
+class BulkDelistSerializer(BulkTransferListSerializer):
+    players = BulkDelistItemSerializer(many=True, allow_empty=False)
+
+
+# Bulk Player Buy
+
+
+class BulkBuyItemSerializer(serializers.Serializer):
+    player_id = serializers.UUIDField()
+    price = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+
+class BulkBuyPlayerSerializer(serializers.Serializer):
+    purchases = BulkBuyItemSerializer(many=True, allow_empty=False)
+
+    def validate_purchases(self, value):
+        limit = getattr(settings, "BULK_BUY_MAX_PLAYERS", 50)
+        if len(value) > limit:
+            raise serializers.ValidationError(
+                f"At most {limit} players can be bought at once."
+            )
+        return value
+
+
+# Trade Ledger
+
+
+class TradeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Trade
+        fields = [
+            "id",
+            "player",
+            "seller_team",
+            "buyer_team",
+            "price",
+            "value_before",
+            "value_after",
+            "traded_at",
+        ]
+
+
+# Batch Request
+
+
+class BatchOperationSerializer(serializers.Serializer):
+    method = serializers.ChoiceField(choices=["GET", "POST", "PUT", "PATCH", "DELETE"])
+    path = serializers.CharField()
+    body = serializers.JSONField(required=False, default=dict)
+
+
+class BatchSerializer(serializers.Serializer):
+    operations = BatchOperationSerializer(many=True, allow_empty=False)
+    atomic = serializers.BooleanField(default=False)
+
+    def validate_operations(self, value):
+        limit = getattr(settings, "BATCH_MAX_OPERATIONS", 20)
+        if len(value) > limit:
+            raise serializers.ValidationError(
+                f"A batch can contain at most {limit} operations."
+            )
         return value
@@ -0,0 +1,136 @@
+import threading
+from contextlib import contextmanager
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import Signal, receiver
+from .models import Team, Player, TransferList, MarketList
+from .market_stats import record_listed, record_delisted
+from .invalidation import bus_enabled, publish_market_change, publish_teams_change
+
+
+"""
+Market change notifications. Receivers of `market_changed` get the ids
+of players whose listing (or displayed listing data) changed, once the
+surrounding transaction has committed, and receivers of `teams_changed`
+the ids of teams whose budget or values changed. Paths that bypass
+model signals (queryset update, bulk_create) call notify_market_changed
+and notify_teams_changed themselves. Both also publish the change to
+the other processes through the invalidation bus.
+"""
+
+market_changed = Signal()
+teams_changed = Signal()
+
+
+class ChangesDuringReads:
+    """
+    Ids changed while an in-memory cache reads its tables. A cache
+    connects its receiver before reading, records what the receiver gets
+    for every read in progress, and refreshes those ids again once the
+    read is swapped in, so no change falls between the read and the
+    swap.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reads = []
+
+    @contextmanager
+    def reading(self):
+        changed = set()
+        with self._lock:
+            self._reads.append(changed)
+        try:
+            yield changed
+        finally:
+            with self._lock:
+                self._reads.remove(changed)
+
+    def record(self, ids):
+        with self._lock:
+            for changed in self._reads:
+                changed.update(ids)
+
+
+def notify_market_changed(player_ids):
+    publish_market_change()
+    if not market_changed.has_listeners():
+        return
+    player_ids = set(player_ids)
+    transaction.on_commit(
+        lambda: market_changed.send(sender=MarketList, player_ids=player_ids)
+    )
+
+
+def notify_teams_changed(team_ids):
+    # Budget or value changes, sent with the team ids after commit
+    publish_teams_change()
+    if not teams_changed.has_listeners():
+        return
+    team_ids = set(team_ids)
+    transaction.on_commit(lambda: teams_changed.send(sender=Team, team_ids=team_ids))
+
+
+@receiver(post_save, sender=TransferList)
+@receiver(post_delete, sender=TransferList)
+@receiver(post_save, sender=MarketList)
+@receiver(post_delete, sender=MarketList)
+def listing_changed(sender, instance, **kwargs):
+    # MarketList is a proxy of TransferList, saved from its admin page
+    notify_market_changed([instance.player_id])
+
+
+@receiver(pre_save, sender=TransferList)
+@receiver(pre_save, sender=MarketList)
+def listing_editing(sender, instance, **kwargs):
+    # What the market statistics counted for a listing edited in the admin
+    if instance._state.adding:
+        return
+    instance._counted_listing = (
+        TransferList.objects.filter(pk=instance.pk)
+        .annotate(position=F("player__position"), country=F("player__country"))
+        .values_list("position", "country", "asking_price", named=True)
+        .first()
+    )
+
+
+@receiver(post_save, sender=TransferList)
+@receiver(post_save, sender=MarketList)
+def listing_saved(sender, instance, created, **kwargs):
+    # Listings made with bulk_create are counted by create_listings
+    if created:
+        record_listed([(instance.player, instance.asking_price)])
+        return
+    counted = getattr(instance, "_counted_listing", None)
+    player = instance.player
+    if counted is not None and counted != (
+        player.position,
+        player.country,
+        instance.asking_price,
+    ):
+        record_delisted([(counted, counted.asking_price)])
+        record_listed([(player, instance.asking_price)])
+
+
+@receiver(post_save, sender=Player)
+def player_changed(sender, instance, **kwargs):
+    notify_market_changed([instance.pk])
+
+
+@receiver(post_save, sender=Team)
+def team_changed(sender, instance, created, **kwargs):
+    if created or not (market_changed.has_listeners() or bus_enabled()):
+        return
+    notify_market_changed(
+        TransferList.objects.filter(player__team=instance).values_list(
+            "player_id", flat=True
+        )
+    )
+
+
+@receiver(post_save, sender=Team)
+@receiver(post_delete, sender=Team)
+def team_values_changed(sender, instance, **kwargs):
+    # Signup, team updates and admin edits
+    notify_teams_changed([instance.pk])
@@ -1,4 +1,18 @@
-from .models import CustomUser, Team, Player, TransferList, MarketList
+from .models import (
+    CustomUser,
+    Team,
+    Player,
+    TransferList,
+    MarketList,
+    IdempotencyRecord,
+    Bid,
+    Trade,
+    ArchivedTrade,
+    MarketStat,
+    Fixture,
+    Standing,
+    CacheGeneration,
+)
 from .serializers import (
     UserRegisterSerializer,
     UserLoginSerializer,
@@ -13,7 +27,7 @@ from .serializers import (
     MarketListSerializer,
     BuyPlayerSerializer,
 )
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 from decimal import Decimal
 import pycountry
 import uuid
@@ -24,6 +38,53 @@ from django.urls import reverse
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from django.contrib.auth.hashers import check_password
+from .coalesce import SingleFlight
+from .market_index import market_index
+from .orderbook import order_book
+from .auctions import auction_closer
+from .leaderboard import leaderboard
+from .seasons import current_rollover, name_pool, roll_over_teams
+from .league import save_results, simulate_season
+from .match_engine import round_robin
+from .recommender import Listing, recommender, solve
+from .price_suggestions import Point, distance, log_value, price_index
+from .listing_expiry import ListingSweeper, MAX_CONFLICTS, listing_sweeper
+from .signals import market_changed, teams_changed
+from .valuation import ValuationModel, MAX_VALUE, revalue_players, valuation_config
+from .market_snapshot import (
+    MarketSnapshotReader,
+    MarketSnapshotWriter,
+    publish_market_snapshot,
+    publish_on_market_change,
+)
+from .helper import (
+    show_market_list_data,
+    buy_player,
+    create_listings,
+    load_own_players,
+    PurchaseConflict,
+    user_register_create_team_and_players,
+)
+from .metrics import conflict_stats
+from django.db.models import F, Q, Count, Min, Max, Sum
+from unittest.mock import patch
+from .invalidation import InvalidationBus, ORDER_BOOK_KEY, drop_order_book
+from django.test import override_settings
+import tempfile
+import os
+import socket
+import threading
+import itertools
+import time
+from datetime import timedelta
+from io import StringIO
+from django.core.management import call_command
+from .management.commands.reconcile_team_values import (
+    Command as ReconcileTeamValuesCommand,
+)
+from django.utils import timezone
+from django.db import connection, transaction, DatabaseError
+from django.test.utils import CaptureQueriesContext
 
 """ Sample Test User Data Dictionary"""
 
@@ -147,11 +208,11 @@ class BaseClassForUnitTest(APITestCase):
             player=self.players2[0], asking_price=Decimal("5500.00")
         )
 
-        # Creating market list instance for 1st user
-        self.market_list = MarketList.objects.create(transfer_list=self.transfer_list)
+        # Market list instance (same listing) for 1st user
+        self.market_list = MarketList.objects.get(pk=self.transfer_list.pk)
 
-        # Creating market list instance for 2nd user
-        self.market_list2 = MarketList.objects.create(transfer_list=self.transfer_list2)
+        # Market list instance (same listing) for 2nd user
+        self.market_list2 = MarketList.objects.get(pk=self.transfer_list2.pk)
 
 
 #############################################################################
@@ -237,8 +298,8 @@ class MarketListModelTest(BaseClassForUnitTest):
         super().setUp()  # Inheriting from the Base Class For Unit Test
 
     def test_market_list_creation(self):
-        self.assertEqual(self.market_list.transfer_list, self.transfer_list)
-        self.assertEqual(self.market_list.transfer_list.player.listing_status, "Listed")
+        self.assertEqual(self.market_list.pk, self.transfer_list.pk)
+        self.assertEqual(self.market_list.player.listing_status, "Listed")
 
 
 #############################################################################
@@ -493,16 +554,12 @@ class MarketListSerializerTest(BaseClassForUnitTest):
         # Check serialized data
         self.assertEqual(
             data["player_name"],
-            f"{market_list.transfer_list.player.first_name} {market_list.transfer_list.player.last_name}",
-        )
-        self.assertEqual(
-            data["player_country"], market_list.transfer_list.player.country
-        )
-        self.assertEqual(data["team_name"], market_list.transfer_list.player.team.name)
-        self.assertEqual(data["position"], market_list.transfer_list.player.position)
-        self.assertEqual(
-            data["asking_price"], f"$ {market_list.transfer_list.asking_price}"
+            f"{market_list.player.first_name} {market_list.player.last_name}",
         )
+        self.assertEqual(data["player_country"], market_list.player.country)
+        self.assertEqual(data["team_name"], market_list.player.team.name)
+        self.assertEqual(data["position"], market_list.player.position)
+        self.assertEqual(data["asking_price"], f"$ {market_list.asking_price}")
 
 
 """ Unit Test for Buy Player Serializer """
@@ -891,9 +948,7 @@ class TransferListViewTest(BaseClassForUnitTest):
         # Checking if the player is in the Transfer List
         self.assertTrue(TransferList.objects.filter(player=self.player).exists())
         # Checking if the player is in Market List
-        self.assertTrue(
-            MarketList.objects.filter(transfer_list__player=self.player).exists()
-        )
+        self.assertTrue(MarketList.objects.filter(player=self.player).exists())
 
 
 """ Unit Test for Market List View """
@@ -975,9 +1030,7 @@ class BuyPlayerViewTest(BaseClassForUnitTest):
 
         # Checking if the player is not present in TransferList and MarketList
         self.assertFalse(TransferList.objects.filter(player=self.player).exists())
-        self.assertFalse(
-            MarketList.objects.filter(transfer_list__player=self.player).exists()
-        )
+        self.assertFalse(MarketList.objects.filter(player=self.player).exists())
 
         # Checking if the status of player changed from "Listed" back to "Not Listed"
         self.assertEqual(self.player.listing_status, "Not Listed")
@@ -1032,6 +1085,2511 @@ class BuyPlayerViewTest(BaseClassForUnitTest):
         # print(f"Player's listing status: {self.player.listing_status}")
 
 
+#############################################################################
+#                        UNIT TEST FOR PERFORMANCE                          #
+#############################################################################
+
+""" Unit Test for Single Flight Request Coalescing """
+
+
+class SingleFlightTest(APITestCase):
+    def setUp(self):
+        self.coalescer = SingleFlight(timeout=5)
+        self.release = threading.Event()
+        self.calls = 0
+
+    def slow_query(self):
+        self.calls += 1
+        self.release.wait(5)
+        return ["market", "data"]
+
+    def test_concurrent_calls_share_one_execution(self):
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    self.coalescer.do("market", self.slow_query)
+                )
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+
+        # Wait until every follower is parked on the in-flight call
+        while self.coalescer.stats()["market"]["executions"] < 1:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [["market", "data"]] * 5)
+        stats = self.coalescer.stats()["market"]
+        self.assertEqual(stats["executions"], 1)
+        self.assertEqual(stats["shared"], 4)
+        self.assertFalse(stats["in_flight"])
+
+    def test_follower_timeout_computes_itself(self):
+        coalescer = SingleFlight(timeout=0.05)
+        leader = threading.Thread(target=coalescer.do, args=("key", self.slow_query))
+        leader.start()
+        while self.calls < 1:
+            time.sleep(0.01)
+
+        self.assertEqual(coalescer.do("key", lambda: "own result"), "own result")
+        self.release.set()
+        leader.join()
+        self.assertEqual(coalescer.stats()["key"]["timeouts"], 1)
+
+
+""" Unit Test for Metrics View """
+
+
+class MetricsViewTest(BaseClassForUnitTest):
+    def setUp(self):
+        super().setUp()  # Inheriting from the Base Class For Unit Test
+        self.url = reverse("metrics")
+        self.token = Token.objects.create(user=self.user)
+
+    def test_metrics_view_requires_admin(self):
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_metrics_view_reports_coalescing_stats(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+        # Requesting the market list goes through the coalescer
+        self.client.get(reverse("market-list"))
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("coalescing", response.data)
+        self.assertTrue(
+            any(key.startswith("MarketListView") for key in response.data["coalescing"])
+        )
+
+
+""" Unit Test for In-Memory Market Index """
+
+
+@override_settings(MARKET_INDEX_ENABLED=True)
+class MarketIndexTest(BaseClassForUnitTest):
+    def setUp(self):
+        super().setUp()  # Inheriting from the Base Class For Unit Test
+        market_index.reset()
+        self.url = reverse("market-list")
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+    def tearDown(self):
+        market_index.reset()
+
+    def test_index_answers_filters_like_the_database(self):
+        response = self.client.get(self.url, {"ordering": "-asking_price"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item["asking_price"] for item in response.data],
+            ["$ 5500.00", "$ 4500.00"],
+        )
+
+        response = self.client.get(self.url, {"min_price": "5000", "max_price": "6000"})
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]["player_id"], self.players2[0].id)
+
+        position = self.players[0].position
+        response = self.client.get(self.url, {"position": position})
+        expected = MarketList.objects.filter(player__position=position).count()
+        self.assertEqual(len(response.data), expected)
+
+    def test_index_follows_listing_and_buying(self):
+        market_index.ensure_built()
+        player = self.players[1]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("transfer-list", kwargs={"username": self.user.username}),
+                {"player_id": player.id, "asking_price": "100.00"},
+                format="json",
+            )
+        listed = market_index.query(max_price=Decimal("100"))
+        self.assertEqual(listed[0]["player_id"], player.id)
+
+        buyer_token = Token.objects.create(user=self.user2)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + buyer_token.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("buy-player", kwargs={"username": self.user2.username}),
+                {"player_id": player.id, "price": "100.00"},
+                format="json",
+            )
+        self.assertEqual(market_index.query(max_price=Decimal("100")), [])
+        self.assertEqual(
+            market_index.verify(), {"missing": [], "extra": [], "stale": []}
+        )
+
+    def test_change_during_rebuild_is_kept(self):
+        clear = market_index._clear
+        delisted = self.players[0].pk
+
+        def change_then_clear():
+            # Another request commits after the read, before the swap
+            TransferList.objects.filter(player=delisted).delete()
+            market_changed.send(sender=MarketList, player_ids={delisted})
+            clear()
+
+        with patch.object(market_index, "_clear", side_effect=change_then_clear):
+            market_index.rebuild()
+        self.assertEqual(len(market_index.query()), 1)
+        self.assertEqual(
+            market_index.verify(), {"missing": [], "extra": [], "stale": []}
+        )
+
+    def test_cold_index_is_built_once(self):
+        started, release = threading.Event(), threading.Event()
+
+        def slow_rebuild():
+            started.set()
+            release.wait(5)
+            market_index._built = True
+
+        with patch.object(market_index, "rebuild", side_effect=slow_rebuild) as rebuild:
+            first = threading.Thread(target=market_index.ensure_built)
+            first.start()
+            started.wait(5)
+            # Arrives while the first build is still reading
+            second = threading.Thread(target=market_index.ensure_built)
+            second.start()
+            time.sleep(0.05)
+            release.set()
+            first.join()
+            second.join()
+        self.assertEqual(rebuild.call_count, 1)
+
+
+""" Unit Test for Memory-Mapped Market Snapshot """
+
+
+class MarketSnapshotTest(BaseClassForUnitTest):
+    def setUp(self):
+        super().setUp()  # Inheriting from the Base Class For Unit Test
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "market.snapshot")
+        self.reader = MarketSnapshotReader(self.path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_snapshot_matches_market_list_data(self):
+        self.assertEqual(publish_market_snapshot(self.path), 1)
+        expected = sorted(
+            (show_market_list_data(market) for market in MarketList.objects.all()),
+            key=lambda data: Decimal(data["asking_price"][2:]),
+        )
+        self.assertEqual(self.reader.query(), expected)
+        self.assertEqual(self.reader.query(min_price=Decimal("5000.00")), expected[1:])
+        self.assertEqual(
+            self.reader.query(country=self.players[0].country)[0]["player_id"],
+            self.players[0].id,
+        )
+
+    def test_new_version_is_remapped(self):
+        publish_market_snapshot(self.path)
+        self.assertEqual(len(self.reader.query()), 2)
+
+        TransferList.objects.filter(player=self.players[0]).delete()
+        self.assertEqual(publish_market_snapshot(self.path), 2)
+        self.assertEqual(len(self.reader.query()), 1)
+        self.assertEqual(self.reader.version, 2)
+
+    def test_writer_publishes_only_listing_changes(self):
+        # A long delay keeps the writer thread asleep, flush publishes
+        writer = MarketSnapshotWriter(self.path, delay=3600)
+        writer.schedule([self.players[0].pk, self.players[1].pk])
+        self.assertEqual(writer.flush(), 1)
+        self.assertIsNone(writer.flush())
+
+        # Players who are neither listed nor in the snapshot
+        unlisted = Player.objects.filter(transferlist__isnull=True)
+        writer.schedule(unlisted.values_list("pk", flat=True))
+        self.assertIsNone(writer.flush())
+        self.assertEqual(writer.stats()["skipped"], 1)
+
+        # A delisted player is still in the published snapshot
+        TransferList.objects.filter(player=self.players[0]).delete()
+        writer.schedule([self.players[0].pk])
+        self.assertEqual(writer.flush(), 2)
+        self.assertEqual(len(self.reader.query()), 1)
+        self.assertEqual(writer.stats()["published"], 2)
+
+
+""" Unit Test for Cross-Process Invalidation Bus """
+
+
+class InvalidationBusTest(APITestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        # Two buses stand in for two worker processes
+        self.publisher = InvalidationBus(socket_dir=self.directory.name)
+        self.worker = InvalidationBus(socket_dir=self.directory.name)
+        self.invalidated = threading.Event()
+        self.worker.subscribe("market", lambda key: self.invalidated.set())
+
+    def tearDown(self):
+        self.worker.close()
+        self.directory.cleanup()
+
+    def test_generation_check_fallback(self):
+        self.worker.check()  # Baseline
+        self.assertFalse(self.invalidated.is_set())
+
+        self.assertEqual(self.publisher.bump("market"), 1)
+        self.worker.check()
+        self.assertTrue(self.invalidated.is_set())
+        stats = self.worker.stats()["market"]
+        self.assertEqual(stats["received"], 1)
+        self.assertEqual(stats["generation"], 1)
+
+        # Nothing new, nothing invalidated again
+        self.worker.check()
+        self.assertEqual(self.worker.stats()["market"]["received"], 1)
+
+    def test_datagram_push(self):
+        self.worker.check()
+        self.worker.listen()
+        self.publisher.bump("market")
+        self.assertTrue(self.invalidated.wait(2))
+        self.assertEqual(self.worker.stats()["market"]["pushed"], 1)
+
+        # The later generation check does not apply it a second time
+        self.worker.check()
+        self.assertEqual(self.worker.stats()["market"]["received"], 1)
+
+    def test_malformed_datagram_is_ignored(self):
+        self.worker.check()
+        self.worker.listen()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+            sender.sendto(b"garbage", self.worker._socket_path)
+            sender.sendto(b"\xff\xfe", self.worker._socket_path)
+        # The receiver thread is still there for the next invalidation
+        self.publisher.bump("market")
+        self.assertTrue(self.invalidated.wait(2))
+
+    def test_publishes_bump_once_per_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            for _ in range(3):
+                self.publisher.publish("market")
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(self.publisher.stats()["market"]["published"], 1)
+
+        # A rolled back publish does not hold back the next one
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    self.publisher.publish("market")
+                    raise DatabaseError
+            except DatabaseError:
+                pass
+            self.publisher.publish("market")
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(CacheGeneration.objects.get(key="market").generation, 2)
+
+
+""" Unit Test for Batch View """
+
+
+class BatchViewTest(BaseClassForUnitTest):
+    def setUp(self):
+        super().setUp()  # Inheriting from the Base Class For Unit Test
+        self.url = reverse("batch")
+
+    def test_login_then_authenticated_reads_in_one_request(self):
+        response = self.client.post(
+            self.url,
+            {
+                "operations": [
+                    {
+                        "method": "POST",
+                        "path": reverse("user-login"),
+                        "body": {
+                            "email": test_user["email"],
+                            "password": test_user["password"],
+                        },
+                    },
+                    {
+                        "method": "GET",
+                        "path": reverse(
+                            "user-detail", kwargs={"username": self.user.username}
+                        ),
+                    },
+                    {"method": "GET", "path": reverse("market-list")},
+                    {"method": "GET", "path": "/admin/"},
+                ]
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data["results"]
+        self.assertEqual([result["status"] for result in results], [200, 200, 200, 404])
+        self.assertEqual(results[1]["body"]["username"], self.user.username)
+        self.assertEqual(len(results[2]["body"]), MarketList.objects.count())
+        self.assertTrue(all("duration_ms" in result for result in results))
+
+    def test_atomic_batch_rolls_back_on_failure(self):
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+        player = self.players[1]
+        response = self.client.post(
+            self.url,
+            {
+                "atomic": True,
+                "operations": [
+                    {
+                        "method": "POST",
+                        "path": reverse(
+                            "transfer-list", kwargs={"username": self.user.username}
+                        ),
+                        "body": {"player_id": str(player.id), "asking_price": "10"},
+                    },
+                    {
+                        "method": "POST",
+                        "path": reverse(
+                            "buy-player", kwargs={"username": self.user.username}
+                        ),
+                        "body": {"player_id": str(uuid.uuid4()), "price": "10"},
+                    },
+                ],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data["committed"])
+        self.assertEqual(
+            [result["status"] for result in response.data["results"]], [201, 400]
+        )
+        self.assertFalse(TransferList.objects.filter(player=player).exists())
+
+    def test_second_purchase_sees_the_first_ones_budget(self):
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+        TransferList.objects.create(
+            player=self.players2[1], asking_price=Decimal("6500.00")
+        )
+        path = reverse("buy-player", kwargs={"username": self.user.username})
+        budget = self.team.budget
+        conflicts = conflict_stats.stats().get("buy_player", {}).get("conflicts", 0)
+        response = self.client.post(
+            self.url,
+            {
+                "operations": [
+                    {
+                        "method": "POST",
+                        "path": path,
+                        "body": {"player_id": str(player.id), "price": price},
+                    }
+                    for player, price in [
+                        (self.players2[0], "5500.00"),
+                        (self.players2[1], "6500.00"),
+                    ]
+                ]
+            },
+            format="json",
+        )
+        self.assertEqual(
+            [result["status"] for result in response.data["results"]], [200, 200]
+        )
+        # Both operations share the user, the second must not read its stale team
+        self.assertEqual(conflict_stats.stats()["buy_player"]["conflicts"], conflicts)
+        self.team.refresh_from_db()
+        self.assertEqual(self.team.budget, budget - Decimal("12000.00"))
+
+
+""" Unit Test for Concurrent Buy Player Requests """
+
+
+class BuyPlayerConcurrencyTest(BaseClassForUnitTest):
+    def setUp(self):
+        super().setUp()  # Inheriting from the Base Class For Unit Test
+        self.player = self.players2[0]
+        self.price = self.transfer_list2.asking_price
+        self.buyer_initial_budget = self.team.budget
+        self.seller_initial_budget = self.team2.budget
+
+    def validated_purchase(self):
+        serializer = BuyPlayerSerializer(
+            data={"player_id": str(self.player.id), "price": str(self.price)}
+        )
+        self.assertTrue(serializer.is_valid())
+        return serializer
+
+    def test_player_is_sold_and_paid_for_only_once(self):
+        # Both requests pass validation before either purchase runs
+        first, second = self.validated_purchase(), self.validated_purchase()
+
+        self.assertEqual(
+            buy_player(first, self.user.username).status_code, status.HTTP_200_OK
+        )
+        self.assertEqual(
+            buy_player(second, self.user.username).status_code,
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+        self.team.refresh_from_db()
+        self.team2.refresh_from_db()
+        self.assertEqual(self.team.budget, self.buyer_initial_budget - self.price)
+        self.assertEqual(self.team2.budget, self.seller_initial_budget + self.price)
+        self.assertEqual(self.team.final_value, self.team.team_value + self.team.budget)
+        self.assertEqual(
+            self.team2.final_value, self.team2.team_value + self.team2.budget
+        )
+
+    def test_buy_player_query_count(self):
+        serializer = self.validated_purchase()
+        # The market statistics are written after commit
+        with self.assertNumQueries(10):
+            buy_player(serializer, self.user.username)
+
+    def test_insufficient_budget(self):
+        Team.objects.filter(pk=self.team.pk).update(budget=Decimal("10.00"))
+        response = buy_player(self.validated_purchase(), self.user.username)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(TransferList.objects.filter(player=self.player).exists())
+
+
+""" Unit Test for Optimistic Concurrency in Buy Player """
+
+
+class BuyPlayerOptimisticLockingTest(BaseClassForUnitTest):
+    def setUp(self):
+        super().setUp()  # Inheriting from the Base Class For Unit Test
+        self.player = self.players2[0]
+        self.serializer = BuyPlayerSerializer(
+            data={
+                "player_id": str(self.player.id),
+                "price": str(self.transfer_list2.asking_price),
+            }
+        )
+        self.assertTrue(self.serializer.is_valid())
+
+    def test_conflict_is_retried(self):
+        raced = []
+
+        def racing_randint(low, high):
+            # Another request changes the player between our read and write
+            if not raced:
+                Player.objects.filter(pk=self.player.pk).update(
+                    version=F("version") + 1
+                )
+                raced.append(True)
+            return 50
+
+        with patch("api.helper.randint", side_effect=racing_randint):
+            response = buy_player(
+                self.serializer, self.user.username, endpoint="test_retry"
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.player.refresh_from_db()
+        self.assertEqual(self.player.team, self.team)
+        stats = conflict_stats.stats()["test_retry"]
+        self.assertEqual(stats["attempts"], 2)
+        self.assertEqual(stats["conflicts"], 1)
+        self.assertEqual(stats["conflict_rate"], 0.5)
+
+    @override_settings(BUY_PLAYER_MAX_RETRIES=1)
+    def test_exhausted_retries_answer_conflict(self):
+        with patch("api.helper.attempt_purchase", side_effect=PurchaseConflict):
+            response = buy_player(
+                self.serializer, self.user.username, endpoint="test_exhausted"
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        stats = conflict_stats.stats()["test_exhausted"]
+        self.assertEqual(stats["attempts"], 2)
+        self.assertEqual(stats["exhausted"], 1)
+
+
+""" Unit Test for Request-Scoped Entity Loading """
+
+
+class EntityLoaderQueryCountTest(BaseClassForUnitTest):
+    def setUp(self):
+        super().setUp()  # Inheriting from the Base Class For Unit Test
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+    def test_buy_player_loads_each_row_once(self):
+        url = reverse("buy-player", kwargs={"username": self.user.username})
+        data = {
+            "player_id": str(self.players2[0].id),
+            "price": str(self.transfer_list2.asking_price),
+        }
+        # Token, player with team, owner and listing, buyer team, then writes
+        # (the market statistics follow the commit)
+        with self.assertNumQueries(11):
+            response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_transfer_list_loads_each_row_once(self):
+        url = reverse("transfer-list", kwargs={"username": self.user.username})
+        data = {"player_id": str(self.players[1].id), "asking_price": "1000.00"}
+        # Token, player with team, owner and listing, then a savepoint
+        # around the listing insert and the player (the market statistics
+        # follow the commit)
+        with self.assertNumQueries(6):
+            response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+""" Unit Test for Bulk Buy Player View """
+
+
+class BulkBuyPlayerViewTest(BaseClassForUnitTest):
+    def setUp(self):
+        super().setUp()  # Inheriting from the Base Class For Unit Test
+        self.url = reverse("bulk-buy-player", kwargs={"username": self.user.username})
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+        # List a few more players of the 2nd team
+        self.listed = [self.players2[0]]
+        for player in self.players2[1:4]:
+            TransferList.objects.create(player=player, asking_price=Decimal("1000.00"))
+            self.listed.append(player)
+
+    def purchases(self):
+        return [
+            {
+                "player_id": str(player.id),
+                "price": str(TransferList.objects.get(player=player).asking_price),
+            }
+            for player in self.listed
+        ]
+
+    def test_bulk_buy_all_players(self):
+        total = sum(
+            TransferList.objects.get(player=p).asking_price for p in self.listed
+        )
+        purchases = self.purchases()
+        # Same number of queries whatever the number of players bought
+        with self.assertNumQueries(11):
+            response = self.client.post(
+                self.url, {"purchases": purchases}, format="json"
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(Player.objects.filter(team=self.team).count(), 24)
+        self.assertFalse(TransferList.objects.filter(player__in=self.listed).exists())
+        self.team.refresh_from_db()
+        self.team2.refresh_from_db()
+        self.assertEqual(self.team.budget, test_user["budget"] - total)
+        self.assertEqual(self.team2.budget, test_user_2["budget"] + total)
+        self.assertEqual(
+            self.team.team_value,
+            sum(player.market_value for player in self.team.players.all()),
+        )
+        self.assertEqual(
+            self.team2.team_value,
+            sum(player.market_value for player in self.team2.players.all()),
+        )
+        self.assertEqual(self.team.final_value, self.team.team_value + self.team.budget)
+
+    def test_one_invalid_item_buys_nothing(self):
+        purchases = self.purchases()
+        purchases[2]["price"] = "1.00"
+        response = self.client.post(self.url, {"purchases": purchases}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(response.data["errors"]), 1)
+        self.assertEqual(TransferList.objects.filter(player__in=self.listed).count(), 4)
+        self.team.refresh_from_db()
+        self.assertEqual(self.team.budget, test_user["budget"])
+
+    def test_other_managers_token_is_refused(self):
+        token2 = Token.objects.create(user=self.user2)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token2.key)
+        purchases = self.purchases()[1:]
+        response = self.client.post(self.url, {"purchases": purchases}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post(
+            reverse("buy-player", kwargs={"username": self.user.username}),
+            purchases[0],
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(TransferList.objects.filter(player__in=self.listed).count(), 4)
+        self.team.refresh_from_db()
+        self.assertEqual(self.team.budget, test_user["budget"])
+
+
+""" Unit Test for Bulk Transfer List Views """
+
+
+class BulkTransferListViewTest(BaseClassForUnitTest):
+    def setUp(self):
+        super().setUp()  # Inheriting from the Base Class For Unit Test
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        self.username = {"username": self.user.username}
+
+    def test_bulk_list_players(self):
+        url = reverse("bulk-list-player", kwargs=self.username)
+        players = [
+            {"player_id": str(player.id), "asking_price": "1500.00"}
+            for player in self.players[1:6]
+        ]
+        players.append({"player_id": str(self.players[0].id), "asking_price": "1.00"})
+        players.append({"player_id": str(self.players2[1].id), "asking_price": "1.00"})
+        # Token, players, then a savepoint around the insert and the update
+        # (the market statistics follow the commit)
+        with self.assertNumQueries(6):
+            response = self.client.post(url, {"players": players}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [result["status"] for result in response.data["results"]],
+            ["Listed"] * 5 + ["Error"] * 2,
+        )
+        for player in self.players[1:6]:
+            player.refresh_from_db()
+            self.assertEqual(player.listing_status, "Listed")
+            self.assertEqual(
+                MarketList.objects.get(player=player).asking_price,
+                Decimal("1500.00"),
+            )
+        # Already listed player keeps its price, other team's player untouched
+        self.transfer_list.refresh_from_db()
+        self.assertEqual(self.transfer_list.asking_price, Decimal("4500.00"))
+        self.assertFalse(TransferList.objects.filter(player=self.players2[1]).exists())
+
+    def test_bulk_reprice_and_delist_players(self):
+        reprice_url = reverse("bulk-reprice-player", kwargs=self.username)
+        delist_url = reverse("bulk-delist-player", kwargs=self.username)
+        players = [
+            {"player_id": str(self.players[0].id), "asking_price": "2500.00"},
+            {"player_id": str(self.players[1].id), "asking_price": "2500.00"},
+        ]
+        response = self.client.post(reprice_url, {"players": players}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [result["status"] for result in response.data["results"]],
+            ["Repriced", "Error"],
+        )
+        self.transfer_list.refresh_from_db()
+        self.assertEqual(self.transfer_list.asking_price, Decimal("2500.00"))
+
+        response = self.client.post(
+            delist_url,
+            {"players": [{"player_id": str(self.players[0].id)}]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["results"][0]["status"], "Delisted")
+        self.assertFalse(TransferList.objects.filter(player=self.players[0]).exists())
+        self.assertFalse(MarketList.objects.filter(pk=self.market_list.pk).exists())
+        self.players[0].refresh_from_db()
+        self.assertEqual(self.players[0].listing_status, "Not Listed")
+
+        # Nothing left to delist
+        response = self.client.post(
+            delist_url,
+            {"players": [{"player_id": str(self.players[0].id)}]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_listing_changed_after_the_check_is_a_conflict(self):
+        def load_then_change(items, username):
+            loaded = load_own_players(items, username)
+            # Another request reprices the listing after it was checked
+            TransferList.objects.filter(pk=self.transfer_list.pk).update(
+                asking_price=F("asking_price") + 1
+            )
+            return loaded
+
+        item = {"player_id": str(self.players[0].id), "asking_price": "2500.00"}
+        with patch("api.helper.load_own_players", side_effect=load_then_change):
+            for name in ["bulk-reprice-player", "bulk-delist-player"]:
+                response = self.client.post(
+                    reverse(name, kwargs=self.username),
+                    {"players": [item]},
+                    format="json",
+                )
+                self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.transfer_list.refresh_from_db()
+        self.assertEqual(self.transfer_list.asking_price, Decimal("4502.00"))
+
+    def test_other_managers_token_is_refused(self):
+        token2 = Token.objects.create(user=self.user2)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token2.key)
+        item = {"player_id": str(self.players[0].id), "asking_price": "1.00"}
+        for name, data in [
+            ("transfer-list", dict(item, player_id=str(self.players[1].id))),
+            (
+                "bulk-list-player",
+                {"players": [dict(item, player_id=str(self.players[1].id))]},
+            ),
+            ("bulk-reprice-player", {"players": [item]}),
+            ("bulk-delist-player", {"players": [{"player_id": item["player_id"]}]}),
+        ]:
+            response = self.client.post(
+                reverse(name, kwargs=self.username), data, format="json"
+            )
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN, name)
+        self.assertEqual(
+            list(TransferList.objects.filter(player__team=self.team)),
+            [self.transfer_list],
+        )
+        self.transfer_list.refresh_from_db()
+        self.assertEqual(self.transfer_list.asking_price, Decimal("4500.00"))
+
+
+""" Unit Test for Transactional Listing """
+
+
+class TransactionalListingTest(BaseClassForUnitTest):
+    def setUp(self):
+        super().setUp()  # Inheriting from the Base Class For Unit Test
+        self.url = reverse("transfer-list", kwargs={"username": self.user.username})
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+    def test_duplicate_listing_is_detected_without_writing(self):
+        data = {"player_id": str(self.players[0].id), "asking_price": "1.00"}
+        # Token and the player with its listing, nothing else
+        with self.assertNumQueries(2):
+            response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Warning", response.data)
+        self.transfer_list.refresh_from_db()
+        self.assertEqual(self.transfer_list.asking_price, Decimal("4500.00"))
+
+    def test_stale_player_is_not_listed(self):
+        # Read as unlisted and owned, then listed and sold by other requests
+        player = Player.objects.get(pk=self.players[1].pk)
+        TransferList.objects.create(player=self.players[1], asking_price=Decimal("1"))
+        self.assertIsNone(
+            create_listings([(player, Decimal("2000.00"))], self.user.username)
+        )
+        self.assertEqual(TransferList.objects.get(player=player).asking_price, 1)
+
+        player = Player.objects.get(pk=self.players[2].pk)
+        Player.objects.filter(pk=player.pk).update(team=self.team2)
+        self.assertIsNone(
+            create_listings([(player, Decimal("2000.00"))], self.user.username)
+        )
+        self.assertFalse(TransferList.objects.filter(player=player).exists())
+
+    def test_listing_is_all_or_nothing(self):
+        players = self.players[1:4]
+        statuses = {player.pk: player.listing_status for player in players}
+        listed = [
+            (Player.objects.get(pk=player.pk), Decimal("2000.00")) for player in players
+        ]
+        # The last one changed team after it was read
+        Player.objects.filter(pk=players[-1].pk).update(team=self.team2)
+        self.assertIsNone(create_listings(listed, self.user.username))
+        self.assertFalse(TransferList.objects.filter(player__in=players).exists())
+        self.assertEqual(
+            dict(
+                Player.objects.filter(pk__in=statuses).values_list(
+                    "pk", "listing_status"
+                )
+            ),
+            statuses,
+        )
+
+
+""" Unit Test for Idempotency Keys """
+
+
+class IdempotencyKeyTest(BaseClassForUnitTest):
+    def setUp(self):
+        super().setUp()  # Inheriting from the Base Class For Unit Test
+        self.url = reverse("buy-player", kwargs={"username": self.user.username})
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        self.data = {
+            "player_id": str(self.players2[0].id),
+            "price": str(self.transfer_list2.asking_price),
+        }
+
+    def buy(self, data, key="retry-1"):
+        return self.client.post(self.url, data, format="json", HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_first_response(self):
+        first = self.buy(self.data)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        budget = Team.objects.get(pk=self.team.pk).budget
+
+        # Token lookup and the stored response, the purchase does not run again
+        with self.assertNumQueries(2):
+            retry = self.buy(self.data)
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Team.objects.get(pk=self.team.pk).budget, budget)
+
+        # A new key is a new request: the player is no longer listed
+        self.assertEqual(
+            self.buy(self.data, "retry-2").status_code, status.HTTP_400_BAD_REQUEST
+        )
+
+    def test_key_reused_for_another_request(self):
+        self.buy(self.data)
+        response = self.buy(dict(self.data, price="1.00"))
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    @override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0)
+    def test_duplicate_of_running_request_is_held(self):
+        # The first request claimed the key and has not answered yet
+        response = self.buy(self.data)
+        record = IdempotencyRecord.objects.get(key="retry-1")
+        record.status_code = record.body = None
+        record.save()
+        response = self.buy(self.data)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    @override_settings(IDEMPOTENCY_KEY_TTL=60)
+    def test_expired_key_runs_again(self):
+        self.buy(self.data)
+        IdempotencyRecord.objects.update(
+            created_at=timezone.now() - timedelta(seconds=61)
+        )
+        response = self.buy(self.data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertNotIn("Idempotent-Replayed", response)
+
+        IdempotencyRecord.objects.update(
+            created_at=timezone.now() - timedelta(seconds=61)
+        )
+        call_command("purge_idempotency_keys", stdout=StringIO())
+        self.assertFalse(IdempotencyRecord.objects.exists())
+
+    def test_server_error_is_not_stored(self):
+        with patch("api.views.buy_player", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.buy(self.data)
+        self.assertFalse(IdempotencyRecord.objects.exists())
+        self.assertEqual(self.buy(self.data).status_code, status.HTTP_200_OK)
+
+    @override_settings(BUY_PLAYER_MAX_RETRIES=0)
+    def test_conflict_is_not_stored(self):
+        with patch("api.helper.attempt_purchase", side_effect=PurchaseConflict):
+            response = self.buy(self.data)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(IdempotencyRecord.objects.exists())
+
+        # The retry the 409 asks for runs the purchase
+        retry = self.buy(self.data)
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertNotIn("Idempotent-Replayed", retry)
+
+
+""" Unit Test for Order Book """
+
+
+class OrderBookTest(BaseClassForUnitTest):
+    def setUp(self):
+        super().setUp()  # Inheriting from the Base Class For Unit Test
+        order_book.reset()
+        self.url = reverse("place-bid", kwargs={"username": self.user.username})
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+        # A 3rd manager competing for the same players
+        self.user3 = CustomUser.objects.create_user(
+            email="test3@example.com",
+            password="1122",
+            username="testuser3",
+            name="Test User 3",
+        )
+        self.team3 = Team.objects.create(
+            owner=self.user3, name="Test Team 3", country="Brazil"
+        )
+
+    def tearDown(self):
+        order_book.reset()
+        super().tearDown()
+
+    def bid(self, player, price):
+        return self.client.post(
+            self.url, {"player_id": str(player.id), "price": price}, format="json"
+        )
+
+    def test_bid_rests_then_crosses_at_asking_price(self):
+        player = self.players2[0]  # Listed at 5500.00
+        response = self.bid(player, "5000.00")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["status"], "Open")
+        self.assertTrue(Bid.objects.filter(player=player, team=self.team).exists())
+
+        # Raising the bid crosses the ask, the resting ask sets the price
+        response = self.bid(player, "6000.00")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        player.refresh_from_db()
+        self.assertEqual(player.team, self.team)
+        self.team.refresh_from_db()
+        self.assertEqual(self.team.budget, test_user["budget"] - Decimal("5500.00"))
+        self.assertFalse(Bid.objects.exists())
+        self.assertFalse(TransferList.objects.filter(player=player).exists())
+
+    def test_own_player_and_budget_are_checked(self):
+        response = self.bid(self.players[1], "10.00")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.bid(self.players2[1], "9999999.00")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Bid.objects.exists())
+
+    def test_new_listing_fills_best_bid_with_price_time_priority(self):
+        player = self.players2[1]
+        order_book.submit(self.team3, [(player, Decimal("3000.00"))])
+        order_book.submit(self.team, [(player, Decimal("3000.00"))])
+        order_book.submit(self.team, [(self.players2[2], Decimal("9000.00"))])
+
+        # Listing below both bids fills the earlier one at its own price
+        transfer_list_url = reverse(
+            "transfer-list", kwargs={"username": self.user2.username}
+        )
+        token2 = Token.objects.create(user=self.user2)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token2.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                transfer_list_url,
+                {"player_id": str(player.id), "asking_price": "2000.00"},
+                format="json",
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        player.refresh_from_db()
+        self.assertEqual(player.team, self.team3)
+        self.team3.refresh_from_db()
+        self.assertEqual(self.team3.budget, Decimal("5000000.00") - 3000)
+        # The later bid and the bid on the unlisted player keep resting
+        self.assertEqual(order_book.stats()["resting_bids"], 2)
+        self.assertEqual(Bid.objects.count(), 2)
+
+    def test_unfunded_bid_is_cancelled_for_the_next_one(self):
+        player = self.players2[1]
+        order_book.submit(self.team3, [(player, Decimal("4000.00"))])
+        order_book.submit(self.team, [(player, Decimal("3000.00"))])
+        Team.objects.filter(pk=self.team3.pk).update(budget=100)
+
+        TransferList.objects.create(player=player, asking_price=Decimal("2500.00"))
+        filled = order_book.match_all()
+        self.assertEqual(list(filled.values()), [Decimal("3000.00")])
+        player.refresh_from_db()
+        self.assertEqual(player.team, self.team)
+        self.assertFalse(Bid.objects.exists())
+        self.assertEqual(order_book.stats()["resting_bids"], 0)
+
+    def test_book_is_rebuilt_and_settled_in_one_batch(self):
+        players = self.players2[1:6]
+        for player in players:
+            order_book.submit(self.team, [(player, Decimal("2000.00"))])
+
+        # Restart: the book comes back from the Bid and TransferList tables
+        order_book.reset()
+        for player in players:
+            TransferList.objects.create(player=player, asking_price=Decimal("1000.00"))
+        order_book.load()
+        self.assertEqual(order_book.stats()["resting_bids"], 5)
+
+        batches = order_book.stats()["settled_batches"]
+        filled = order_book.match_all()
+        self.assertEqual(len(filled), 5)
+        self.assertEqual(order_book.stats()["settled_batches"], batches + 1)
+        self.assertEqual(
+            Player.objects.filter(
+                pk__in=[p.pk for p in players], team=self.team
+            ).count(),
+            5,
+        )
+        self.assertEqual(
+            Team.objects.get(pk=self.team.pk).budget,
+            test_user["budget"] - 5 * Decimal("2000.00"),
+        )
+
+    def test_cancel_bid(self):
+        self.bid(self.players2[1], "100.00")
+        url = reverse("cancel-bid", kwargs={"username": self.user.username})
+        data = {"player_id": str(self.players2[1].id)}
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(Bid.objects.exists())
+        self.assertEqual(order_book.stats()["resting_bids"], 0)
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_other_managers_token_is_refused(self):
+        order_book.submit(self.team, [(self.players2[1], Decimal("100.00"))])
+        token2 = Token.objects.create(user=self.user2)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token2.key)
+        response = self.bid(self.players2[0], "9000.00")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post(
+            reverse("cancel-bid", kwargs={"username": self.user.username}),
+            {"player_id": str(self.players2[1].id)},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(
+            list(Bid.objects.values_list("team", flat=True)), [self.team.pk]
+        )
+        self.assertTrue(TransferList.objects.filter(player=self.players2[0]).exists())
+
+    def test_bid_changed_elsewhere_is_not_filled(self):
+        cancelled, replaced = self.players2[1], self.players2[2]
+        order_book.submit(self.team, [(cancelled, Decimal("3000.00"))])
+        order_book.submit(self.team, [(replaced, Decimal("3000.00"))])
+        # Another worker cancels one bid and replaces the other below the ask
+        Bid.objects.filter(player=cancelled).delete()
+        Bid.objects.filter(player=replaced).update(
+            price=Decimal("1000.00"), placed_at=timezone.now()
+        )
+        for player in (cancelled, replaced):
+            with self.captureOnCommitCallbacks(execute=True):
+                TransferList.objects.create(
+                    player=player, asking_price=Decimal("2000.00")
+                )
+        self.assertEqual(
+            Player.objects.filter(
+                pk__in=[cancelled.pk, replaced.pk], team=self.team2
+            ).count(),
+            2,
+        )
+        self.assertEqual(Team.objects.get(pk=self.team.pk).budget, test_user["budget"])
+        self.assertEqual(order_book.stats()["resting_bids"], 0)
+        self.assertEqual(Bid.objects.get(player=replaced).price, Decimal("1000.00"))
+
+    def test_bids_of_other_processes_reload_the_book(self):
+        order_book.submit(self.team, [(self.players2[1], Decimal("100.00"))])
+        Bid.objects.create(
+            player=self.players2[1],
+            team=self.team3,
+            price=Decimal("200.00"),
+            placed_at=timezone.now(),
+        )
+        drop_order_book(ORDER_BOOK_KEY)
+        order_book.ensure_loaded()
+        self.assertEqual(order_book.stats()["resting_bids"], 2)
+
+
+""" Test for Timed Auctions """
+
+
+class AuctionTest(BaseClassForUnitTest):
+    def setUp(self):
+        super().setUp()  # Inheriting from the Base Class For Unit Test
+        order_book.reset()
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+        # A 3rd manager competing for the same players
+        self.user3 = CustomUser.objects.create_user(
+            email="test3@example.com",
+            password="1122",
+            username="testuser3",
+            name="Test User 3",
+        )
+        self.team3 = Team.objects.create(
+            owner=self.user3, name="Test Team 3", country="Brazil"
+        )
+
+    def tearDown(self):
+        order_book.reset()
+        super().tearDown()
+
+    def auction(self, players, reserve, ends_in):
+        return create_listings(
+            [(player, Decimal(reserve)) for player in players],
+            self.user2.username,
+            timezone.now() + ends_in,
+        )
+
+    def test_list_and_bid_on_an_auction(self):
+        player = self.players2[1]
+        token2 = Token.objects.create(user=self.user2)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token2.key)
+        response = self.client.post(
+            reverse("transfer-list", kwargs={"username": self.user2.username}),
+            {
+                "player_id": str(player.id),
+                "asking_price": "1000.00",
+                "auction_ends_at": (timezone.now() + timedelta(hours=1)).isoformat(),
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn("auction_ends_at", response.data)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+        # Bids at or above the reserve rest until the auction closes
+        url = reverse("place-bid", kwargs={"username": self.user.username})
+        response = self.client.post(
+            url, {"player_id": str(player.id), "price": "999.00"}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(
+            url, {"player_id": str(player.id), "price": "5000.00"}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["status"], "Open")
+        player.refresh_from_db()
+        self.assertEqual(player.team, self.team2)
+
+        # And the player can't be bought at the reserve meanwhile
+        response = self.client.post(
+            reverse("buy-player", kwargs={"username": self.user.username}),
+            {"player_id": str(player.id), "price": "1000.00"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_auction_must_end_in_the_future(self):
+        token2 = Token.objects.create(user=self.user2)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token2.key)
+        response = self.client.post(
+            reverse("transfer-list", kwargs={"username": self.user2.username}),
+            {
+                "player_id": str(self.players2[1].id),
+                "asking_price": "1000.00",
+                "auction_ends_at": (timezone.now() - timedelta(hours=1)).isoformat(),
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(TransferList.objects.filter(player=self.players2[1]).exists())
+
+    def test_close_due_settles_best_funded_bid(self):
+        sold, unsold, unfunded, running = self.players2[1:5]
+        self.auction([sold, unsold, unfunded], "1000.00", timedelta(minutes=-5))
+        self.auction([running], "1000.00", timedelta(hours=1))
+        Bid.objects.bulk_create(
+            Bid(
+                player=player, team=team, price=Decimal(price), placed_at=timezone.now()
+            )
+            for player, team, price in [
+                (sold, self.team, "3000.00"),
+                (sold, self.team3, "4000.00"),
+                (unsold, self.team, "500.00"),
+                (unfunded, self.team3, "9000000.00"),
+                (unfunded, self.team, "2000.00"),
+                (running, self.team, "2000.00"),
+            ]
+        )
+
+        passes = auction_closer.stats()["passes"]
+        result = auction_closer.close_due()
+        self.assertEqual(result, {"sold": 2, "unsold": 1, "failed": 0})
+        self.assertEqual(Player.objects.get(pk=sold.pk).team, self.team3)
+        self.assertEqual(Player.objects.get(pk=unfunded.pk).team, self.team)
+        unsold.refresh_from_db()
+        self.assertEqual(unsold.team, self.team2)
+        self.assertEqual(unsold.listing_status, "Not Listed")
+        self.assertEqual(
+            Team.objects.get(pk=self.team3.pk).budget,
+            test_user["budget"] - Decimal("4000.00"),
+        )
+        self.assertEqual(
+            Team.objects.get(pk=self.team.pk).budget,
+            test_user["budget"] - Decimal("2000.00"),
+        )
+
+        # The running auction and its bid are left alone
+        self.assertEqual(
+            list(Bid.objects.values_list("player", flat=True)), [running.pk]
+        )
+        self.assertTrue(TransferList.objects.filter(player=running).exists())
+
+        stats = auction_closer.stats()
+        self.assertEqual(stats["passes"], passes + 1)
+        self.assertEqual(stats["last_pass"]["closed"], 3)
+        self.assertGreaterEqual(stats["last_pass"]["max_lag_ms"], 5 * 60 * 1000)
+        self.assertEqual(stats["due"], 0)
+
+    def test_close_due_queries_do_not_grow_with_auctions(self):
+        def close(players):
+            self.auction(players, "1000.00", timedelta(seconds=-1))
+            Bid.objects.bulk_create(
+                Bid(
+                    player=player,
+                    team=team,
+                    price=Decimal("2000.00"),
+                    placed_at=timezone.now(),
+                )
+                for player in players[::2]
+                for team in (self.team, self.team3)
+            )
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(auction_closer.close_due()["failed"], 0)
+            return len(queries)
+
+        self.assertEqual(close(self.players2[1:3]), close(self.players2[3:13]))
+        self.assertFalse(
+            TransferList.objects.filter(player__team=self.team2)
+            .exclude(player=self.players2[0])
+            .exists()
+        )
+
+    def test_close_auctions_command(self):
+        self.auction([self.players2[1]], "1000.00", timedelta(seconds=-1))
+        order_book.submit(self.team3, [(self.players2[1], Decimal("10.00"))])
+        out = StringIO()
+        with patch("api.invalidation.publish_bids_change") as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command("close_auctions", stdout=out)
+        self.assertIn("Closed 1 auctions: 0 sold, 1 unsold", out.getvalue())
+        self.assertFalse(TransferList.objects.filter(player=self.players2[1]).exists())
+        # Other processes drop the auction's bids from their books too
+        publish.assert_called_once()
+        self.assertEqual(order_book.stats()["resting_bids"], 0)
+
+    def test_withdrawn_auction_takes_its_bids(self):
+        player = self.players2[1]
+        self.auction([player], "1000.00", timedelta(hours=1))
+        order_book.submit(self.team, [(player, Decimal("5000.00"))])
+        token2 = Token.objects.create(user=self.user2)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token2.key)
+        username = {"username": self.user2.username}
+        items = {"players": [{"player_id": str(player.id), "asking_price": "9.00"}]}
+
+        # The reserve can't change under the bidders
+        response = self.client.post(
+            reverse("bulk-reprice-player", kwargs=username), items, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        listing = TransferList.objects.get(player=player)
+        self.assertEqual(listing.asking_price, Decimal("1000.00"))
+
+        with patch("api.invalidation.publish_bids_change") as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    reverse("bulk-delist-player", kwargs=username),
+                    {"players": [{"player_id": str(player.id)}]},
+                    format="json",
+                )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        publish.assert_called_once()
+        self.assertFalse(Bid.objects.exists())
+        self.assertEqual(order_book.stats()["resting_bids"], 0)
+
+        # Listed again at a fixed price, no ghost bid crosses it
+        with self.captureOnCommitCallbacks(execute=True):
+            create_listings([(player, Decimal("100.00"))], self.user2.username)
+        player.refresh_from_db()
+        self.assertEqual(player.team, self.team2)
+
+
+""" Test for Trade Ledger """
+
+
+class TradeLedgerTest(BaseClassForUnitTest):
+    def setUp(self):
+        super().setUp()  # Inheriting from the Base Class For Unit Test
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+    def trade(self, player, seller, buyer, days_ago=0):
+        return Trade.objects.create(
+            player=player,
+            seller_team=seller,
+            buyer_team=buyer,
+            price=Decimal("1000.00"),
+            value_before=Decimal("1000000.00"),
+            value_after=Decimal("1500000.00"),
+            traded_at=timezone.now() - timedelta(days=days_ago),
+        )
+
+    def test_buy_player_records_trade(self):
+        response = self.client.post(
+            reverse("buy-player", kwargs={"username": self.user.username}),
+            {"player_id": str(self.players2[0].id), "price": "5500.00"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        trade = Trade.objects.get()
+        self.assertEqual(trade.player_id, self.players2[0].pk)
+        self.assertEqual(trade.seller_team, self.team2)
+        self.assertEqual(trade.buyer_team, self.team)
+        self.assertEqual(trade.price, Decimal("5500.00"))
+        self.assertEqual(trade.value_before, Decimal("1000000.00"))
+        self.assertEqual(
+            trade.value_after, Player.objects.get(pk=self.players2[0].pk).market_value
+        )
+
+    def test_failed_purchase_records_nothing(self):
+        response = self.client.post(
+            reverse("buy-player", kwargs={"username": self.user.username}),
+            {"player_id": str(self.players2[0].id), "price": "1.00"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Trade.objects.exists())
+
+    def test_history_is_cursor_paginated_newest_first(self):
+        trades = [self.trade(self.players2[1], self.team2, self.team) for _ in range(5)]
+        url = reverse("player-trades", kwargs={"player_id": self.players2[1].id})
+        seen = []
+        response = self.client.get(url, {"page_size": 2})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(trade["id"] for trade in response.data["results"])
+            if not response.data["next"]:
+                break
+            response = self.client.get(response.data["next"])
+        self.assertEqual(seen, [trade.pk for trade in reversed(trades)])
+
+    def test_team_and_global_history(self):
+        bought = self.trade(self.players2[1], self.team2, self.team)
+        sold = self.trade(self.players[1], self.team, self.team2)
+        self.trade(self.players2[2], self.team2, self.team2)
+
+        response = self.client.get(
+            reverse("team-trades", kwargs={"username": self.user.username})
+        )
+        self.assertEqual(
+            [trade["id"] for trade in response.data["results"]], [sold.pk, bought.pk]
+        )
+        response = self.client.get(reverse("trades"))
+        self.assertEqual(len(response.data["results"]), 3)
+        response = self.client.get(
+            reverse("team-trades", kwargs={"username": "nobody"})
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_team_history_pages_through_both_sides(self):
+        trades = [
+            self.trade(self.players2[1], self.team2, self.team),
+            self.trade(self.players[1], self.team, self.team2),
+            self.trade(self.players2[2], self.team2, self.team2),
+            self.trade(self.players2[1], self.team2, self.team),
+            self.trade(self.players[2], self.team, self.team2),
+        ]
+        url = reverse("team-trades", kwargs={"username": self.user.username})
+        pages = []
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {"page_size": 2})
+        # Each side reads no more than a page and the next trade
+        reads = [query["sql"] for query in queries if '"api_trade"' in query["sql"]]
+        self.assertEqual(len(reads), 2)
+        self.assertTrue(all(sql.endswith(" LIMIT 3") for sql in reads))
+        while True:
+            pages.append([trade["id"] for trade in response.data["results"]])
+            if not response.data["next"]:
+                break
+            response = self.client.get(response.data["next"])
+        expected = [trade.pk for trade in reversed(trades) if trade is not trades[2]]
+        self.assertEqual(pages, [expected[:2], expected[2:]])
+
+        # And back
+        response = self.client.get(response.data["previous"])
+        self.assertEqual(
+            [trade["id"] for trade in response.data["results"]], expected[:2]
+        )
+
+    def test_archive_trades_command(self):
+        old = [
+            self.trade(self.players2[1], self.team2, self.team, 400) for _ in range(3)
+        ]
+        recent = self.trade(self.players2[1], self.team2, self.team, 1)
+
+        out = StringIO()
+        call_command("archive_trades", "--batch-size", "2", stdout=out)
+        self.assertIn("Archived 3 trades", out.getvalue())
+        self.assertEqual(list(Trade.objects.values_list("pk", flat=True)), [recent.pk])
+        self.assertEqual(
+            sorted(ArchivedTrade.objects.values_list("pk", flat=True)),
+            [trade.pk for trade in old],
+        )
+
+        response = self.client.get(reverse("trades"), {"archived": "true"})
+        self.assertEqual(
+            [trade["id"] for trade in response.data["results"]],
+            [trade.pk for trade in reversed(old)],
+        )
+
+
+""" Test for Market Statistics """
+
+
+class MarketStatsTest(BaseClassForUnitTest):
+    def setUp(self):
+        super().setUp()  # Inheriting from the Base Class For Unit Test
+        self.url = reverse("market-stats")
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        # Count the fixture listings, made without a commit
+        self.reconcile("--fix")
+
+    def reconcile(self, *args):
+        out = StringIO()
+        call_command("reconcile_market_stats", *args, stdout=out)
+        return out.getvalue()
+
+    def goalkeepers(self, players):
+        Player.objects.filter(pk__in=[p.pk for p in players]).update(
+            position="Goalkeeper"
+        )
+        for player in players:
+            player.position = "Goalkeeper"
+        return players
+
+    def goalkeeper_stats(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return next(
+            row
+            for row in response.data["by_position"]
+            if row["position"] == "Goalkeeper"
+        )
+
+    def test_listing_paths_keep_stats_in_step(self):
+        players = self.goalkeepers(self.players[1:5])
+        username = {"username": self.user.username}
+        with self.captureOnCommitCallbacks(execute=True):
+            create_listings(
+                [
+                    (player, Decimal(price))
+                    for player, price in zip(players, [1, 2, 3, 4])
+                ],
+                self.user.username,
+            )
+            self.client.post(
+                reverse("bulk-reprice-player", kwargs=username),
+                {
+                    "players": [
+                        {"player_id": str(players[1].id), "asking_price": "20.00"}
+                    ]
+                },
+                format="json",
+            )
+            self.client.post(
+                reverse("bulk-delist-player", kwargs=username),
+                {"players": [{"player_id": str(players[3].id)}]},
+                format="json",
+            )
+            self.client.post(
+                reverse("buy-player", kwargs=username),
+                {"player_id": str(self.players2[0].id), "price": "5500.00"},
+                format="json",
+            )
+        self.assertIn("Found 0 drifted statistics.", self.reconcile())
+
+        expected = TransferList.objects.filter(player__position="Goalkeeper").aggregate(
+            count=Count("pk"), low=Min("asking_price"), high=Max("asking_price")
+        )
+        stats = self.goalkeeper_stats()
+        self.assertEqual(stats["listings"], expected["count"])
+        self.assertEqual(stats["min_price"], expected["low"])
+        self.assertEqual(stats["max_price"], expected["high"])
+
+        sales = self.client.get(self.url).data["daily_sales"]
+        self.assertEqual(sales[0]["day"], timezone.localdate())
+        self.assertEqual(sales[0]["sales"], 1)
+        self.assertEqual(sales[0]["volume"], Decimal("5500.00"))
+
+    def test_removed_extreme_is_recomputed_on_read(self):
+        TransferList.objects.all().delete()
+        self.reconcile("--fix")
+        players = self.goalkeepers(self.players[1:4])
+        with self.captureOnCommitCallbacks(execute=True):
+            create_listings(
+                [(player, Decimal(price)) for player, price in zip(players, [1, 2, 3])],
+                self.user.username,
+            )
+            self.client.post(
+                reverse("bulk-delist-player", kwargs={"username": self.user.username}),
+                {"players": [{"player_id": str(players[0].id)}]},
+                format="json",
+            )
+        stat = MarketStat.objects.get(dimension="position", value="Goalkeeper")
+        self.assertEqual(stat.listings, 2)
+        self.assertIsNone(stat.min_price)
+        self.assertEqual(stat.max_price, Decimal("3.00"))
+
+        stats = self.goalkeeper_stats()
+        self.assertEqual(stats["min_price"], Decimal("2.00"))
+        self.assertEqual(stats["average_price"], Decimal("2.50"))
+        stat.refresh_from_db()
+        self.assertEqual(stat.min_price, Decimal("2.00"))
+
+    def test_reconcile_reports_and_fixes_drift(self):
+        self.assertIn("Found 0 drifted statistics.", self.reconcile())
+        MarketStat.objects.filter(dimension="country").update(
+            listings=F("listings") + 1
+        )
+        output = self.reconcile("--fix")
+        self.assertIn("listings is", output)
+        self.assertIn("Found and fixed", output)
+        self.assertIn("Found 0 drifted statistics.", self.reconcile())
+
+    def test_admin_price_edit_is_recorded(self):
+        listing = MarketList.objects.get(pk=self.transfer_list.pk)
+        listing.asking_price = Decimal("9000.00")
+        with self.captureOnCommitCallbacks(execute=True):
+            listing.save()
+        self.assertIn("Found 0 drifted statistics.", self.reconcile())
+
+
+""" Test for Team Leaderboard """
+
+
+class LeaderboardTest(BaseClassForUnitTest):
+    def setUp(self):
+        super().setUp()  # Inheriting from the Base Class For Unit Test
+        leaderboard.reset()
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+        # A 3rd team richer than the other two
+        self.user3 = CustomUser.objects.create_user(
+            email="test3@example.com",
+            password="1122",
+            username="testuser3",
+            name="Test User 3",
+        )
+        self.team3 = Team.objects.create(
+            owner=self.user3,
+            name="Test Team 3",
+            country="Brazil",
+            final_value=Decimal("90000000.00"),
+        )
+
+    def tearDown(self):
+        leaderboard.reset()
+        super().tearDown()
+
+    def rank(self, username, metric="final_value"):
+        return self.client.get(
+            reverse("team-rank", kwargs={"username": username}), {"metric": metric}
+        )
+
+    def test_top_and_rank(self):
+        response = self.client.get(reverse("leaderboard"), {"limit": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [team["team_id"] for team in response.data["teams"]],
+            [self.team3.pk, self.team.pk],  # Ties go to the lower id
+        )
+        self.assertEqual(response.data["teams"][0]["rank"], 1)
+
+        response = self.rank(self.user2.username)
+        self.assertEqual(response.data["rank"], 3)
+        self.assertEqual(response.data["of"], 3)
+        # Same budgets, ranked by id
+        self.assertEqual(self.rank(self.user3.username, "budget").data["rank"], 3)
+        self.assertEqual(self.rank("nobody").status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_rank_lookup_does_not_count_teams(self):
+        leaderboard.rebuild()
+        # Token and the team id, the rank comes from the cached ranking
+        with self.assertNumQueries(2):
+            response = self.rank(self.user.username)
+        self.assertEqual(response.data["rank"], 2)
+
+    def test_purchase_and_signup_update_the_ranking(self):
+        leaderboard.rebuild()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("buy-player", kwargs={"username": self.user.username}),
+                {"player_id": str(self.players2[0].id), "price": "5500.00"},
+                format="json",
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            self.rank(self.user.username, "budget").data["budget"],
+            Team.objects.get(pk=self.team.pk).budget,
+        )
+        self.assertEqual(self.rank(self.user2.username, "budget").data["rank"], 1)
+
+        user4 = CustomUser.objects.create_user(
+            email="test4@example.com", password="1122", username="testuser4"
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            Team.objects.create(owner=user4, name="Test Team 4", country="Chile")
+        self.assertEqual(self.rank(user4.username).data["of"], 4)
+        self.assertEqual(leaderboard.verify(), [])
+
+    def test_change_during_rebuild_is_kept(self):
+        read = Team.objects.values_list
+
+        def read_then_change(*args, **kwargs):
+            rows = list(read(*args, **kwargs))
+            # Another request commits before the read is swapped in
+            Team.objects.filter(pk=self.team.pk).update(
+                final_value=Decimal("99000000.00")
+            )
+            teams_changed.send(sender=Team, team_ids={self.team.pk})
+            return rows
+
+        with patch.object(Team.objects, "values_list", side_effect=read_then_change):
+            leaderboard.rebuild()
+        self.assertEqual(leaderboard.top("final_value", 1)[0]["team_id"], self.team.pk)
+        self.assertEqual(leaderboard.verify(), [])
+
+
+""" Test for Team Value Reconciliation """
+
+
+class ReconcileTeamValuesTest(BaseClassForUnitTest):
+    def reconcile(self, *args):
+        out = StringIO()
+        call_command("reconcile_team_values", *args, stdout=out)
+        return out.getvalue()
+
+    def drift(self):
+        Team.objects.filter(pk=self.team.pk).update(team_value=1)
+        Player.objects.filter(pk=self.players2[1].pk).update(
+            market_value=F("market_value") + 500
+        )
+        user3 = CustomUser.objects.create_user(
+            email="test3@example.com", password="1122", username="testuser3"
+        )
+        # No players at all
+        return Team.objects.create(
+            owner=user3, name="Test Team 3", country="Chile", team_value=5
+        )
+
+    def test_dry_run_reports_drift_only(self):
+        self.drift()
+        output = self.reconcile("--dry-run")
+        self.assertIn(f"Team {self.team.pk}: team_value 1.00 -> 20000000.00", output)
+        self.assertIn("3 teams drifted, nothing changed.", output)
+        self.assertEqual(Team.objects.get(pk=self.team.pk).team_value, 1)
+
+    def test_fixes_drifted_teams_in_batches(self):
+        team3 = self.drift()
+        output = self.reconcile("--batch-size", "2")
+        self.assertIn("Fixed 3 of 3 drifted teams.", output)
+        for team in Team.objects.all():
+            expected = sum(player.market_value for player in team.players.all())
+            self.assertEqual(team.team_value, expected)
+            self.assertEqual(team.final_value, team.budget + expected)
+        self.assertEqual(Team.objects.get(pk=team3.pk).team_value, 0)
+        self.assertIn("Fixed 0 of 0 drifted teams.", self.reconcile())
+
+    def test_team_changed_meanwhile_is_left_alone(self):
+        self.drift()
+        command = ReconcileTeamValuesCommand()
+        drifted = list(command.drifted_teams())
+        Team.objects.filter(pk=self.team.pk).update(version=F("version") + 1)
+        self.assertEqual(command.fix(drifted), 2)
+        self.assertEqual(Team.objects.get(pk=self.team.pk).team_value, 1)
+
+    def test_cent_values_are_not_drift(self):
+        # Bought players' values are quantized to cents, not whole amounts
+        Player.objects.filter(team=self.team).update(market_value=Decimal("0.10"))
+        self.assertIn("Fixed 1 of 1 drifted teams.", self.reconcile())
+        version = Team.objects.get(pk=self.team.pk).version
+        self.assertIn("Fixed 0 of 0 drifted teams.", self.reconcile())
+        team = Team.objects.get(pk=self.team.pk)
+        self.assertEqual(team.version, version)
+        expected = sum(player.market_value for player in team.players.all())
+        self.assertEqual(team.team_value, expected)
+
+
+class ValuationTest(BaseClassForUnitTest):
+    def setUp(self):
+        super().setUp()
+        leaderboard.reset()
+
+    def tearDown(self):
+        leaderboard.reset()
+        super().tearDown()
+
+    def test_model_prices_by_age_and_position(self):
+        model = ValuationModel()
+        peak, young, old = model.price([27, 20, 40], ["Midfielder"] * 3, [None] * 3)
+        self.assertEqual(peak, 1000000)
+        self.assertGreater(peak, young)
+        self.assertGreater(young, old)
+        self.assertEqual(old, 400000)  # At the floor
+        goalkeeper, attacker = model.price(
+            [27, 27], ["Goalkeeper", "Attacker"], [None, None]
+        )
+        self.assertLess(goalkeeper, peak)
+        self.assertGreater(attacker, peak)
+
+    def test_model_blends_recent_trade_prices(self):
+        model = ValuationModel(
+            dict(valuation_config(), trade_weight=0.5, base_value=2000000)
+        )
+        (value,) = model.price([27], ["Midfielder"], [1000000.0])
+        self.assertEqual(value, 1500000)
+        (value,) = model.price([27], ["Attacker"], [1e12])
+        self.assertEqual(value, MAX_VALUE)
+
+    def test_revalue_players_refreshes_team_values(self):
+        player = self.players[0]
+        Trade.objects.create(
+            player=player,
+            seller_team=self.team2,
+            buyer_team=self.team,
+            price=Decimal("9000000.00"),
+            value_before=player.market_value,
+            value_after=player.market_value,
+            traded_at=timezone.now(),
+        )
+        leaderboard.rebuild()
+        with self.captureOnCommitCallbacks(execute=True):
+            result = revalue_players(batch_teams=1)
+        self.assertEqual((result["players"], result["teams"]), (40, 2))
+
+        model = ValuationModel()
+        player = Player.objects.get(pk=player.pk)
+        (expected,) = model.price([player.age], [player.position], [9000000.0])
+        self.assertEqual(player.market_value, Decimal(f"{expected:.2f}"))
+        self.assertEqual(player.version, self.players[0].version + 1)
+        for team in Team.objects.all():
+            expected = sum(player.market_value for player in team.players.all())
+            self.assertEqual(team.team_value, expected)
+            self.assertEqual(team.final_value, team.budget + expected)
+        self.assertEqual(leaderboard.verify(), [])
+        out = StringIO()
+        call_command("reconcile_team_values", "--dry-run", stdout=out)
+        self.assertIn("0 teams drifted", out.getvalue())
+
+    def test_player_changed_meanwhile_keeps_its_value(self):
+        player = self.players[0]
+        model = ValuationModel()
+        price = model.price
+
+        def bought_meanwhile(*args):
+            Player.objects.filter(pk=player.pk).update(
+                market_value=Decimal("123.00"), version=F("version") + 1
+            )
+            return price(*args)
+
+        with patch.object(model, "price", side_effect=bought_meanwhile):
+            revalue_players(model)
+        self.assertEqual(Player.objects.get(pk=player.pk).market_value, 123)
+        team = Team.objects.get(pk=self.team.pk)
+        expected = sum(player.market_value for player in team.players.all())
+        self.assertEqual(team.team_value, expected)
+
+    def test_command_reports_throughput(self):
+        out = StringIO()
+        call_command("revalue_players", "--batch-size", "1", stdout=out)
+        self.assertRegex(
+            out.getvalue(), r"Repriced 40 players of 2 teams in .*s \(\d+ players/s\)"
+        )
+
+
+class SeasonRolloverTest(BaseClassForUnitTest):
+    def setUp(self):
+        super().setUp()  # Inheriting from the Base Class For Unit Test
+        Player.objects.update(age=30)
+        self.veterans = self.players[:3] + self.players2[:1]
+        Player.objects.filter(pk__in=[p.pk for p in self.veterans]).update(age=40)
+        self.youth = (ValuationModel(), name_pool(10))
+
+    def rollover(self, *args):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("season_rollover", *args, stdout=out)
+        return out.getvalue()
+
+    def test_ages_retires_and_replaces_players(self):
+        shape = {
+            team.pk: sorted(team.players.values_list("position", flat=True))
+            for team in (self.team, self.team2)
+        }
+        output = self.rollover("--batch-size", "1")
+        self.assertIn("Season 1: rolled over 2 teams, 4 players retired", output)
+        self.assertFalse(
+            Player.objects.filter(pk__in=[p.pk for p in self.veterans]).exists()
+        )
+        self.assertEqual(Player.objects.filter(age=31, season=1).count(), 36)
+        youth = Player.objects.filter(age__lte=18, season=1)
+        self.assertEqual(youth.count(), 4)
+        for team in (self.team, self.team2):
+            team.refresh_from_db()
+            positions = sorted(team.players.values_list("position", flat=True))
+            self.assertEqual(positions, shape[team.pk])
+            expected = sum(player.market_value for player in team.players.all())
+            self.assertEqual(team.team_value, expected)
+            self.assertEqual(team.final_value, team.budget + expected)
+
+        self.assertIn("Season 2: rolled over 2 teams", self.rollover())
+        self.assertEqual(Player.objects.filter(age=32, season=2).count(), 36)
+
+    def test_retired_listing_leaves_the_market(self):
+        veteran = self.veterans[0]
+        # Count the fixture listings, made without a commit
+        call_command("reconcile_market_stats", "--fix", stdout=StringIO())
+        with self.captureOnCommitCallbacks(execute=True):
+            create_listings([(veteran, Decimal("500.00"))], self.user.username)
+        Bid.objects.create(
+            player=veteran,
+            team=self.team2,
+            price=Decimal("100.00"),
+            placed_at=timezone.now(),
+        )
+        self.rollover()
+        self.assertFalse(TransferList.objects.filter(player=veteran.pk).exists())
+        self.assertFalse(Bid.objects.exists())
+        stat = MarketStat.objects.get(dimension="position", value=veteran.position)
+        self.assertEqual((stat.listings, stat.total_price), (0, 0))
+
+    def test_interrupted_rollover_resumes(self):
+        # A run which stopped after rolling over the first team
+        rollover = current_rollover()
+        roll_over_teams(rollover, [self.team.pk], 40, (16, 18), *self.youth)
+        # A player transferred to a team which wasn't rolled over yet
+        Player.objects.filter(pk=self.players[5].pk).update(team=self.team2)
+
+        output = self.rollover()
+        self.assertIn(f"Resuming season 1 after team {self.team.pk}.", output)
+        self.assertIn("Season 1: rolled over 2 teams, 4 players retired", output)
+        self.assertEqual(Player.objects.get(pk=self.players[5].pk).age, 31)
+        self.assertEqual(Player.objects.filter(age=31).count(), 36)
+
+    def test_player_bought_into_a_rolled_over_team_is_aged(self):
+        rollover = current_rollover()
+        roll_over_teams(rollover, [self.team.pk], 40, (16, 18), *self.youth)
+        # Bought from a team not rolled over yet into one already done
+        bought = [self.players2[5].pk, self.players2[0].pk]
+        Player.objects.filter(pk__in=bought).update(team=self.team)
+
+        output = self.rollover()
+        self.assertIn("Season 1: rolled over 2 teams, 4 players retired", output)
+        self.assertEqual(Player.objects.get(pk=bought[0]).age, 31)
+        # The veteran retired, with its listing, and was replaced
+        self.assertFalse(Player.objects.filter(pk=bought[1]).exists())
+        self.assertFalse(TransferList.objects.filter(player=bought[1]).exists())
+        self.assertEqual(Player.objects.filter(team=self.team).count(), 22)
+        self.assertFalse(Player.objects.filter(season=0).exists())
+
+    def test_chunk_rolled_over_by_another_run_is_skipped(self):
+        rollover = current_rollover()
+        stale = current_rollover()
+        self.assertEqual(
+            roll_over_teams(rollover, [self.team.pk], 40, (16, 18), *self.youth), 3
+        )
+        self.assertIsNone(
+            roll_over_teams(stale, [self.team.pk], 40, (16, 18), *self.youth)
+        )
+        self.assertEqual(Player.objects.filter(team=self.team, age=31).count(), 17)
+
+
+class LeagueSimulationTest(BaseClassForUnitTest):
+    def setUp(self):
+        super().setUp()  # Inheriting from the Base Class For Unit Test
+        for number in range(3, 6):
+            user = CustomUser.objects.create_user(
+                email=f"test{number}@example.com",
+                password="1122",
+                username=f"testuser{number}",
+            )
+            user_register_create_team_and_players(user, f"Test Team {number}", "Chile")
+
+    def results(self):
+        return sorted(
+            Fixture.objects.values_list(
+                "division",
+                "round",
+                "home_team",
+                "away_team",
+                "home_goals",
+                "away_goals",
+            )
+        )
+
+    def test_round_robin_meets_every_team_home_and_away(self):
+        rounds = round_robin(range(7))
+        self.assertEqual(len(rounds), 14)
+        pairs = [pair for fixtures in rounds for pair in fixtures]
+        self.assertEqual(len(pairs), 42)
+        self.assertEqual(len(set(pairs)), 42)
+        for fixtures in rounds:
+            teams = [team for pair in fixtures for team in pair]
+            self.assertEqual(len(teams), len(set(teams)))
+
+    def test_every_team_of_an_odd_count_gets_a_standing(self):
+        # Divisions too small to play in are made of two teams
+        result = simulate_season(season=1, division_size=1, workers=1)
+        self.assertEqual((result["divisions"], result["teams"]), (2, 5))
+        self.assertEqual(Standing.objects.filter(season=1).count(), 5)
+
+        # A team which signed up after the season was played sits it out
+        user = CustomUser.objects.create_user(
+            email="test6@example.com", password="1122", username="testuser6"
+        )
+        user_register_create_team_and_players(user, "Test Team 6", "Chile")
+        result = simulate_season(season=1, division_size=2, workers=1)
+        self.assertEqual(
+            (result["divisions"], result["teams"], result["fixtures"]), (1, 1, 0)
+        )
+        standing = Standing.objects.get(season=1, team__owner=user)
+        self.assertEqual((standing.division, standing.played), (3, 0))
+
+    def test_season_writes_fixtures_and_standings(self):
+        result = simulate_season(season=1, division_size=2, workers=1)
+        # The fifth team joins the second division rather than play alone
+        self.assertEqual(
+            (result["divisions"], result["teams"], result["fixtures"]), (2, 5, 8)
+        )
+        standings = Standing.objects.filter(season=1)
+        self.assertEqual(
+            sorted(standings.values_list("division", flat=True)), [1, 1, 2, 2, 2]
+        )
+        for standing in standings:
+            self.assertEqual(
+                standing.played, standing.won + standing.drawn + standing.lost
+            )
+            self.assertEqual(standing.points, 3 * standing.won + standing.drawn)
+            fixtures = Fixture.objects.filter(
+                Q(home_team=standing.team) | Q(away_team=standing.team)
+            )
+            self.assertEqual(fixtures.count(), standing.played)
+        totals = standings.aggregate(
+            scored=Sum("goals_for"), conceded=Sum("goals_against")
+        )
+        self.assertEqual(totals["scored"], totals["conceded"])
+        # Divisions are tiers: the most valuable teams play in the first
+        top = list(
+            Team.objects.order_by("-final_value", "pk").values_list("pk", flat=True)[:2]
+        )
+        self.assertEqual(
+            sorted(standings.filter(division=1).values_list("team", flat=True)),
+            sorted(top),
+        )
+        # Played already
+        self.assertEqual(simulate_season(season=1, workers=1)["fixtures"], 0)
+
+    def test_pool_plays_the_same_season(self):
+        simulate_season(season=1, division_size=2, workers=1)
+        results = self.results()
+        Fixture.objects.all().delete()
+        Standing.objects.all().delete()
+        simulate_season(season=1, division_size=2, workers=2)
+        self.assertEqual(self.results(), results)
+
+    def test_interrupted_season_resumes(self):
+        saved = []
+
+        def interrupted(season, results):
+            if saved:
+                raise RuntimeError("Interrupted")
+            saved.append(save_results(season, results))
+            return saved[-1]
+
+        with patch("api.league.save_results", side_effect=interrupted):
+            with self.assertRaises(RuntimeError):
+                simulate_season(season=1, division_size=2, workers=1, batch_size=1)
+        self.assertEqual(Standing.objects.count(), 2)
+        # The remaining three teams make the next division
+        result = simulate_season(season=1, division_size=20, workers=1)
+        self.assertEqual((result["teams"], result["fixtures"]), (3, 6))
+        self.assertEqual(
+            sorted(Standing.objects.values_list("division", flat=True)),
+            [1, 1, 2, 2, 2],
+        )
+
+    def test_command_reports_throughput(self):
+        out = StringIO()
+        call_command("simulate_season", "--workers", "1", stdout=out)
+        self.assertRegex(
+            out.getvalue(),
+            r"Season 0: 5 teams played 20 fixtures in 1 divisions in .*s",
+        )
+
+
+class RecommendPlayersTest(BaseClassForUnitTest):
+    def setUp(self):
+        super().setUp()  # Inheriting from the Base Class For Unit Test
+        recommender.reset()
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        self.url = reverse("recommend-players", kwargs={"username": self.user.username})
+        TransferList.objects.all().delete()
+        positions = ["Goalkeeper", "Defender", "Midfielder", "Attacker"]
+        rng = random.Random(7)
+        listings = []
+        for index, player in enumerate(self.players2[:16]):
+            player.position = positions[index % 4]
+            player.market_value = Decimal(rng.randrange(500, 4000) * 1000)
+            player.save()
+            listings.append((player, Decimal(rng.randrange(300, 3000) * 1000)))
+        create_listings(listings, self.user2.username)
+        # Cheap and valuable, but the manager's own and an auction
+        own, auctioned = self.players[0], self.players2[16]
+        for player in (own, auctioned):
+            player.position, player.market_value = "Attacker", Decimal("9000000.00")
+            player.save()
+        create_listings([(own, Decimal("1000.00"))], self.user.username)
+        create_listings(
+            [(auctioned, Decimal("1000.00"))],
+            self.user2.username,
+            auction_ends_at=timezone.now() + timedelta(days=1),
+        )
+
+    def tearDown(self):
+        recommender.reset()
+        super().tearDown()
+
+    def brute_force(self, counts, budget):
+        listings = (
+            TransferList.objects.filter(auction_ends_at__isnull=True)
+            .exclude(player__team=self.team)
+            .select_related("player")
+        )
+        by_position = {}
+        for listing in listings:
+            by_position.setdefault(listing.player.position, []).append(listing)
+        best = None
+        choices = [
+            itertools.combinations(by_position.get(position, []), count)
+            for position, count in counts.items()
+            if count
+        ]
+        for combination in itertools.product(*choices):
+            picked = [listing for group in combination for listing in group]
+            if sum(listing.asking_price for listing in picked) > budget:
+                continue
+            value = sum(listing.player.market_value for listing in picked)
+            best = value if best is None else max(best, value)
+        return best
+
+    def recommend(self, **query):
+        response = self.client.get(self.url, query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_solve_matches_brute_force(self):
+        rng = random.Random(3)
+        for _ in range(30):
+            groups = [
+                (
+                    rng.randint(1, 2),
+                    [
+                        Listing(
+                            rng.randint(1, 50),
+                            0,
+                            str(index),
+                            rng.randint(1, 50),
+                            0,
+                            None,
+                        )
+                        for index in range(rng.randint(1, 7))
+                    ],
+                )
+                for _ in range(rng.randint(1, 3))
+            ]
+            budget = rng.randint(10, 120)
+            picks, optimal = solve(groups, budget)
+            self.assertTrue(optimal)
+            best = None
+            for combination in itertools.product(
+                *[itertools.combinations(listings, count) for count, listings in groups]
+            ):
+                picked = [listing for group in combination for listing in group]
+                if sum(listing.price for listing in picked) <= budget:
+                    value = sum(listing.value for listing in picked)
+                    best = value if best is None else max(best, value)
+            found = None if picks is None else sum(listing.value for listing in picks)
+            self.assertEqual(found, best)
+
+    def test_recommends_best_affordable_players(self):
+        data = self.recommend(attackers=2, defenders=1)
+        best = self.brute_force({"Attacker": 2, "Defender": 1}, self.team.budget)
+        self.assertEqual(data["total_value"], f"$ {best:.2f}")
+        self.assertTrue(data["optimal"])
+        self.assertEqual(len(data["players"]), 3)
+        picked = {player["player_id"] for player in data["players"]}
+        self.assertNotIn(self.players[0].id, picked)
+        self.assertNotIn(self.players2[16].id, picked)
+        self.assertLessEqual(
+            Decimal(data["total_price"].removeprefix("$ ")), self.team.budget
+        )
+
+        # A lower budget, and one above the team's which is capped
+        data = self.recommend(attackers=2, defenders=1, budget="2000000.00")
+        best = self.brute_force({"Attacker": 2, "Defender": 1}, Decimal(2000000))
+        self.assertEqual(data["total_value"], f"$ {best or 0:.2f}")
+        data = self.recommend(midfielders=3, budget="90000000.00")
+        self.assertEqual(data["budget"], f"$ {self.team.budget:.2f}")
+
+    def test_nothing_affordable_or_asked(self):
+        data = self.recommend(goalkeepers=1, budget="1.00")
+        self.assertEqual((data["players"], data["total_price"]), ([], "$ 0.00"))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {"attackers": 6})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Another manager's budget isn't shown
+        token2 = Token.objects.create(user=self.user2)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token2.key)
+        response = self.client.get(self.url, {"attackers": 1})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_follows_market_changes(self):
+        counts = {"Attacker": 2, "Defender": 1}
+        first = self.recommend(attackers=2, defenders=1)
+        hits = recommender.stats()["hits"]
+        self.assertEqual(self.recommend(attackers=2, defenders=1), first)
+        self.assertEqual(recommender.stats()["hits"], hits + 1)
+
+        # Every change spends slack, with none left positions are rebuilt
+        with patch("api.recommender.SLACK", 0):
+            recommender.rebuild()
+            for player in first["players"]:
+                with self.captureOnCommitCallbacks(execute=True):
+                    TransferList.objects.filter(player=player["player_id"]).delete()
+                data = self.recommend(attackers=2, defenders=1)
+                self.assertGreater(data["market_version"], first["market_version"])
+                best = self.brute_force(counts, self.team.budget)
+                self.assertEqual(data["total_value"], f"$ {best or 0:.2f}")
+
+    def test_expired_cache_is_rebuilt_by_one_caller(self):
+        recommender.ensure_built()
+        rebuilds = recommender.stats()["rebuilds"]
+        with override_settings(RECOMMENDER_CACHE_SECONDS=0):
+            # Another request is rebuilding, this one keeps the old cache
+            with recommender._refreshing:
+                data = self.recommend(attackers=1)
+            self.assertEqual(recommender.stats()["rebuilds"], rebuilds)
+            self.assertEqual(len(data["players"]), 1)
+            recommender.ensure_built()
+        self.assertEqual(recommender.stats()["rebuilds"], rebuilds + 1)
+
+
+class PriceSuggestionTest(BaseClassForUnitTest):
+    def setUp(self):
+        super().setUp()  # Inheriting from the Base Class For Unit Test
+        price_index.reset()
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        TransferList.objects.all().delete()
+        rng = random.Random(11)
+        listings = []
+        for player in self.players2[:18]:
+            player.position = rng.choice(["Defender", "Attacker"])
+            player.age = rng.randint(18, 34)
+            player.country = rng.choice(["Spain", "Brazil"])
+            player.market_value = Decimal(rng.randrange(500, 8000) * 1000)
+            player.save()
+            listings.append((player, Decimal(rng.randrange(300, 9000) * 1000)))
+        create_listings(listings, self.user2.username)
+        self.player = self.players[0]
+        self.player.position, self.player.age = "Attacker", 25
+        self.player.country, self.player.market_value = "Spain", Decimal("2000000.00")
+        self.player.save()
+
+    def tearDown(self):
+        price_index.reset()
+        super().tearDown()
+
+    def suggest(self, player=None, **query):
+        player = player or self.player
+        return self.client.get(
+            reverse(
+                "price-suggestion",
+                kwargs={"username": self.user.username, "player_id": player.id},
+            ),
+            query,
+        )
+
+    def brute_force(self, player, k):
+        target = log_value(player.market_value)
+        gaps = []
+        for listing in TransferList.objects.select_related("player"):
+            other = listing.player
+            if other.position == player.position:
+                point = Point(
+                    log_value(other.market_value), other.age, other.country, 0
+                )
+                gaps.append(distance(point, target, player.age, player.country))
+        gaps.sort()
+        return gaps[:k]
+
+    def test_nearest_matches_brute_force(self):
+        rng = random.Random(5)
+        for _ in range(20):
+            self.player.position = rng.choice(["Defender", "Attacker"])
+            self.player.age = rng.randint(16, 38)
+            self.player.country = rng.choice(["Spain", "Brazil", "Ghana"])
+            self.player.market_value = Decimal(rng.randrange(100, 20000) * 1000)
+            k = rng.randint(1, 12)
+            nearest = price_index.nearest(
+                self.player.position,
+                self.player.age,
+                self.player.country,
+                self.player.market_value,
+                k,
+            )
+            self.assertEqual(
+                [round(gap, 9) for gap, _, _ in nearest],
+                [round(gap, 9) for gap in self.brute_force(self.player, k)],
+            )
+
+    def test_suggests_price_range(self):
+        response = self.suggest(k=5)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.data
+        self.assertEqual(data["comparables"], 5)
+        prices = sorted(
+            Decimal(similar["price"].removeprefix("$ ")) for similar in data["similar"]
+        )
+        self.assertEqual(data["suggested_price"], f"$ {prices[2]}")
+        self.assertEqual(
+            data["price_range"], {"low": f"$ {prices[1]}", "high": f"$ {prices[3]}"}
+        )
+        self.assertEqual(
+            [similar["distance"] for similar in data["similar"]],
+            [round(gap, 3) for gap in self.brute_force(self.player, 5)],
+        )
+
+        # No comparables, another team's player, a bad k
+        self.player.position = "Goalkeeper"
+        self.player.save()
+        data = self.suggest().data
+        self.assertEqual((data["comparables"], data["suggested_price"]), (0, None))
+        response = self.suggest(self.players2[0])
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.suggest(k=0)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        token2 = Token.objects.create(user=self.user2)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token2.key)
+        response = self.suggest()
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_leaves_out_own_listing(self):
+        create_listings([(self.player, Decimal("1.00"))], self.user.username)
+        data = self.suggest(k=50).data
+        self.assertNotIn("$ 1.00", [similar["price"] for similar in data["similar"]])
+
+    def test_follows_listings_and_trades(self):
+        price_index.ensure_built()
+        points = price_index.stats()["points"]
+        rebuilds = price_index.stats()["rebuilds"]
+        sold = self.players2[19]
+        sold.position, sold.age, sold.country = "Attacker", 25, "Spain"
+        sold.save()
+        for days_ago in (0, 200):
+            Trade.objects.create(
+                player=sold,
+                seller_team=self.team2,
+                buyer_team=self.team,
+                price=Decimal("4321.00"),
+                value_before=Decimal("2000000.00"),
+                value_after=Decimal("2000000.00"),
+                traded_at=timezone.now() - timedelta(days=days_ago),
+            )
+        delisted = TransferList.objects.first().player_id
+        with self.captureOnCommitCallbacks(execute=True):
+            TransferList.objects.filter(player=delisted).delete()
+        # One listing less, the recent trade more, the old one out of the window
+        self.assertEqual(price_index.stats()["points"], points)
+        self.assertEqual(price_index.stats()["sold"], 1)
+        self.assertEqual(price_index.stats()["rebuilds"], rebuilds)
+        nearest = self.suggest(k=1).data["similar"]
+        self.assertEqual(
+            nearest, [{"distance": 0, "kind": "sold", "price": "$ 4321.00"}]
+        )
+
+    def test_same_value_walks_nearest_ages_first(self):
+        # The default market value everywhere, ages spread over 20 years
+        players = Player.objects.bulk_create(
+            Player(
+                id=uuid.uuid4(),
+                first_name="Same",
+                last_name="Value",
+                country="Spain",
+                age=18 + index % 20,
+                market_value=Decimal("1000000.00"),
+                position="Defender",
+                listing_status="Listed",
+                team=self.team2,
+            )
+            for index in range(200)
+        )
+        TransferList.objects.bulk_create(
+            TransferList(player=player, asking_price=Decimal("1000.00"))
+            for player in players
+        )
+        with patch("api.price_suggestions.distance", wraps=distance) as measured:
+            nearest = price_index.nearest("Defender", 25, "Spain", Decimal(10**6), 5)
+        self.assertEqual([gap for gap, _, _ in nearest], [0] * 5)
+        # The ten players aged 25 at most, not the whole position
+        self.assertLessEqual(measured.call_count, 10)
+
+    def test_change_during_rebuild_is_kept(self):
+        read = TransferList.objects.values_list
+        delisted = TransferList.objects.first().player_id
+
+        def read_then_change(*args, **kwargs):
+            rows = list(read(*args, **kwargs))
+            # Another request commits before the read is swapped in
+            TransferList.objects.filter(player=delisted).delete()
+            market_changed.send(sender=MarketList, player_ids={delisted})
+            return rows
+
+        with patch.object(
+            TransferList.objects, "values_list", side_effect=read_then_change
+        ):
+            price_index.rebuild()
+        self.assertEqual(price_index.stats()["points"], TransferList.objects.count())
+
+    def test_rebuilt_after_cache_seconds(self):
+        price_index.ensure_built()
+        rebuilds = price_index.stats()["rebuilds"]
+        price_index.ensure_built()
+        self.assertEqual(price_index.stats()["rebuilds"], rebuilds)
+        with override_settings(PRICE_SUGGESTION_CACHE_SECONDS=0):
+            price_index.ensure_built()
+        self.assertEqual(price_index.stats()["rebuilds"], rebuilds + 1)
+
+
+""" Test for Listing Expiry """
+
+
+class ListingExpiryTest(BaseClassForUnitTest):
+    def setUp(self):
+        super().setUp()  # Inheriting from the Base Class For Unit Test
+        TransferList.objects.all().delete()
+        MarketStat.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            create_listings(
+                [(player, Decimal("1000.00")) for player in self.players2[:5]],
+                self.user2.username,
+            )
+
+    def expire(self, players, days_ago=1):
+        TransferList.objects.filter(player__in=players).update(
+            expires_at=timezone.now() - timedelta(days=days_ago)
+        )
+
+    def assertStatsMatchListings(self):
+        stats = MarketStat.objects.filter(dimension="position").aggregate(
+            listings=Sum("listings")
+        )
+        self.assertEqual(stats["listings"] or 0, TransferList.objects.count())
+
+    def test_listings_get_an_expiry(self):
+        listing = TransferList.objects.get(player=self.players2[0])
+        self.assertEqual(listing.expires_at - listing.created_at, timedelta(days=30))
+        create_listings(
+            [(self.players2[5], Decimal("1000.00"))],
+            self.user2.username,
+            auction_ends_at=timezone.now() + timedelta(days=1),
+        )
+        self.assertIsNone(TransferList.objects.get(player=self.players2[5]).expires_at)
+        with override_settings(LISTING_TTL_DAYS=None):
+            create_listings([(self.players2[6], Decimal("1.00"))], self.user2.username)
+        self.assertIsNone(TransferList.objects.get(player=self.players2[6]).expires_at)
+
+    def test_sweep_withdraws_expired_listings_in_batches(self):
+        expired = self.players2[:3]
+        self.expire(expired)
+        notified = []
+
+        def listener(sender, player_ids, **kwargs):
+            notified.append(player_ids)
+
+        market_changed.connect(listener)
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                result = ListingSweeper().sweep(batch_size=2)
+        finally:
+            market_changed.disconnect(listener)
+        self.assertEqual(result, {"expired": 3, "conflicts": 0})
+        # One market notification per batch, not per listing
+        self.assertEqual([len(player_ids) for player_ids in notified], [2, 1])
+        self.assertEqual(set().union(*notified), {player.pk for player in expired})
+        self.assertFalse(TransferList.objects.filter(player__in=expired).exists())
+        self.assertEqual(TransferList.objects.count(), 2)
+        for player in expired:
+            player.refresh_from_db()
+            self.assertEqual(player.listing_status, "Not Listed")
+        self.assertStatsMatchListings()
+
+        # Nothing left to expire
+        self.assertEqual(ListingSweeper().sweep()["expired"], 0)
+
+    def test_sweep_statements_dont_grow_with_batch(self):
+        self.expire(self.players2[:1])
+        with CaptureQueriesContext(connection) as one:
+            ListingSweeper().sweep()
+        self.expire(self.players2[1:5])
+        with CaptureQueriesContext(connection) as four:
+            ListingSweeper().sweep()
+        self.assertEqual(len(one), len(four))
+        self.assertFalse(TransferList.objects.exists())
+
+    def test_conflicting_batch_is_rolled_back(self):
+        self.expire(self.players2[:2])
+        with patch("api.listing_expiry.delete_expired", return_value=1):
+            result = ListingSweeper().sweep()
+        self.assertEqual(result, {"expired": 0, "conflicts": MAX_CONFLICTS})
+        self.assertEqual(TransferList.objects.count(), 5)
+        self.assertStatsMatchListings()
+
+    def test_command_and_middleware(self):
+        self.expire(self.players2[:2])
+        out = StringIO()
+        call_command("expire_listings", stdout=out)
+        self.assertIn("Withdrew 2 expired listings", out.getvalue())
+
+        with override_settings(LISTING_SWEEP_INTERVAL=60), patch.object(
+            listing_sweeper, "start"
+        ) as start:
+            self.client.get(reverse("market-list"))
+        start.assert_called_with(60)
+
+
+class ListingExpirySnapshotTest(APITransactionTestCase):
+    # Committing for real, so the market changes reach the snapshot writer
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "market.snapshot")
+        user = CustomUser.objects.create_user(
+            email=test_user["email"],
+            password=test_user["password"],
+            username=test_user["username"],
+            name=test_user["name"],
+        )
+        team = Team.objects.create(
+            owner=user, name=test_user["team_name"], country=test_user["team_country"]
+        )
+        self.players = [
+            Player.objects.create(
+                first_name=fake.first_name(),
+                last_name=fake.last_name(),
+                country=random.choice(COUNTRIES),
+                age=25,
+                position="Defender",
+                team=team,
+            )
+            for _ in range(2)
+        ]
+        for player in self.players:
+            TransferList.objects.create(player=player, asking_price=Decimal("1000.00"))
+        TransferList.objects.filter(player=self.players[0]).update(
+            expires_at=timezone.now() - timedelta(days=1)
+        )
+        market_changed.connect(publish_on_market_change)
+
+    def tearDown(self):
+        market_changed.disconnect(publish_on_market_change)
+        self.directory.cleanup()
+
+    def test_command_leaves_snapshot_up_to_date(self):
+        # The writer thread sleeps far longer than the command runs
+        with override_settings(
+            MARKET_SNAPSHOT_PATH=self.path, MARKET_SNAPSHOT_DELAY=3600
+        ):
+            publish_market_snapshot()
+            call_command("expire_listings", stdout=StringIO())
+            reader = MarketSnapshotReader()
+            self.assertEqual(
+                [row["player_id"] for row in reader.query()], [self.players[1].pk]
+            )
+            self.assertEqual(reader.version, 2)
+
+
 #############################################################################
 #                                  THE END                                  #
 #############################################################################
@@ -11,7 +11,21 @@ from .views import (
     UserDeleteView,
     TransferListView,
     MarketListView,
+    MarketStatsView,
+    LeaderboardView,
+    TeamRankView,
+    RecommendPlayersView,
+    PriceSuggestionView,
     BuyPlayerView,
+    MetricsView,
+    BatchView,
+    BulkBuyPlayerView,
+    PlaceBidView,
+    CancelBidView,
+    TradeHistoryView,
+    BulkListPlayerView,
+    BulkRepricePlayerView,
+    BulkDelistPlayerView,
 )
 
 urlpatterns = [
@@ -37,6 +51,58 @@ urlpatterns = [
         TransferListView.as_view(),
         name="transfer-list",
     ),
+    path(
+        "bulk_list_player/<str:username>/",
+        BulkListPlayerView.as_view(),
+        name="bulk-list-player",
+    ),
+    path(
+        "bulk_reprice_player/<str:username>/",
+        BulkRepricePlayerView.as_view(),
+        name="bulk-reprice-player",
+    ),
+    path(
+        "bulk_delist_player/<str:username>/",
+        BulkDelistPlayerView.as_view(),
+        name="bulk-delist-player",
+    ),
     path("market_list/", MarketListView.as_view(), name="market-list"),
+    path("market_stats/", MarketStatsView.as_view(), name="market-stats"),
+    path("leaderboard/", LeaderboardView.as_view(), name="leaderboard"),
+    path(
+        "leaderboard/rank/<str:username>/",
+        TeamRankView.as_view(),
+        name="team-rank",
+    ),
+    path(
+        "recommend_players/<str:username>/",
+        RecommendPlayersView.as_view(),
+        name="recommend-players",
+    ),
+    path(
+        "price_suggestion/<str:username>/<uuid:player_id>/",
+        PriceSuggestionView.as_view(),
+        name="price-suggestion",
+    ),
     path("buy_player/<str:username>/", BuyPlayerView.as_view(), name="buy-player"),
+    path(
+        "bulk_buy_player/<str:username>/",
+        BulkBuyPlayerView.as_view(),
+        name="bulk-buy-player",
+    ),
+    path("place_bid/<str:username>/", PlaceBidView.as_view(), name="place-bid"),
+    path("cancel_bid/<str:username>/", CancelBidView.as_view(), name="cancel-bid"),
+    path("trades/", TradeHistoryView.as_view(), name="trades"),
+    path(
+        "trades/player/<uuid:player_id>/",
+        TradeHistoryView.as_view(),
+        name="player-trades",
+    ),
+    path(
+        "trades/team/<str:username>/",
+        TradeHistoryView.as_view(),
+        name="team-trades",
+    ),
+    path("metrics/", MetricsView.as_view(), name="metrics"),
+    path("batch/", BatchView.as_view(), name="batch"),
 ]
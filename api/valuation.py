@@ -0,0 +1,173 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Team, Player, Trade
+from .orderbook import in_batches
+from .signals import notify_teams_changed
+
+
+"""
+Batch player valuation. A player is worth the base value times an age
+factor, peaking at `peak_age` and falling off quadratically to
+`age_floor`, times a factor for the position, blended with the average
+price paid for the player over the last `trade_window_days` when it
+was traded. The parameters come from the PLAYER_VALUATION setting.
+
+The engine works a chunk of teams at a time: the players' columns are
+read with one query, priced with lookup tables for the age and
+position factors, and written back with one executemany; the team
+values of the chunk are then recomputed from their players, all in one
+transaction. Players changed by a purchase since they were read keep
+their value.
+"""
+
+DEFAULT_VALUATION = {
+    "base_value": 1000000,
+    "peak_age": 27,
+    "age_curvature": 0.004,
+    "age_floor": 0.4,
+    "position_factors": {
+        "Goalkeeper": 0.8,
+        "Defender": 0.9,
+        "Midfielder": 1.0,
+        "Attacker": 1.2,
+    },
+    "trade_weight": 0.25,
+    "trade_window_days": 90,
+}
+
+MAX_AGE = 100
+MAX_VALUE = 99999999.99  # market_value has 10 digits, 2 of them decimals
+
+
+def valuation_config():
+    return {**DEFAULT_VALUATION, **getattr(settings, "PLAYER_VALUATION", {})}
+
+
+class ValuationModel:
+    def __init__(self, config=None):
+        config = config or valuation_config()
+        self.base_value = float(config["base_value"])
+        self.peak_age = config["peak_age"]
+        self.age_curvature = config["age_curvature"]
+        self.age_floor = config["age_floor"]
+        self.position_factors = {
+            position: float(factor)
+            for position, factor in config["position_factors"].items()
+        }
+        self.trade_weight = config["trade_weight"]
+        self.trade_window = timedelta(days=config["trade_window_days"])
+        # Older players are priced as MAX_AGE
+        self._age_factors = [self.age_factor(age) for age in range(MAX_AGE + 1)]
+
+    def age_factor(self, age):
+        decline = self.age_curvature * (age - self.peak_age) ** 2
+        return max(self.age_floor, 1 - decline)
+
+    def price(self, ages, positions, trade_prices):
+        """
+        Price players given column-wise: ages, positions and average
+        recent trade prices (None when not traded). Returns floats.
+        """
+        by_age, weight = self._age_factors, self.trade_weight
+        by_position = {
+            position: self.base_value * factor
+            for position, factor in self.position_factors.items()
+        }
+        values = [
+            by_position.get(position, self.base_value) * by_age[min(age, MAX_AGE)]
+            for age, position in zip(ages, positions)
+        ]
+        return [
+            min(MAX_VALUE, value if trade is None else value + weight * (trade - value))
+            for value, trade in zip(values, trade_prices)
+        ]
+
+    def recent_trade_prices(self):
+        since = timezone.now() - self.trade_window
+        return {
+            player_id: float(price)
+            for player_id, price in Trade.objects.filter(
+                traded_at__gte=since, player__isnull=False
+            )
+            .values("player")
+            .annotate(price=Avg("price"))
+            .values_list("player", "price")
+        }
+
+
+def team_values():
+    # Sum of the market values of the team's players, 0 without players
+    players = (
+        Player.objects.filter(team=OuterRef("pk"))
+        .values("team")
+        .annotate(total=Sum("market_value"))
+        .values("total")
+    )
+    money = DecimalField(max_digits=10, decimal_places=2)
+    return Coalesce(Subquery(players, output_field=money), Value(0), output_field=money)
+
+
+def revalue_players(model=None, batch_teams=500):
+    """
+    Reprice every player and refresh the team values. Returns the
+    number of players repriced, of teams, and the time it took.
+    """
+    model = model or ValuationModel()
+    started = time.monotonic()
+    trade_prices = model.recent_trade_prices()
+    # Used for every row, so looked up once instead of through django.db.connection
+    db = transaction.get_connection()
+    meta, quote = Player._meta, db.ops.quote_name
+    version = quote(meta.get_field("version").column)
+    update = (
+        f"UPDATE {quote(meta.db_table)} "
+        f"SET {quote(meta.get_field('market_value').column)} = %s, "
+        f"{version} = {version} + 1 "
+        f"WHERE {quote(meta.pk.column)} = %s AND {version} = %s"
+    )
+    prep_pk, cent = meta.pk.get_db_prep_value, Decimal("0.01")
+
+    repriced, teams = 0, 0
+    team_ids = list(Team.objects.order_by("pk").values_list("pk", flat=True))
+    for batch in in_batches(team_ids, batch_teams):
+        with transaction.atomic():
+            rows = list(
+                Player.objects.filter(team__in=batch).values_list(
+                    "pk", "age", "position", "version"
+                )
+            )
+            if rows:
+                ids, ages, positions, versions = zip(*rows)
+                values = model.price(
+                    ages, positions, [trade_prices.get(pk) for pk in ids]
+                )
+                with db.cursor() as cursor:
+                    cursor.executemany(
+                        update,
+                        [
+                            (
+                                Decimal(value).quantize(cent),
+                                prep_pk(pk, db),
+                                row_version,
+                            )
+                            for pk, value, row_version in zip(ids, values, versions)
+                        ],
+                    )
+                repriced += len(rows)
+            values = team_values()
+            Team.objects.filter(pk__in=batch).update(
+                team_value=values, final_value=F("budget") + values
+            )
+            notify_teams_changed(batch)
+        teams += len(batch)
+    return {
+        "players": repriced,
+        "teams": teams,
+        "seconds": time.monotonic() - started,
+    }
@@ -1,5 +1,13 @@
 from rest_framework import generics, status, filters
-from .models import CustomUser, Team, Player, TransferList, MarketList
+from .models import (
+    CustomUser,
+    Team,
+    Player,
+    TransferList,
+    MarketList,
+    Trade,
+    ArchivedTrade,
+)
 from .serializers import (
     UserRegisterSerializer,
     UserLoginSerializer,
@@ -11,15 +19,59 @@ from .serializers import (
     PlayerUpdateSerializer,
     TransferListSerializer,
     MarketListSerializer,
+    MarketListFilterSerializer,
+    MarketStatsQuerySerializer,
+    LeaderboardQuerySerializer,
+    RecommendPlayersQuerySerializer,
+    PriceSuggestionQuerySerializer,
     BuyPlayerSerializer,
+    BulkBuyPlayerSerializer,
+    PlaceBidSerializer,
+    CancelBidSerializer,
+    BulkTransferListSerializer,
+    BulkDelistSerializer,
+    TradeSerializer,
+    BatchSerializer,
 )
 from django.contrib.auth import authenticate
 from rest_framework.authtoken.models import Token
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.views import APIView
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.authentication import TokenAuthentication
-from django.db import IntegrityError
-from .helper import CheckTokenUserMatch, buy_player
+from rest_framework.pagination import CursorPagination
+from django.db import transaction
+from django.http import HttpRequest, QueryDict
+from django.urls import resolve, Resolver404
+from io import BytesIO
+from contextlib import nullcontext
+from operator import attrgetter
+import json
+import time
+from .helper import (
+    CheckTokenUserMatch,
+    CheckUsernameMatch,
+    buy_player,
+    bulk_buy_players,
+    bulk_list_players,
+    bulk_reprice_players,
+    bulk_delist_players,
+    create_listings,
+)
+from .coalesce import CoalescedReadMixin, read_coalescer
+from .idempotency import IdempotentPostMixin, META_KEY as IDEMPOTENCY_META_KEY
+from .market_index import market_index
+from .orderbook import order_book, place_bid, cancel_bid
+from .auctions import auction_closer
+from .listing_expiry import listing_sweeper
+from .market_snapshot import market_snapshot, market_snapshot_writer
+from .market_stats import market_stats
+from .leaderboard import leaderboard
+from .recommender import recommender
+from .price_suggestions import price_index
+from .invalidation import invalidation_bus
+from .metrics import conflict_stats
+from .loaders import EntityLoader
 
 
 # User Register
@@ -97,7 +149,7 @@ class UserListView(generics.ListAPIView):
 # User Details
 
 
-class UserDetailView(generics.RetrieveAPIView):
+class UserDetailView(CoalescedReadMixin, generics.RetrieveAPIView):
     queryset = CustomUser.objects.all()
     serializer_class = UserDetailSerializer
     lookup_field = "username"
@@ -162,68 +214,251 @@ class PlayerUpdateView(generics.UpdateAPIView):
 # Player Transfer List Create
 
 
-class TransferListView(generics.ListCreateAPIView):
+class TransferListView(IdempotentPostMixin, generics.ListCreateAPIView):
     queryset = TransferList.objects.all()
     serializer_class = TransferListSerializer
-    permission_classes = [IsAuthenticated, CheckTokenUserMatch]
+    permission_classes = [IsAuthenticated, CheckUsernameMatch]
     authentication_classes = [TokenAuthentication]
 
     def post(self, request, *args, **kwargs):
         username = self.kwargs["username"]
-        user = CustomUser.objects.get(username=username)
-        team = Team.objects.get(owner=user)
-        serializer = self.serializer_class(data=request.data)
+        serializer = self.serializer_class(
+            data=request.data, context={"request": request}
+        )
         serializer.is_valid(raise_exception=True)
+        # Loaded once with its team, owner and listing by the serializer
         player = serializer.validated_data["player_id"]
-        if not team.players.filter(id=player.id).exists():
+        if player.team.owner.username != username:
             return Response(
                 {"error": "Player does not exist in the team"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        try:
-            transfer_list_entry = serializer.save()
-            MarketList.objects.create(transfer_list=transfer_list_entry)
-        except IntegrityError:
+        transfer_lists = None
+        if EntityLoader.for_request(request).listing(player) is None:
+            transfer_lists = create_listings(
+                [(player, serializer.validated_data["asking_price"])],
+                username,
+                serializer.validated_data.get("auction_ends_at"),
+            )
+        if transfer_lists is None:
             return Response(
                 {
                     "Warning": f"Player *{player.first_name} {player.last_name}* already listed in the transfer list."
                 },
                 status=status.HTTP_400_BAD_REQUEST,
             )
+        serializer.instance = transfer_lists[0]
         return Response(
             serializer.data,
             status=status.HTTP_201_CREATED,
         )
 
 
+# Bulk Transfer List Views
+
+
+class BulkListPlayerView(IdempotentPostMixin, generics.CreateAPIView):
+    serializer_class = BulkTransferListSerializer
+    permission_classes = [IsAuthenticated, CheckUsernameMatch]
+    authentication_classes = [TokenAuthentication]
+    bulk_action = staticmethod(bulk_list_players)
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return self.bulk_action(
+            serializer.validated_data["players"], self.kwargs["username"]
+        )
+
+
+class BulkRepricePlayerView(BulkListPlayerView):
+    bulk_action = staticmethod(bulk_reprice_players)
+
+
+class BulkDelistPlayerView(BulkListPlayerView):
+    serializer_class = BulkDelistSerializer
+    bulk_action = staticmethod(bulk_delist_players)
+
+
 # Market List View
 
 
-class MarketListView(generics.ListAPIView):
+class MarketListView(CoalescedReadMixin, generics.ListAPIView):
     serializer_class = MarketListSerializer
     permission_classes = [IsAuthenticated, CheckTokenUserMatch]
     authentication_classes = [TokenAuthentication]
+    coalesce_per_user = False  # Market data is the same for every manager
     filter_backends = [filters.SearchFilter]
     search_fields = [
-        "transfer_list__player__id",
-        "transfer_list__player__first_name",
-        "transfer_list__player__last_name",
-        "transfer_list__player__country",
-        "transfer_list__player__team__name",
-        "transfer_list__player__position",
-        "transfer_list__asking_price",
+        "player__id",
+        "player__first_name",
+        "player__last_name",
+        "player__country",
+        "player__team__name",
+        "player__position",
+        "asking_price",
     ]
 
+    def get_market_filters(self):
+        serializer = MarketListFilterSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
     def get_queryset(self):
-        return MarketList.objects.all()
+        queryset = MarketList.objects.select_related("player__team")
+        market_filters = self.get_market_filters()
+        if "position" in market_filters:
+            queryset = queryset.filter(player__position=market_filters["position"])
+        if "country" in market_filters:
+            queryset = queryset.filter(player__country=market_filters["country"])
+        if "min_price" in market_filters:
+            queryset = queryset.filter(asking_price__gte=market_filters["min_price"])
+        if "max_price" in market_filters:
+            queryset = queryset.filter(asking_price__lte=market_filters["max_price"])
+        if "ordering" in market_filters:
+            queryset = queryset.order_by(market_filters["ordering"])
+        return queryset
+
+    def get_market_source(self):
+        # Shared mmap snapshot first, then the per-process index
+        if market_snapshot.enabled:
+            return market_snapshot
+        if market_index.enabled:
+            return market_index
+        return None
+
+    def list(self, request, *args, **kwargs):
+        # Free-text search still needs the database, everything else can be
+        # answered from an in-memory market source when one is enabled
+        source = self.get_market_source()
+        if source is None or request.query_params.get("search"):
+            return super().list(request, *args, **kwargs)
+        market_filters = self.get_market_filters()
+        return Response(
+            source.query(
+                position=market_filters.get("position"),
+                country=market_filters.get("country"),
+                min_price=market_filters.get("min_price"),
+                max_price=market_filters.get("max_price"),
+                descending=market_filters.get("ordering") == "-asking_price",
+            )
+        )
+
+
+# Market Statistics View
+
+
+class MarketStatsView(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+
+    def get(self, request):
+        query = MarketStatsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response(
+            market_stats(query.validated_data["days"]), status=status.HTTP_200_OK
+        )
+
+
+# Leaderboard Views
+
+
+class LeaderboardView(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+
+    def get(self, request):
+        query = LeaderboardQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        metric = query.validated_data["metric"]
+        return Response(
+            {
+                "metric": metric,
+                "teams": leaderboard.top(metric, query.validated_data["limit"]),
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class TeamRankView(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+
+    def get(self, request, username):
+        query = LeaderboardQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        metric = query.validated_data["metric"]
+        team_id = (
+            Team.objects.filter(owner__username=username)
+            .values_list("pk", flat=True)
+            .first()
+        )
+        rank = leaderboard.rank(metric, team_id) if team_id is not None else None
+        if rank is None:
+            return Response(
+                {"error": "Team does not exist"}, status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(dict(rank, metric=metric), status=status.HTTP_200_OK)
+
+
+# Squad Recommendation View
+
+
+class RecommendPlayersView(APIView):
+    permission_classes = [IsAuthenticated, CheckUsernameMatch]
+    authentication_classes = [TokenAuthentication]
+
+    def get(self, request, username):
+        query = RecommendPlayersQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        team = (
+            Team.objects.filter(owner__username=username)
+            .values_list("pk", "budget")
+            .first()
+        )
+        if team is None:
+            return Response(
+                {"error": "Team does not exist"}, status=status.HTTP_404_NOT_FOUND
+            )
+        team_id, budget = team
+        budget = min(query.validated_data.get("budget", budget), budget)
+        return Response(
+            recommender.recommend(team_id, budget, query.counts()),
+            status=status.HTTP_200_OK,
+        )
+
+
+# Player Price Suggestion View
+
+
+class PriceSuggestionView(APIView):
+    permission_classes = [IsAuthenticated, CheckUsernameMatch]
+    authentication_classes = [TokenAuthentication]
+
+    def get(self, request, username, player_id):
+        query = PriceSuggestionQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        player = (
+            Player.objects.filter(pk=player_id, team__owner__username=username)
+            .only("position", "age", "country", "market_value")
+            .first()
+        )
+        if player is None:
+            return Response(
+                {"error": "Player does not exist"}, status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(
+            price_index.suggest(player, query.validated_data["k"]),
+            status=status.HTTP_200_OK,
+        )
 
 
 # Player Buy View
 
 
-class BuyPlayerView(generics.CreateAPIView):
+class BuyPlayerView(IdempotentPostMixin, generics.CreateAPIView):
     serializer_class = BuyPlayerSerializer
-    permission_classes = [IsAuthenticated, CheckTokenUserMatch]
+    permission_classes = [IsAuthenticated, CheckUsernameMatch]
     authentication_classes = [TokenAuthentication]
 
     def post(self, request, *args, **kwargs):
@@ -232,11 +467,275 @@ class BuyPlayerView(generics.CreateAPIView):
             data=request.data, context={"request": request}
         )
         serializer.is_valid(raise_exception=True)
-        player = Player.objects.get(id=serializer.validated_data["player_id"])
+        loader = EntityLoader.for_request(request)
+        player = loader.player(serializer.validated_data["player_id"])
         if player.team.owner.username == username:
             return Response(
                 {"message": "You can't buy your own team player."},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        response = buy_player(serializer, username)
+        response = buy_player(serializer, username, loader=loader)
         return response
+
+
+# Bulk Player Buy View
+
+
+class BulkBuyPlayerView(IdempotentPostMixin, generics.CreateAPIView):
+    serializer_class = BulkBuyPlayerSerializer
+    permission_classes = [IsAuthenticated, CheckUsernameMatch]
+    authentication_classes = [TokenAuthentication]
+
+    def post(self, request, *args, **kwargs):
+        username = self.kwargs["username"]
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return bulk_buy_players(
+            serializer.validated_data["purchases"],
+            username,
+            EntityLoader.for_request(request),
+        )
+
+
+# Order Book Bid Views
+
+
+class PlaceBidView(IdempotentPostMixin, generics.CreateAPIView):
+    serializer_class = PlaceBidSerializer
+    permission_classes = [IsAuthenticated, CheckUsernameMatch]
+    authentication_classes = [TokenAuthentication]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.serializer_class(
+            data=request.data, context={"request": request}
+        )
+        serializer.is_valid(raise_exception=True)
+        return place_bid(
+            serializer.validated_data,
+            self.kwargs["username"],
+            EntityLoader.for_request(request),
+        )
+
+
+class CancelBidView(generics.CreateAPIView):
+    serializer_class = CancelBidSerializer
+    permission_classes = [IsAuthenticated, CheckUsernameMatch]
+    authentication_classes = [TokenAuthentication]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.serializer_class(
+            data=request.data, context={"request": request}
+        )
+        serializer.is_valid(raise_exception=True)
+        return cancel_bid(
+            serializer.validated_data,
+            self.kwargs["username"],
+            EntityLoader.for_request(request),
+        )
+
+
+# Trade Ledger Views
+
+
+class TradePagination(CursorPagination):
+    # Newest first by id, every page is a range scan of one index
+    ordering = "-id"
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
+
+
+class TeamTrades:
+    """
+    The trades a team sold or bought, for TradePagination: ordering,
+    cursor filters and the page limit go to each side, a range scan of
+    the seller or buyer index, and the two short lists are merged here.
+    An OR of the two can't be read in id order from either index.
+    """
+
+    def __init__(self, sold, bought, ordering=()):
+        self.model = sold.model
+        self.sold, self.bought, self.ordering = sold, bought, ordering
+
+    def order_by(self, *ordering):
+        return TeamTrades(self.sold, self.bought, ordering)
+
+    def filter(self, *args, **kwargs):
+        return TeamTrades(
+            self.sold.filter(*args, **kwargs),
+            self.bought.filter(*args, **kwargs),
+            self.ordering,
+        )
+
+    def __getitem__(self, index):
+        # The paginator slices from its offset to the end of the page, so
+        # no side can contribute more than the slice's stop
+        trades = {
+            trade.pk: trade
+            for side in (self.sold, self.bought)
+            for trade in side.order_by(*self.ordering)[: index.stop]
+        }
+        trades = list(trades.values())
+        for field in reversed(self.ordering):
+            trades.sort(
+                key=attrgetter(field.lstrip("-")), reverse=field.startswith("-")
+            )
+        return trades[index]
+
+
+class TradeHistoryView(generics.ListAPIView):
+    serializer_class = TradeSerializer
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+    pagination_class = TradePagination
+
+    def get_queryset(self):
+        # ?archived=true pages through trades moved out by archive_trades
+        if self.request.query_params.get("archived") in ("true", "1"):
+            queryset = ArchivedTrade.objects.all()
+        else:
+            queryset = Trade.objects.all()
+        if "player_id" in self.kwargs:
+            queryset = queryset.filter(player_id=self.kwargs["player_id"])
+        if "username" in self.kwargs:
+            team = generics.get_object_or_404(
+                Team.objects.only("pk"), owner__username=self.kwargs["username"]
+            )
+            return TeamTrades(
+                queryset.filter(seller_team=team), queryset.filter(buyer_team=team)
+            )
+        return queryset
+
+
+# Batch View
+
+
+class BatchView(generics.GenericAPIView):
+    serializer_class = BatchSerializer
+    permission_classes = []
+    authentication_classes = [TokenAuthentication]
+    batchable = False
+
+    def build_sub_request(self, operation, user, token):
+        path, _, query = operation["path"].partition("?")
+        body = json.dumps(operation["body"]).encode("utf-8")
+        sub_request = HttpRequest()
+        sub_request.method = operation["method"]
+        sub_request.path = sub_request.path_info = path
+        sub_request.META = {
+            **self.request._request.META,
+            "REQUEST_METHOD": operation["method"],
+            "PATH_INFO": path,
+            "QUERY_STRING": query,
+            "CONTENT_TYPE": "application/json",
+            "CONTENT_LENGTH": str(len(body)),
+        }
+        # The batch's own key must not be reused by its operations
+        sub_request.META.pop(IDEMPOTENCY_META_KEY, None)
+        sub_request.GET = QueryDict(query)
+        sub_request._stream = BytesIO(body)
+        sub_request._read_started = False
+        if user is not None:
+            # Read by DRF's Request, so sub-views skip the token lookup
+            sub_request._force_auth_user = user
+            sub_request._force_auth_token = token
+        return sub_request
+
+    def is_batchable(self, match):
+        # Only the API's own endpoints can be called from a batch
+        view_class = getattr(match.func, "view_class", None)
+        if view_class is None or view_class.__module__ != __name__:
+            return False
+        return getattr(view_class, "batchable", True)
+
+    def run_operation(self, operation, user, token):
+        started = time.perf_counter()
+        result = {"method": operation["method"], "path": operation["path"]}
+        try:
+            match = resolve(operation["path"].partition("?")[0])
+        except Resolver404:
+            match = None
+        if match is None or not self.is_batchable(match):
+            result.update(status=status.HTTP_404_NOT_FOUND, body={"error": "Not found"})
+        else:
+            sub_request = self.build_sub_request(operation, user, token)
+            sub_request.resolver_match = match
+            try:
+                with transaction.atomic():
+                    response = match.func(sub_request, *match.args, **match.kwargs)
+                result.update(
+                    status=response.status_code, body=getattr(response, "data", None)
+                )
+            except Exception as error:
+                result.update(
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    body={"error": str(error)},
+                )
+            result["url_name"] = match.url_name
+        result["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        return result
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        atomic = serializer.validated_data["atomic"]
+        user = request.user if request.user.is_authenticated else None
+        token = request.auth
+        started = time.perf_counter()
+        results = []
+        committed = True
+        with transaction.atomic() if atomic else nullcontext():
+            for operation in serializer.validated_data["operations"]:
+                result = self.run_operation(operation, user, token)
+                results.append(result)
+                url_name = result.pop("url_name", None)
+                if url_name == "user-login" and result["status"] == status.HTTP_200_OK:
+                    # Later operations run as the user who just logged in
+                    token = Token.objects.select_related("user").get(
+                        key=result["body"]["token"]
+                    )
+                    user = token.user
+                if atomic and result["status"] >= status.HTTP_400_BAD_REQUEST:
+                    transaction.set_rollback(True)
+                    committed = False
+                    break
+        return Response(
+            {
+                "atomic": atomic,
+                "committed": committed,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                "results": results,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+# Metrics View (admin only)
+
+
+class MetricsView(APIView):
+    permission_classes = [IsAuthenticated, IsAdminUser]
+    authentication_classes = [TokenAuthentication]
+    batchable = False
+
+    def get(self, request):
+        data = {
+            "coalescing": read_coalescer.stats(),
+            "market_index": market_index.stats(),
+            "market_snapshot": dict(
+                market_snapshot.stats(), writer=market_snapshot_writer.stats()
+            ),
+            "invalidation": invalidation_bus.stats(),
+            "conflicts": conflict_stats.stats(),
+            "order_book": order_book.stats(),
+            "auctions": auction_closer.stats(),
+            "listing_expiry": listing_sweeper.stats(),
+            "leaderboard": leaderboard.stats(),
+            "recommender": recommender.stats(),
+            "price_index": price_index.stats(),
+        }
+        if request.query_params.get("verify") and market_index.built:
+            data["market_index"]["consistency"] = market_index.verify()
+        if request.query_params.get("verify") and leaderboard.built:
+            data["leaderboard"]["mismatches"] = leaderboard.verify()
+        return Response(data, status=status.HTTP_200_OK)